@@ -0,0 +1,201 @@
+# -*- coding: utf-8 -*-
+""" Archive of activities - retention and compaction
+
+The activity table only keeps the recent activities (hot data). Older ones
+are moved to archive segments, one per month: gzip compressed files of
+line delimited JSON (one activity per line) named activities-YYYY-MM.ndjson.gz
+
+Compaction moves the rows in small batches; every batch is appended to its
+segments and deleted in a short transaction of its own, so the table is
+never locked for long and compaction can stop and resume at any time.
+If a run is interrupted between appending and deleting a batch, the batch
+is appended once more by the next run - reading a segment skips duplicates.
+
+The archive is queried much like the activity table: ::
+
+    Activity.archived().filter_by(actor='nick%local').between(start, end)
+"""
+import datetime as dt
+import gzip
+import json
+import os
+import re
+
+from sqlalchemy import select
+
+from enma.database import db
+
+TIMESTAMP_FORMAT = '%Y-%m-%dT%H:%M:%S.%f'
+SEGMENT_PATTERN = re.compile(r'^activities-(\d{4}-\d{2})\.ndjson\.gz$')
+
+
+def _month(timestamp):
+    return timestamp.strftime('%Y-%m')
+
+
+def _encode(row):
+    row = dict(row)
+    row['timestamp'] = row['timestamp'].strftime(TIMESTAMP_FORMAT)
+    return json.dumps(row, sort_keys=True)
+
+
+def _decode(line):
+    row = json.loads(line)
+    row['timestamp'] = dt.datetime.strptime(row['timestamp'],
+                                            TIMESTAMP_FORMAT)
+    return row
+
+
+class ActivityArchive(object):
+    """ The monthly archive segments in a directory
+
+    Args:
+        directory (str): Where the segments are stored, created on demand.
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+
+    def segment_path(self, month):
+        return os.path.join(self.directory,
+                            'activities-{0}.ndjson.gz'.format(month))
+
+    def months(self):
+        """ The months (YYYY-MM) that have a segment - sorted """
+        if not os.path.isdir(self.directory):
+            return []
+        matches = (SEGMENT_PATTERN.match(name)
+                   for name in os.listdir(self.directory))
+        return sorted(match.group(1) for match in matches if match)
+
+    def append(self, rows):
+        """ Append rows (dictionaries of column values) to their segments """
+        if not os.path.isdir(self.directory):
+            os.makedirs(self.directory)
+        by_month = {}
+        for row in rows:
+            by_month.setdefault(_month(row['timestamp']), []).append(row)
+        for month, month_rows in by_month.items():
+            # every append adds a gzip member, gzip reads them as one stream
+            segment = gzip.open(self.segment_path(month), 'ab')
+            try:
+                for row in month_rows:
+                    segment.write(_encode(row) + '\n')
+            finally:
+                segment.close()
+
+    def read(self, month):
+        """ Iterate over the rows of a segment """
+        seen = set()
+        segment = gzip.open(self.segment_path(month), 'rb')
+        try:
+            for line in segment:
+                row = _decode(line)
+                if row['id'] not in seen:
+                    seen.add(row['id'])
+                    yield row
+        finally:
+            segment.close()
+
+    def query(self):
+        return ArchiveQuery(self)
+
+
+class ArchiveQuery(object):
+    """ A query of archived activities
+
+    Mimics the part of the SQLAlchemy query API that is useful for audits.
+    Queries are immutable, each method returns a new query. The activities
+    are returned as (transient) Activity objects in chronological order.
+    """
+
+    def __init__(self, archive, criteria=None, start=None, end=None,
+                 limit=None):
+        self.archive = archive
+        self.criteria = criteria or {}
+        self.start = start
+        self.end = end
+        self._limit = limit
+
+    def _copy(self, **kwargs):
+        values = dict(criteria=self.criteria, start=self.start,
+                      end=self.end, limit=self._limit)
+        values.update(kwargs)
+        return ArchiveQuery(self.archive, **values)
+
+    def filter_by(self, **kwargs):
+        """ Filter by equality of columns, e.g. actor='nick%local' """
+        criteria = dict(self.criteria)
+        criteria.update(kwargs)
+        return self._copy(criteria=criteria)
+
+    def between(self, start=None, end=None):
+        """ Filter by timestamp: start <= timestamp < end """
+        return self._copy(start=start, end=end)
+
+    def limit(self, limit):
+        return self._copy(limit=limit)
+
+    def __iter__(self):
+        from enma.activity.models import Activity
+        count = 0
+        for month in self.archive.months():
+            # skip segments outside of the time range without reading them
+            if self.start and month < _month(self.start):
+                continue
+            if self.end and month > _month(self.end):
+                break
+            for row in self.archive.read(month):
+                if self._limit is not None and count >= self._limit:
+                    return
+                if self._matches(row):
+                    count += 1
+                    yield Activity(**row)
+
+    def _matches(self, row):
+        if self.start and row['timestamp'] < self.start:
+            return False
+        if self.end and row['timestamp'] >= self.end:
+            return False
+        return all(row.get(key) == value
+                   for key, value in self.criteria.items())
+
+    def all(self):
+        return list(self)
+
+    def first(self):
+        for activity in self.limit(1):
+            return activity
+        return None
+
+    def count(self):
+        return sum(1 for _ in self)
+
+
+def compact(archive, before, batch_size=1000, max_batches=None):
+    """ Move activities older than a point in time to the archive
+
+    Args:
+        archive (ActivityArchive): The archive to move the activities to
+        before (datetime): Activities older than this are moved
+        batch_size (int): Number of activities moved per transaction
+        max_batches (int): Stop after this many batches (None: no limit)
+    Returns:
+        int: The number of activities moved
+    """
+    from enma.activity.models import Activity
+    table = Activity.__table__
+    oldest = select([table]).where(table.c.timestamp < before) \
+        .order_by(table.c.timestamp, table.c.id).limit(batch_size)
+    moved = batches = 0
+    while max_batches is None or batches < max_batches:
+        rows = [dict(row) for row in db.session.execute(oldest)]
+        if not rows:
+            break
+        archive.append(rows)
+        db.session.execute(table.delete().where(
+            table.c.id.in_([row['id'] for row in rows])))
+        db.session.commit()
+        moved += len(rows)
+        batches += 1
+    return moved
@@ -0,0 +1,112 @@
+# -*- coding: utf-8 -*-
+""" Streaming export of activities as CSV or NDJSON
+
+The activities are read in batches of plain rows (no ORM objects, no
+identity map) walking along the primary key, so each batch is an index
+range scan and memory stays flat no matter how many rows are exported.
+Each batch is formatted into one chunk of the output.
+"""
+import csv
+import datetime as dt
+import json
+from cStringIO import StringIO
+
+from sqlalchemy import and_, select
+
+from enma.database import db
+from enma.compat import text_type
+
+COLUMNS = ('id', 'timestamp', 'actor', 'category', 'acted_on',
+           'description', 'origin')
+
+MIMETYPES = {
+    'csv': 'text/csv',
+    'ndjson': 'application/x-ndjson',
+}
+
+
+def parse_time(value):
+    """ Parse a point in time given as YYYY-MM-DD or YYYY-MM-DDTHH:MM:SS
+
+    Raises:
+        ValueError: if the value has none of the formats
+    """
+    for time_format in ('%Y-%m-%dT%H:%M:%S', '%Y-%m-%d'):
+        try:
+            return dt.datetime.strptime(value, time_format)
+        except ValueError:
+            pass
+    raise ValueError('Invalid point in time %s' % value)
+
+
+def iter_batches(actor=None, category=None, since=None, until=None,
+                 batch_size=1000):
+    """ Iterate over the matching activities in batches of rows
+
+    Args:
+        actor (str): Only activities of this actor
+        category (str): Only activities of this category (e.g. 'Export')
+        since (datetime): Only activities at or after this point in time
+        until (datetime): Only activities before this point in time
+        batch_size (int): The number of rows per batch
+    """
+    from enma.activity.models import Activity
+    table = Activity.__table__
+    conditions = []
+    if actor:
+        conditions.append(table.c.actor == actor)
+    if category:
+        conditions.append(table.c.category == category)
+    if since:
+        conditions.append(table.c.timestamp >= since)
+    if until:
+        conditions.append(table.c.timestamp < until)
+    columns = [table.c[name] for name in COLUMNS]
+    last_id = 0
+    while True:
+        statement = select(columns) \
+            .where(and_(table.c.id > last_id, *conditions)) \
+            .order_by(table.c.id).limit(batch_size)
+        rows = db.session.execute(statement).fetchall()
+        if not rows:
+            return
+        yield rows
+        last_id = rows[-1].id
+
+
+def _value(value):
+    if isinstance(value, dt.datetime):
+        return value.isoformat()
+    return value
+
+
+def to_dict(row):
+    """ Make a JSON serializable dictionary of an activity row """
+    return dict(zip(COLUMNS, map(_value, row)))
+
+
+def to_csv(batches):
+    """ Format batches of rows as CSV chunks, starting with a header """
+    yield ','.join(COLUMNS) + '\r\n'
+    for rows in batches:
+        chunk = StringIO()
+        writer = csv.writer(chunk)
+        for row in rows:
+            writer.writerow([value.encode('utf-8')
+                             if isinstance(value, text_type) else
+                             _value(value) for value in row])
+        yield chunk.getvalue()
+
+
+def to_ndjson(batches):
+    """ Format batches of rows as NDJSON chunks - one object per line """
+    for rows in batches:
+        yield ''.join(
+            json.dumps(to_dict(row)) + '\n'
+            for row in rows)
+
+
+FORMATTERS = {
+    'csv': to_csv,
+    'ndjson': to_ndjson,
+}
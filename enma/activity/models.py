@@ -9,8 +9,11 @@ from enma.database import (
     SurrogatePK,
 )
 from flask_login import current_user
-from flask import request
+from flask import request, current_app
 from enma.user.models import User, AnonymousUser
+from enma.activity.writer import ActivityWriter
+from enma.activity.archive import ActivityArchive
+from enma.metrics.registry import metrics
 
 """
 Limit the set of possible categories to fixed meaningful subset
@@ -45,6 +48,12 @@ class Activity(SurrogatePK, Model):
     model state changes.
     """
     __tablename__ = 'activities'
+    __table_args__ = (
+        # keyset pagination of all activities and of the activities of a user
+        db.Index('ix_activities_timestamp', 'timestamp'),
+        db.Index('ix_activities_actor_timestamp', 'actor', 'timestamp'),
+        {'extend_existing': True},
+    )
     timestamp = Column(db.DateTime, nullable=False, default=dt.datetime.utcnow)
     actor = Column(db.String(80), nullable=False)
     category = Column(db.String(20), nullable=False, default='')
@@ -55,7 +64,7 @@ class Activity(SurrogatePK, Model):
     def __init__(self, actor, description, category=EMPTY, acted_on='',
                  origin='', **kwargs):
         db.Model.__init__(self, actor=actor, description=description,
-                          category=categories[category],
+                          category=categories.get(category, category),
                           acted_on=acted_on, origin=origin, **kwargs)
 
     def __repr__(self):
@@ -63,20 +72,46 @@ class Activity(SurrogatePK, Model):
                 timestamp=self.timestamp, actor=self.actor,
                 description=self.description)
 
+    @staticmethod
+    def archived():
+        """ Query the archived activities (moved out of the table)
 
-def record(description, category=EMPTY, acted_on=None):
+        Returns:
+            ArchiveQuery: Supports filter_by, between, limit, all, first...
+        """
+        return ActivityArchive(
+            current_app.config['ACTIVITY_ARCHIVE_DIR']).query()
+
+
+# activities are buffered and written in bulk - see enma.activity.writer
+activity_writer = ActivityWriter(Activity.__table__)
+
+activities_recorded = metrics.counter(
+    'enma_activities_recorded_total', 'Activities recorded by category',
+    ('category',))
+metrics.gauge('enma_activities_buffered', 'Activities not written yet',
+              function=lambda: len(activity_writer))
+metrics.gauge('enma_activities_dropped', 'Activities dropped (buffer full'
+              ' or writing failed) since the process started',
+              function=lambda: activity_writer.dropped)
+
+
+def record(description, category=EMPTY, acted_on=None, actor=None):
     """ General recording of an business relevant activity
 
     Determines actor and host automatically; 
     Transforms acted_on to a string (if given)
-    Writes to the activity table
+    Hands the activity over to the activity writer, that writes it to the
+    activity table (immediately in synchronous mode, otherwise in bulk)
 
     Args:
         description (str): The description
         category (str): The category to record - fixed set of values only
         acted_on (str): Optional - the user or users data that is affected.
+        actor (User): Optional - the acting user if not the logged in one,
+            e.g. the authenticated caller of the REST API
     """
-    user = current_user  # get the current user
+    user = actor or current_user  # get the current user
     acted_on_name = ''
     if acted_on and isinstance(acted_on, User):
         acted_on_name = acted_on.username
@@ -84,9 +119,13 @@ def record(description, category=EMPTY, acted_on=None):
     origin = 'not set' 
     if 'REMOTE_ADDR' in request.environ.keys():
         origin = request.environ['REMOTE_ADDR']
-    act = Activity(user.username, description, category, acted_on_name, origin)
-    db.session.add(act)
-    db.session.commit()
+    activity_writer.put(dict(timestamp=dt.datetime.utcnow(),
+                             actor=user.username,
+                             category=categories[category],
+                             acted_on=acted_on_name,
+                             description=description,
+                             origin=origin))
+    activities_recorded.inc((categories[category],))
 
 
 def record_authentication(description='Login'):
@@ -97,9 +136,17 @@ def record_priviledge(acted_on, description='Change'):
     record(description, category=PRIVILEGE, acted_on=acted_on)
 
 
-def record_api(description, acted_on=None):
-    record(description, category=API, acted_on=acted_on)
+def record_api(description, acted_on=None, actor=None):
+    record(description, category=API, acted_on=acted_on, actor=actor)
 
 
 def record_user(description, acted_on=None):
         record(description, category=USER, acted_on=acted_on)
+
+
+def record_import(description='Import', actor=None):
+    record(description, category=IMPORT, actor=actor)
+
+
+def record_export(description='Export'):
+    record(description, category=EXPORT)
@@ -1,10 +1,14 @@
 # -*- coding: utf-8 -*-
 
-from flask import Blueprint, render_template, request
+from flask import Blueprint, render_template, request, current_app
+from flask import Response, abort, stream_with_context
 from flask.ext.login import login_required, current_user
 
-from enma.activity.models import Activity
-from enma.database import db
+from enma.activity.models import Activity, record_export
+from enma.activity import export as activity_export
+from enma.database import db, KeysetPagination
+from enma.decorators import admin_required
+from enma.extensions import cache
 
 
 blueprint = Blueprint("activity", __name__, url_prefix='/activities',
@@ -25,16 +29,62 @@ def home():
         columns.act_on = True
         columns.origin = True
         activities = Activity.query
+        count_key = 'activity-count'
     else:
         activities = Activity.query.filter_by(actor=current_user.username)
-    page = request.args.get('page', 1, type=int)
-    pagination = activities.order_by(Activity.timestamp.desc()).paginate(
-                page, per_page=10, error_out=False)
-    print dir(pagination)
-    return render_template("activities/list.html", 
-                           #activities=activities,
+        count_key = 'activity-count/' + current_user.username
+    pagination = KeysetPagination(activities,
+                                  (Activity.timestamp, Activity.id),
+                                  after=request.args.get('after'),
+                                  before=request.args.get('before'),
+                                  per_page=10)
+    return render_template("activities/list.html",
                            activities=pagination.items,
                            pagination=pagination,
+                           total=estimated_count(activities, count_key),
                            columns=columns)
 
 
+def estimated_count(query, key):
+    """ Count the rows of a query - cached for ACTIVITY_COUNT_CACHE_TTL
+
+    The number is shown for orientation only, so it is fine if it lags
+    behind, but an exact COUNT of the whole table on every page view is not.
+    """
+    count = cache.get(key)
+    if count is None:
+        count = query.order_by(None).count()
+        cache.set(key, count,
+                  timeout=current_app.config['ACTIVITY_COUNT_CACHE_TTL'])
+    return count
+
+
+@blueprint.route("/export")
+@login_required
+@admin_required
+def export():
+    """ Stream the activities as CSV or NDJSON file
+
+    Query parameters: format (csv or ndjson), actor, category, since and
+    until (YYYY-MM-DD or YYYY-MM-DDTHH:MM:SS)
+    """
+    export_format = request.args.get('format', 'csv')
+    if export_format not in activity_export.FORMATTERS:
+        abort(400)
+    try:
+        since, until = [activity_export.parse_time(request.args[name])
+                        if request.args.get(name) else None
+                        for name in ('since', 'until')]
+    except ValueError:
+        abort(400)
+    record_export('Export activities as %s' % export_format)
+    batches = activity_export.iter_batches(
+        actor=request.args.get('actor'),
+        category=request.args.get('category'), since=since, until=until,
+        batch_size=current_app.config['ACTIVITY_EXPORT_BATCH'])
+    chunks = activity_export.FORMATTERS[export_format](batches)
+    response = Response(stream_with_context(chunks),
+                        mimetype=activity_export.MIMETYPES[export_format])
+    response.headers['Content-Disposition'] = \
+        'attachment; filename=activities.%s' % export_format
+    return response
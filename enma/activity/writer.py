@@ -0,0 +1,178 @@
+# -*- coding: utf-8 -*-
+""" Buffered, bulk writing of activities
+
+Recording an activity must not cost an extra write transaction on every
+request. The writer keeps recorded rows in a bounded in-memory buffer and a
+background worker writes them in bulk, either when a batch is complete or
+when the flush interval has elapsed - whatever comes first.
+
+Configuration (read from the application config):
+
+    ACTIVITY_WRITER_SYNC: write every row immediately (tests, debugging)
+    ACTIVITY_QUEUE_SIZE: max. number of buffered rows (bounded memory)
+    ACTIVITY_BATCH_SIZE: rows per bulk insert; a full batch triggers a flush
+    ACTIVITY_FLUSH_INTERVAL: seconds between two flushes of the worker
+    ACTIVITY_OVERFLOW: what to do if the buffer is full
+        'inline' - the caller flushes the buffer itself
+        'block' - wait up to ACTIVITY_BLOCK_TIMEOUT seconds, then drop
+        'drop' - drop the row and count it
+
+Rows of a failed write are kept for the next flush as far as the buffer
+has room, see enma.background. Readers that must not miss a late row ask
+for the timestamp of the oldest row not written yet (pending_since).
+"""
+import logging
+import threading
+from collections import deque
+
+from enma.background import Flusher
+from enma.database import db
+
+logger = logging.getLogger(__name__)
+
+OVERFLOW_POLICIES = ('inline', 'block', 'drop')
+
+
+class ActivityWriter(Flusher):
+    """ Buffer rows of a table and write them in bulk
+
+    Attributes:
+        written (int): Number of rows written to the database
+        dropped (int): Number of rows lost due to overflow (also of the rows
+            of failed writes the full buffer has no room for)
+        failures (int): Number of failed writes
+    """
+    worker_name = 'activity-writer'
+
+    def __init__(self, table, app=None):
+        Flusher.__init__(self)
+        self.table = table
+        self.sync = True
+        self.queue_size = 10000
+        self.batch_size = 500
+        self.flush_interval = 2.0
+        self.overflow = 'inline'
+        self.block_timeout = 1.0
+        self.written = 0
+        self.dropped = 0
+        self._buffer = deque()
+        self._lock = threading.Lock()
+        self._not_full = threading.Condition(self._lock)
+        self._writing = []  # the oldest timestamp of each running flush
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        config = app.config
+        overflow = config.get('ACTIVITY_OVERFLOW', self.overflow)
+        if overflow not in OVERFLOW_POLICIES:
+            raise ValueError('Unknown activity overflow policy %s' % overflow)
+        Flusher.init_app(self, app)
+        self.sync = config.get('ACTIVITY_WRITER_SYNC', self.sync)
+        self.queue_size = config.get('ACTIVITY_QUEUE_SIZE', self.queue_size)
+        self.batch_size = config.get('ACTIVITY_BATCH_SIZE', self.batch_size)
+        self.flush_interval = config.get('ACTIVITY_FLUSH_INTERVAL',
+                                         self.flush_interval)
+        self.overflow = overflow
+        self.block_timeout = config.get('ACTIVITY_BLOCK_TIMEOUT',
+                                        self.block_timeout)
+
+    def __len__(self):
+        return len(self._buffer)
+
+    def put(self, row):
+        """ Record a row (a dictionary of column values)
+
+        In synchronous mode the row is written immediately, otherwise it is
+        buffered until the next flush.
+        """
+        if self.sync:
+            self._write([row])
+            return
+        self.ensure_worker()
+        flush_inline = False
+        with self._lock:
+            if len(self._buffer) >= self.queue_size:
+                if self.overflow == 'block':
+                    self._not_full.wait(self.block_timeout)
+                if len(self._buffer) >= self.queue_size:
+                    if self.overflow != 'inline':
+                        self.dropped += 1
+                        return
+                    flush_inline = True
+            self._buffer.append(row)
+            if len(self._buffer) >= self.batch_size:
+                self._wakeup.set()
+        if flush_inline:
+            self.flush()
+
+    def flush(self):
+        """ Write all buffered rows in bulk - requires an application context
+
+        Stops at the first failed batch and puts its rows and the rest back
+        into the buffer.
+
+        Returns:
+            int: The number of rows written
+        """
+        written = 0
+        with self._lock:
+            rows = list(self._buffer)
+            self._buffer.clear()
+            self._not_full.notify_all()
+            since = _oldest(rows)
+            if since is not None:
+                self._writing.append(since)
+        try:
+            for start in range(0, len(rows), self.batch_size):
+                batch = rows[start:start + self.batch_size]
+                try:
+                    self._write(batch)
+                except Exception:
+                    self.failures += 1
+                    logger.exception('Writing %d activities failed',
+                                     len(batch))
+                    self._keep(rows[start:])
+                    break
+                written += len(batch)
+        finally:
+            if since is not None:
+                with self._lock:
+                    self._writing.remove(since)
+        return written
+
+    def pending_since(self):
+        """ The timestamp of the oldest row not written yet (buffered or
+        being written by this process) or None if all rows are written
+        """
+        with self._lock:
+            pending = list(self._writing)
+            if self._buffer:
+                pending.append(_oldest(self._buffer))
+        return min(pending) if pending else None
+
+    def _keep(self, rows):
+        with self._lock:
+            room = max(self.queue_size - len(self._buffer), 0)
+            self.dropped += max(len(rows) - room, 0)
+            self._buffer.extendleft(reversed(rows[:room]))
+
+    def _write(self, rows):
+        # a transaction of its own - the caller's session (inline overflow,
+        # sync mode) is neither committed nor rolled back;
+        # executemany - collapsed to multi-row INSERTs by e.g. MySQLdb
+        with db.engine.begin() as connection:
+            connection.execute(self.table.insert(), rows)
+        self.written += len(rows)
+
+    def _pending(self):
+        return bool(self._buffer)
+
+    def _forget(self):
+        # forked (e.g. gunicorn worker): the parent owns the rows
+        with self._lock:
+            self._buffer.clear()
+
+
+def _oldest(rows):
+    return min(row['timestamp'] for row in rows) if rows else None
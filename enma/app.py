@@ -13,7 +13,15 @@ from enma.extensions import (
     debug_toolbar,
     mail,
 )
-from enma import public, user, activity, entitlement, rest
+from enma import public, user, activity, entitlement, rest, metrics
+from enma.activity.models import activity_writer
+from enma.user.models import token_cache, identity_cache, role_table
+from enma.user.credentials import credentials
+from enma.user.presence import last_seen
+from enma.instrumentation import query_stats
+from enma.metrics.registry import metrics as metrics_registry
+from enma.entitlement.decisions import decisions
+from enma.entitlement.metering import usage_meter
 from enma.oauth2 import register_oauth_blueprints
 
 
@@ -41,6 +49,16 @@ def register_extensions(app):
     migrate.init_app(app, db)
     mail.init_app(app)
     oauth.init_app(app)
+    activity_writer.init_app(app)
+    token_cache.init_app(app)
+    identity_cache.init_app(app)
+    role_table.init_app(app)
+    credentials.init_app(app)
+    decisions.init_app(app)
+    usage_meter.init_app(app)
+    last_seen.init_app(app)
+    query_stats.init_app(app)
+    metrics_registry.init_app(app)
     return None
 
 
@@ -50,6 +68,7 @@ def register_blueprints(app):
     app.register_blueprint(activity.views.blueprint)
     app.register_blueprint(entitlement.views.blueprint)
     app.register_blueprint(rest.api)
+    app.register_blueprint(metrics.views.blueprint)
     register_oauth_blueprints(app)
     return None
 
@@ -0,0 +1,130 @@
+# -*- coding: utf-8 -*-
+"""Work buffered in memory and flushed by a background thread.
+
+The activity writer, the usage meter, the last seen tracker and the
+metrics registry collect in memory what the request threads record and
+write it from a background thread: every flush interval or earlier when
+woken up. Flusher is the common part:
+
+* the worker thread is started on demand, by ensure_worker
+* a forked process (e.g. a gunicorn worker) forgets what it inherited -
+  the parent process flushes its own state - and starts its own worker
+* at exit the worker is stopped and the rest is flushed
+
+Failure policy: flush keeps what could not be written for the next flush
+(bounded by the buffer of the subclass) and counts the failure.
+"""
+import atexit
+import logging
+import os
+import threading
+
+from enma.database import db
+
+logger = logging.getLogger(__name__)
+
+
+class Flusher(object):
+    """ Base of the buffers flushed by a background thread
+
+    Subclasses implement flush() (called with an application context),
+    _pending() (is there anything to flush) and _forget() (drop the state
+    inherited from the parent process).
+
+    Attributes:
+        flush_interval (float): Seconds between two flushes of the worker
+        failures (int): Number of failed flushes (the work is kept)
+    """
+    #: name of the worker thread
+    worker_name = 'flusher'
+
+    def __init__(self):
+        self.app = None
+        self.flush_interval = 1.0
+        self.failures = 0
+        self._wakeup = threading.Event()
+        self._worker = None
+        self._worker_lock = threading.Lock()
+        self._pid = os.getpid()
+        self._stopped = False
+        self._atexit = False
+
+    def init_app(self, app):
+        self.app = app
+        if not self._atexit:
+            atexit.register(self.shutdown)
+            self._atexit = True
+
+    def flush(self):
+        raise NotImplementedError
+
+    def _pending(self):
+        raise NotImplementedError
+
+    def _forget(self):
+        raise NotImplementedError
+
+    def _background(self):
+        """ Whether a worker thread is wanted at all """
+        return True
+
+    def wakeup(self):
+        """ Let the worker flush now """
+        self._wakeup.set()
+
+    def ensure_worker(self):
+        """ Start the worker unless it runs - cheap, call it when recording
+
+        A forked process forgets the state of its parent first.
+        """
+        pid = os.getpid()
+        if pid == self._pid and (self._running() or not self._background()):
+            return
+        with self._worker_lock:
+            if pid != self._pid:
+                # forked (e.g. gunicorn worker): the parent owns the state
+                self._forget()
+                self._pid = pid
+                self._worker = None
+            if not self._running() and self._background():
+                self._start_worker()
+
+    def shutdown(self):
+        """ Stop the worker and flush what is left """
+        self._stopped = True
+        self._wakeup.set()
+        if self._worker is not None and self._pid == os.getpid():
+            self._worker.join(self.flush_interval + 1)
+        self._worker = None
+        if self._pending():
+            self._flush_now()
+        self._stopped = False
+
+    def _running(self):
+        return self._worker is not None and self._worker.is_alive()
+
+    def _start_worker(self):
+        self._worker = threading.Thread(target=self._run,
+                                        name=self.worker_name)
+        self._worker.daemon = True
+        self._worker.start()
+
+    def _flush_now(self):
+        if self.app is None:
+            return
+        with self.app.app_context():
+            try:
+                self.flush()
+            finally:
+                db.session.remove()
+
+    def _run(self):
+        while not self._stopped:
+            self._wakeup.wait(self.flush_interval)
+            self._wakeup.clear()
+            if not self._pending():
+                continue
+            try:
+                self._flush_now()
+            except Exception:
+                logger.exception('Flush of the %s failed', self.worker_name)
@@ -0,0 +1,96 @@
+# -*- coding: utf-8 -*-
+"""In-process caches with a bounded size and a time to live.
+
+The caches live in the memory of a single (gunicorn) worker process. They
+are meant for hot, read mostly data; every entry expires after a short time
+so stale data is bounded even if an invalidation happened in another
+worker process.
+"""
+import threading
+import time
+from collections import OrderedDict
+
+
+class TTLCache(object):
+    """ A thread safe, size bounded LRU cache whose entries expire
+
+    The cache is configured from the application config by prefix, e.g. the
+    prefix 'AUTH_TOKEN_CACHE' reads AUTH_TOKEN_CACHE_SIZE (max. number of
+    entries, 0 disables the cache) and AUTH_TOKEN_CACHE_TTL (seconds).
+
+    Attributes:
+        hits (int): Number of successful lookups
+        misses (int): Number of lookups without (valid) entry
+        evictions (int): Number of entries removed to make room
+        expirations (int): Number of entries removed because they expired
+    """
+
+    def __init__(self, prefix, maxsize=1024, ttl=60, app=None):
+        self.prefix = prefix
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = self.misses = self.evictions = self.expirations = 0
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.maxsize = app.config.get(self.prefix + '_SIZE', self.maxsize)
+        self.ttl = app.config.get(self.prefix + '_TTL', self.ttl)
+        self.clear()
+
+    def __len__(self):
+        return len(self._data)
+
+    def __contains__(self, key):
+        return self.get(key) is not None
+
+    def get(self, key, default=None):
+        """ Lookup a key, returns the default if missing or expired """
+        with self._lock:
+            entry = self._data.pop(key, None)
+            if entry is None:
+                self.misses += 1
+                return default
+            expires, value = entry
+            if expires < time.time():
+                self.expirations += 1
+                self.misses += 1
+                return default
+            self._data[key] = entry  # most recently used
+            self.hits += 1
+            return value
+
+    def set(self, key, value, ttl=None):
+        """ Store a value
+
+        Args:
+            ttl (float): Optional time to live in seconds, it never exceeds
+              the configured time to live of the cache.
+        """
+        if self.maxsize <= 0:
+            return
+        ttl = self.ttl if ttl is None else min(ttl, self.ttl)
+        with self._lock:
+            self._data.pop(key, None)
+            while len(self._data) >= self.maxsize:
+                self._data.popitem(last=False)
+                self.evictions += 1
+            self._data[key] = (time.time() + ttl, value)
+
+    def pop(self, key, default=None):
+        """ Remove an entry and return its value """
+        with self._lock:
+            entry = self._data.pop(key, None)
+        return default if entry is None else entry[1]
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def stats(self):
+        """ The cache statistics as dictionary """
+        return {'size': len(self._data), 'maxsize': self.maxsize,
+                'hits': self.hits, 'misses': self.misses,
+                'evictions': self.evictions, 'expirations': self.expirations}
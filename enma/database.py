@@ -2,6 +2,11 @@
 """Database module, including the SQLAlchemy database object and DB-related
 utilities.
 """
+import base64
+import datetime as dt
+import json
+
+from sqlalchemy import and_, or_
 from sqlalchemy.orm import relationship
 
 from .extensions import db
@@ -74,4 +79,106 @@ def ReferenceCol(tablename, nullable=False, pk_name='id', **kwargs):
     """
     return db.Column(
         db.ForeignKey("{0}.{1}".format(tablename, pk_name)),
-        nullable=nullable, **kwargs)
\ No newline at end of file
+        nullable=nullable, **kwargs)
+
+
+class KeysetPagination(object):
+    """Cursor (keyset) based pagination.
+
+    Instead of skipping rows with OFFSET, a page is selected by the position
+    of its last (or first) row in a unique ordering like (timestamp, id).
+    An index on the ordering columns seeks to that position directly, so
+    deep pages are as cheap as the first one and no COUNT is needed.
+
+    The position is handed to the client as an opaque cursor string.
+
+    Usage: ::
+
+        pagination = KeysetPagination(Activity.query,
+                                      (Activity.timestamp, Activity.id),
+                                      after=request.args.get('after'))
+
+    :param query: The query to paginate, it must not be ordered.
+    :param columns: The ordering columns, the last one must be unique.
+    :param after: Cursor - the page starts after this position.
+    :param before: Cursor - the page ends before this position.
+    :param per_page: Number of items per page.
+    :param descending: Order direction of all columns.
+
+    The decoded position of the cursor is kept as ``cursor`` - None if no
+    or an invalid cursor was given.
+    """
+    DATETIME_FORMAT = '%Y-%m-%dT%H:%M:%S.%f'
+
+    def __init__(self, query, columns, after=None, before=None, per_page=20,
+                 descending=True):
+        self.columns = columns
+        self.per_page = per_page
+        backwards = before is not None and after is None
+        cursor = self.decode(before if backwards else after)
+        self.cursor = cursor
+        desc = descending != backwards
+        if cursor is not None:
+            query = query.filter(self._beyond(cursor, desc))
+        order = [column.desc() if desc else column.asc()
+                 for column in columns]
+        items = query.order_by(*order).limit(per_page + 1).all()
+        more = len(items) > per_page
+        items = items[:per_page]
+        if backwards:
+            items.reverse()
+            self.has_prev, self.has_next = more, cursor is not None
+        else:
+            self.has_prev, self.has_next = cursor is not None, more
+        self.items = items
+
+    @property
+    def next_cursor(self):
+        """The cursor of the next page or None if there is none"""
+        if self.has_next and self.items:
+            return self.encode(self.items[-1])
+        return None
+
+    @property
+    def prev_cursor(self):
+        """The cursor of the previous page or None if there is none"""
+        if self.has_prev and self.items:
+            return self.encode(self.items[0])
+        return None
+
+    def encode(self, item):
+        """Make the cursor of the position of an item (entity or row)"""
+        values = []
+        for column in self.columns:
+            value = getattr(item, column.key)
+            if isinstance(value, dt.datetime):
+                value = value.strftime(self.DATETIME_FORMAT)
+            values.append(value)
+        return base64.urlsafe_b64encode(json.dumps(values))
+
+    def decode(self, cursor):
+        """Get the position of a cursor or None if it is not valid"""
+        if not cursor:
+            return None
+        try:
+            values = json.loads(base64.urlsafe_b64decode(str(cursor)))
+            if len(values) != len(self.columns):
+                return None
+            return [self._parse(column, value)
+                    for column, value in zip(self.columns, values)]
+        except (TypeError, ValueError):
+            return None
+
+    def _parse(self, column, value):
+        if column.type.python_type is dt.datetime:
+            return dt.datetime.strptime(value, self.DATETIME_FORMAT)
+        return column.type.python_type(value)
+
+    def _beyond(self, cursor, desc):
+        # (a, b) < (x, y)  <=>  a < x or (a = x and b < y)
+        clauses = []
+        for i, column in enumerate(self.columns):
+            equal = [c == v for c, v in zip(self.columns[:i], cursor[:i])]
+            beyond = column < cursor[i] if desc else column > cursor[i]
+            clauses.append(and_(*(equal + [beyond])))
+        return or_(*clauses)
@@ -1,3 +1,3 @@
 # -*- coding: utf-8 -*-
 """ The Entitlements Package """
-from . import views
+from . import models, views
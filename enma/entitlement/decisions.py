@@ -0,0 +1,179 @@
+# -*- coding: utf-8 -*-
+"""
+Module: In-process cache of entitlement decisions
+
+Services check an entitlement before almost every billable operation, so
+the decision for (user, entitlement name) is kept in memory:
+
+* the cache is pre-warmed with the valid entitlements at the first request
+* an entry expires at the expiry of its entitlement, at the latest after
+  ENTITLEMENT_CACHE_TTL seconds
+* negative decisions are cached as well, so unknown names are cheap
+* inserting, updating or deleting an entitlement (ORM) invalidates the
+  decision at once - at flush and again after the commit, so a decision
+  read by a concurrent request meanwhile does not survive.
+  The invalidation reaches the cache of this worker process only: the
+  other processes (and bulk updates by plain SQL) are seen after at most
+  ENTITLEMENT_CACHE_TTL seconds, so keep it short (default 5)
+"""
+import datetime as dt
+import logging
+from collections import namedtuple
+
+from sqlalchemy import event, inspect
+from sqlalchemy.exc import SQLAlchemyError
+from sqlalchemy.orm import Session, object_session
+
+from enma.caching import TTLCache
+from enma.entitlement.models import Entitlement
+
+_PENDING = 'entitlement_decisions'
+
+
+class Decision(namedtuple('Decision',
+                          'granted capacity expiry entitlement id')):
+    """ The decision on an entitlement of a user
+
+    Attributes:
+        granted (boolean): The user holds a valid entitlement of the name
+        capacity (int): Its capacity (None: unlimited)
+        expiry (timestamp): Its expiry (None: never)
+        entitlement (dict): Its REST representation, None if not granted
+        id (int): Its id, None if not granted
+    """
+    __slots__ = ()
+
+    @classmethod
+    def of(cls, entitlement):
+        if entitlement is None:
+            return DENIED
+        return cls(True, entitlement.capacity, entitlement.expiry,
+                   entitlement.to_dict(), entitlement.id)
+
+DENIED = Decision(False, None, None, None, None)
+
+
+class DecisionCache(object):
+    """ Cache of entitlement decisions keyed by (user id, name)
+
+    Configuration (read from the application config):
+
+        ENTITLEMENT_CACHE_SIZE, ENTITLEMENT_CACHE_TTL: see TTLCache
+    """
+
+    def __init__(self, app=None):
+        self.cache = TTLCache('ENTITLEMENT_CACHE', maxsize=100000, ttl=5)
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.cache.init_app(app)
+        app.before_first_request(self._warm_up)
+
+    def decide(self, user_id, name):
+        """ Decide whether a user holds a valid entitlement of a name
+
+        Returns:
+            Decision: The (cached) decision
+        """
+        key = (user_id, name)
+        decision = self.cache.get(key)
+        if decision is None:
+            decision = Decision.of(Entitlement.valid(user_id, name)
+                                   .order_by(Entitlement.id).first())
+            self._set(key, decision)
+        return decision
+
+    def decide_many(self, user_ids, names):
+        """ Decide on several entitlements of several users at once
+
+        The decisions that are not cached are made by a single query.
+
+        Returns:
+            dict: (user id, name) -> Decision
+        """
+        keys = [(user_id, name) for user_id in user_ids for name in names]
+        result = dict((key, self.cache.get(key)) for key in keys)
+        missing = [key for key, decision in result.items() if decision is None]
+        if missing:
+            now = dt.datetime.utcnow()
+            valid = Entitlement.granted(now) \
+                .filter(Entitlement.user_id.in_(
+                    set(user_id for user_id, _ in missing))) \
+                .filter(Entitlement.name.in_(set(name for _, name in missing)))
+            for entitlement in valid.order_by(Entitlement.id):
+                key = (entitlement.user_id, entitlement.name)
+                if key in result and result[key] is None:
+                    result[key] = Decision.of(entitlement)
+            for key in missing:
+                if result[key] is None:
+                    result[key] = DENIED
+                self._set(key, result[key], now)
+        return result
+
+    def invalidate(self, user_id, name):
+        """ Forget the decision on an entitlement of a user """
+        self.cache.pop((user_id, name))
+
+    def stats(self):
+        """ The cache statistics as dictionary """
+        return self.cache.stats()
+
+    def _set(self, key, decision, now=None):
+        ttl = None
+        if decision.expiry is not None:
+            now = now or dt.datetime.utcnow()
+            ttl = max(0, (decision.expiry - now).total_seconds())
+        self.cache.set(key, decision, ttl)
+
+    def _warm_up(self):
+        """ Load the decisions of the valid entitlements of all users """
+        now = dt.datetime.utcnow()
+        try:
+            valid = Entitlement.granted(now) \
+                .filter(Entitlement.user_id != None) \
+                .order_by(Entitlement.id).limit(self.cache.maxsize)
+            seen = set()
+            for entitlement in valid:
+                key = (entitlement.user_id, entitlement.name)
+                if key not in seen:  # the first one is decided on
+                    seen.add(key)
+                    self._set(key, Decision.of(entitlement), now)
+        except SQLAlchemyError:
+            logging.getLogger(__name__).exception(
+                'Loading entitlement decisions failed')
+
+
+#: (user id, entitlement name) -> Decision
+decisions = DecisionCache()
+
+
+def _keys(target):
+    """ The decision keys an entitlement affects - before and after """
+    names = set([target.name])
+    names.update(inspect(target).attrs.name.history.deleted or ())
+    return set((user_id, name) for user_id in target.user_ids()
+               for name in names)
+
+
+@event.listens_for(Entitlement, 'after_insert')
+@event.listens_for(Entitlement, 'after_update')
+@event.listens_for(Entitlement, 'after_delete')
+def _entitlement_changed(mapper, connection, target):
+    keys = _keys(target)
+    for key in keys:
+        decisions.invalidate(*key)
+    session = object_session(target)
+    if session is not None:
+        session.info.setdefault(_PENDING, set()).update(keys)
+
+
+@event.listens_for(Session, 'after_commit')
+def _invalidate_committed(session):
+    for key in session.info.pop(_PENDING, ()):
+        decisions.invalidate(*key)
+
+
+@event.listens_for(Session, 'after_soft_rollback')
+def _forget_pending(session, previous_transaction):
+    session.info.pop(_PENDING, None)
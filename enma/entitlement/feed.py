@@ -0,0 +1,169 @@
+# -*- coding: utf-8 -*-
+"""
+Module: Change feed of the entitlements of a user
+
+Instead of polling the entitlements, clients wait for their changes - as
+server-sent events or by long polling (see the REST views):
+
+* granting, revoking or changing an entitlement (ORM) publishes an event
+  to the in-process channel of the entitled user after the commit
+* the expiry of an entitlement is no change in the database, the feed
+  watches the expiries of the valid entitlements and reports them itself
+* every answer carries the entitlement version of the user (see
+  Entitlement.version), it also changes by changes made in other worker
+  processes - a client seeing a new version without event resynchronizes
+* the feed reads on connections of its own, taken for a read only, so the
+  session of the request is left alone and no connection is held while
+  waiting
+"""
+import datetime as dt
+import json
+import time
+
+from sqlalchemy import event, inspect
+from sqlalchemy.orm import Session, object_session
+
+from enma.database import db
+from enma.entitlement.models import Entitlement
+from enma.pubsub import PubSub
+
+_PENDING = 'entitlement_events'
+
+GRANTED = 'granted'
+REVOKED = 'revoked'
+EXPIRED = 'expired'
+RESYNC = 'resync'
+HEARTBEAT = 'heartbeat'
+
+#: the channels of the entitlement events, one per user
+events = PubSub()
+
+
+def channel(user_id):
+    return 'entitlements:{0}'.format(user_id)
+
+
+def _event(kind, name, expiry=None):
+    return {'type': kind, 'name': name,
+            'expiry': expiry.isoformat() if expiry else None}
+
+
+class Feed(object):
+    """ The entitlement events of a user from now on - close it when done
+
+    Args:
+        user_id (int): The user whose entitlements are watched
+    """
+
+    def __init__(self, user_id):
+        self.user_id = user_id
+        self.subscription = events.subscribe(channel(user_id))
+        self._expiring = self._load_expiring()
+
+    def close(self):
+        self.subscription.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def version(self):
+        """ The current entitlement version of the user """
+        with db.engine.connect() as connection:
+            return Entitlement.version(self.user_id, connection)
+
+    def wait(self, timeout):
+        """ Wait for the next events
+
+        Returns:
+            list: The events, empty if there was none within the timeout
+        """
+        deadline = time.time() + timeout
+        while True:
+            now = dt.datetime.utcnow()
+            expired = [_event(EXPIRED, name, expiry)
+                       for expiry, name in self._expiring if expiry <= now]
+            if expired:
+                self._expiring = self._expiring[len(expired):]
+                return expired
+            if self.subscription.overflowed:
+                self.subscription.overflowed = False
+                return [_event(RESYNC, None)]
+            remaining = deadline - time.time()
+            if self._expiring:
+                remaining = min(remaining, (self._expiring[0][0] -
+                                            now).total_seconds())
+            if remaining > 0:
+                message = self.subscription.get(remaining)
+            else:
+                message = self.subscription.get_nowait()
+            if message is not None:
+                messages = [message]
+                message = self.subscription.get_nowait()
+                while message is not None:
+                    messages.append(message)
+                    message = self.subscription.get_nowait()
+                self._expiring = self._load_expiring()
+                return messages
+            if time.time() >= deadline:
+                return []
+
+    def stream(self, duration, heartbeat):
+        """ Server-sent events for duration seconds, then the client is
+        expected to reconnect. Without events a heartbeat is sent every
+        heartbeat seconds.
+        """
+        try:
+            yield 'retry: 1000\n\n'
+            end = time.time() + duration
+            while time.time() < end:
+                found = self.wait(min(heartbeat, max(0, end - time.time())))
+                version = self.version()
+                for found_event in found or [_event(HEARTBEAT, None)]:
+                    found_event['version'] = version
+                    yield 'event: {0}\ndata: {1}\n\n'.format(
+                        found_event['type'], json.dumps(found_event))
+        finally:
+            self.close()
+
+    def _load_expiring(self):
+        """ (expiry, name) of the valid entitlements that expire - sorted """
+        query = Entitlement.valid(self.user_id) \
+            .filter(Entitlement.expiry != None) \
+            .with_entities(Entitlement.expiry, Entitlement.name)
+        with db.engine.connect() as connection:
+            return sorted((expiry, name) for expiry, name
+                          in connection.execute(query.statement))
+
+
+@event.listens_for(Entitlement, 'after_insert')
+@event.listens_for(Entitlement, 'after_update')
+@event.listens_for(Entitlement, 'after_delete')
+def _entitlement_changed(mapper, connection, target):
+    session = object_session(target)
+    if session is None:
+        return
+    pending = session.info.setdefault(_PENDING, [])
+    deleted = target in session.deleted
+    renamed = inspect(target).attrs.name.history.deleted or ()
+    for user_id in target.user_ids():
+        for name in renamed:
+            pending.append((user_id, _event(REVOKED, name)))
+        if not deleted and user_id == target.user_id and target.is_valid:
+            pending.append((user_id, _event(GRANTED, target.name,
+                                            target.expiry)))
+        else:
+            pending.append((user_id, _event(REVOKED, target.name)))
+
+
+@event.listens_for(Session, 'after_commit')
+def _publish_committed(session):
+    for user_id, change in session.info.pop(_PENDING, ()):
+        events.publish(channel(user_id), change)
+
+
+@event.listens_for(Session, 'after_soft_rollback')
+def _forget_pending(session, previous_transaction):
+    session.info.pop(_PENDING, None)
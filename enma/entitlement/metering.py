@@ -0,0 +1,189 @@
+# -*- coding: utf-8 -*-
+""" Metering of the consumed capacity of entitlements
+
+Clients report usage at a high rate, so recording usage must neither cost
+a write transaction nor lock the row of an entitlement:
+
+* usage is added to in-memory counters, striped by thread, so concurrent
+  requests do not contend for one lock
+* a background worker flushes the aggregated counters every
+  ENTITLEMENT_USAGE_FLUSH_INTERVAL seconds - one UPDATE per entitlement
+  and flush, not per report
+* every process adds to a shard row of its own (pid modulo
+  ENTITLEMENT_USAGE_SHARDS), so processes do not contend for a row either
+* the used capacity is the sum of the shards (cached for at most
+  ENTITLEMENT_USAGE_CACHE_TTL seconds) plus the counters of this process,
+  so the usage reported by other processes shows up with a bounded delay
+
+Configuration (read from the application config):
+
+    ENTITLEMENT_USAGE_SYNC: write every report immediately (tests)
+    ENTITLEMENT_USAGE_SHARDS: shard rows per entitlement
+    ENTITLEMENT_USAGE_FLUSH_INTERVAL: seconds between two flushes
+    ENTITLEMENT_USAGE_CACHE_SIZE, ENTITLEMENT_USAGE_CACHE_TTL: the cache of
+        the sums of the shards, see TTLCache
+"""
+import itertools
+import logging
+import os
+import threading
+from collections import defaultdict
+
+from sqlalchemy import and_, func
+from sqlalchemy.exc import IntegrityError
+
+from enma.background import Flusher
+from enma.caching import TTLCache
+from enma.database import db
+from enma.entitlement.models import EntitlementUsage
+
+logger = logging.getLogger(__name__)
+
+STRIPES = 16
+
+# threads take the stripes in turn (thread idents are page aligned
+# addresses, ident % STRIPES would put all threads on one stripe)
+_stripe_numbers = itertools.count()
+
+
+class UsageMeter(Flusher):
+    """ Count the consumed capacity of entitlements and write it in bulk
+
+    Attributes:
+        flushes (int): Number of flushes that wrote usage
+        failures (int): Number of failed writes (the usage is kept)
+    """
+    worker_name = 'usage-meter'
+
+    def __init__(self, app=None):
+        Flusher.__init__(self)
+        self.sync = True
+        self.shards = 8
+        self.totals = TTLCache('ENTITLEMENT_USAGE_CACHE', maxsize=100000,
+                               ttl=5)
+        self.flushes = 0
+        self._stripes = [(threading.Lock(), defaultdict(int))
+                         for _ in range(STRIPES)]
+        self._local = threading.local()
+        self._flushing = {}
+        self._flush_lock = threading.Lock()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        config = app.config
+        Flusher.init_app(self, app)
+        self.sync = config.get('ENTITLEMENT_USAGE_SYNC', self.sync)
+        self.shards = config.get('ENTITLEMENT_USAGE_SHARDS', self.shards)
+        self.flush_interval = config.get('ENTITLEMENT_USAGE_FLUSH_INTERVAL',
+                                         self.flush_interval)
+        self.totals.init_app(app)
+
+    def record(self, entitlement_id, amount=1):
+        """ Add to the consumed capacity of an entitlement """
+        if self.sync:
+            self._write({entitlement_id: amount})
+            self._forget_totals([entitlement_id])
+            return
+        self.ensure_worker()
+        lock, counts = self._stripe()
+        with lock:
+            counts[entitlement_id] += amount
+
+    def _stripe(self):
+        """ The (lock, counts) of the current thread """
+        stripe = getattr(self._local, 'stripe', None)
+        if stripe is None:
+            stripe = self._local.stripe = \
+                self._stripes[next(_stripe_numbers) % STRIPES]
+        return stripe
+
+    def pending(self, entitlement_id):
+        """ The usage recorded by this process but not yet written """
+        return self._flushing.get(entitlement_id, 0) + \
+            sum(counts.get(entitlement_id, 0) for _, counts in self._stripes)
+
+    def used(self, entitlement_id):
+        """ The consumed capacity of an entitlement (bounded staleness) """
+        total = self.totals.get(entitlement_id)
+        if total is None:
+            total = db.session.query(func.sum(EntitlementUsage.used)) \
+                .filter(EntitlementUsage.entitlement_id == entitlement_id) \
+                .scalar() or 0
+            self.totals.set(entitlement_id, total)
+        return total + self.pending(entitlement_id)
+
+    def flush(self):
+        """ Write the counted usage in bulk - requires an application context
+
+        Returns:
+            int: The number of entitlements whose usage was written
+        """
+        with self._flush_lock:
+            deltas = defaultdict(int)
+            for lock, counts in self._stripes:
+                with lock:
+                    for entitlement_id, amount in counts.items():
+                        deltas[entitlement_id] += amount
+                    counts.clear()
+            if not deltas:
+                return 0
+            self._flushing = deltas
+            try:
+                self._write(deltas)
+            except Exception:
+                self.failures += 1
+                logger.exception('Writing the usage of %d entitlements '
+                                 'failed', len(deltas))
+                lock, counts = self._stripes[0]
+                with lock:  # keep the usage for the next flush
+                    for entitlement_id, amount in deltas.items():
+                        counts[entitlement_id] += amount
+                return 0
+            finally:
+                self._flushing = {}
+            self._forget_totals(deltas)
+            self.flushes += 1
+            return len(deltas)
+
+    def _pending(self):
+        return any(counts for _, counts in self._stripes)
+
+    def _forget(self):
+        # forked (e.g. gunicorn worker): the parent owns the counts
+        with self._flush_lock:
+            for lock, counts in self._stripes:
+                with lock:
+                    counts.clear()
+
+    def _write(self, deltas):
+        # a transaction of its own - the caller's session (sync mode) is
+        # neither committed nor rolled back
+        try:
+            with db.engine.begin() as connection:
+                self._add(connection, deltas)
+        except IntegrityError:
+            # another process of the same shard inserted the row meanwhile
+            with db.engine.begin() as connection:
+                self._add(connection, deltas)
+
+    def _forget_totals(self, entitlement_ids):
+        # the written usage is in the database now, not pending any more
+        for entitlement_id in entitlement_ids:
+            self.totals.pop(entitlement_id)
+
+    def _add(self, connection, deltas):
+        table = EntitlementUsage.__table__
+        shard = os.getpid() % self.shards
+        for entitlement_id in sorted(deltas):
+            amount = deltas[entitlement_id]
+            result = connection.execute(table.update().where(and_(
+                table.c.entitlement_id == entitlement_id,
+                table.c.shard == shard)).values(used=table.c.used + amount))
+            if result.rowcount == 0:
+                connection.execute(table.insert().values(
+                    entitlement_id=entitlement_id, shard=shard, used=amount))
+
+
+#: the usage meter of the process
+usage_meter = UsageMeter()
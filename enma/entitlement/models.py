@@ -0,0 +1,183 @@
+# -*- coding: utf-8 -*-
+""" Data and domain model for entitlements """
+import datetime as dt
+
+from sqlalchemy import event, inspect, or_
+
+from enma.database import (
+    Column,
+    db,
+    Model,
+    ReferenceCol,
+    relationship,
+    SurrogatePK,
+)
+from enma.versions import bump_version, current_version
+
+REQUESTED = u'requested'
+GRANTED = u'granted'
+REVOKED = u'revoked'
+
+
+class Organization(SurrogatePK, Model):
+    """ An organization (e.g. a customer) that can hold entitlements
+
+    Attributes:
+        name (str): The name of the organization - unique.
+        description (str): What the organization is about.
+    """
+    __tablename__ = 'organizations'
+    name = Column(db.String(80), unique=True, nullable=False)
+    description = Column(db.String(255), nullable=False, default='')
+
+    def __repr__(self):
+        return '<Organization({name!r})>'.format(name=self.name)
+
+
+class EntitlementType(SurrogatePK, Model):
+    """ The kind of an entitlement, e.g. the service it entitles to use
+
+    Attributes:
+        name (str): The name of the type - unique.
+        description (str): What the type entitles to.
+    """
+    __tablename__ = 'entitlement_types'
+    name = Column(db.String(80), unique=True, nullable=False)
+    description = Column(db.String(255), nullable=False, default='')
+
+    def __repr__(self):
+        return '<EntitlementType({name!r})>'.format(name=self.name)
+
+
+class Entitlement(SurrogatePK, Model):
+    """ The entitlement of a user or an organization
+
+    Only granted and not yet expired entitlements are valid.
+
+    Attributes:
+        name (str): The name the entitlement is looked up by.
+        type: Reference to the EntitlementType.
+        user: Reference to the entitled User (or None).
+        organization: Reference to the entitled Organization (or None).
+        status (str): requested, granted or revoked.
+        description (str): What the entitlement is about.
+        capacity (int): Optional limit of the use (None: unlimited).
+        expiry (timestamp): When the entitlement ends (None: never).
+        created_at (timestamp): When the entitlement was created.
+    """
+    __tablename__ = 'entitlements'
+    __table_args__ = (
+        # lookup of the valid entitlements of a user by name
+        db.Index('ix_entitlements_user_name_status',
+                 'user_id', 'name', 'status'),
+        db.Index('ix_entitlements_organization_id', 'organization_id'),
+        {'extend_existing': True},
+    )
+    name = Column(db.String(80), nullable=False)
+    type_id = ReferenceCol('entitlement_types')
+    type = relationship('EntitlementType', lazy='joined')
+    user_id = ReferenceCol('users', nullable=True)
+    # the previous user is loaded on a change, see user_ids
+    user = relationship('User', active_history=True,
+                        backref=db.backref('entitlements', lazy='dynamic'))
+    organization_id = ReferenceCol('organizations', nullable=True)
+    organization = relationship('Organization',
+                                backref=db.backref('entitlements',
+                                                   lazy='dynamic'))
+    status = Column(db.String(10), nullable=False, default=REQUESTED)
+    description = Column(db.String(255), nullable=False, default='')
+    capacity = Column(db.Integer, nullable=True)
+    expiry = Column(db.DateTime, nullable=True)
+    created_at = Column(db.DateTime, nullable=False, default=dt.datetime.utcnow)
+
+    def __repr__(self):
+        return '<Entitlement({name!r} {status})>'.format(
+            name=self.name, status=self.status)
+
+    def user_ids(self):
+        """ The ids of the entitled users - before and after a change """
+        state = inspect(self)
+        user_ids = set([self.user_id])
+        user_ids.update(state.attrs.user_id.history.deleted or ())
+        user_ids.update(user.id for user in
+                        state.attrs.user.history.deleted or () if user)
+        user_ids.discard(None)
+        return user_ids
+
+    @property
+    def is_valid(self):
+        return self.status == GRANTED and \
+            (self.expiry is None or self.expiry > dt.datetime.utcnow())
+
+    @staticmethod
+    def granted(now=None):
+        """ Query the granted and unexpired entitlements """
+        now = now or dt.datetime.utcnow()
+        return Entitlement.query.filter(Entitlement.status == GRANTED) \
+            .filter(or_(Entitlement.expiry == None, Entitlement.expiry > now))
+
+    @staticmethod
+    def valid(user_id, name=None):
+        """ Query the granted and unexpired entitlements of a user
+
+        Served by the index on (user, name, status).
+
+        Args:
+            user_id (int): The id of the entitled user
+            name (str): Only the entitlements of this name
+        """
+        query = Entitlement.granted().filter(Entitlement.user_id == user_id)
+        if name is not None:
+            query = query.filter(Entitlement.name == name)
+        return query
+
+    @staticmethod
+    def version(user_id, connection=None):
+        """ The version of the entitlements of a user, it changes with any
+        change of them
+        """
+        return current_version('entitlements', user_id, connection)
+
+    def to_dict(self):
+        """ The REST representation """
+        result = {
+            'name': self.name,
+            'type': self.type.name,
+            'status': self.status,
+            'description': self.description,
+            'expiry': self.expiry.isoformat() if self.expiry else None,
+        }
+        if self.capacity is not None:
+            result['capacity'] = self.capacity
+        return result
+
+
+@event.listens_for(Entitlement, 'after_insert')
+@event.listens_for(Entitlement, 'after_update')
+@event.listens_for(Entitlement, 'after_delete')
+def _entitlement_changed(mapper, connection, target):
+    """ Bump the entitlement version of the users, see Entitlement.version """
+    for user_id in target.user_ids():
+        bump_version(connection, 'entitlements', user_id)
+
+
+class EntitlementUsage(Model):
+    """ The consumed capacity of an entitlement
+
+    The usage is spread over several rows (shards) per entitlement, each
+    process adds to its own shard, see metering.
+
+    Attributes:
+        entitlement_id (int): The consumed entitlement
+        shard (int): The shard of the row
+        used (int): The capacity consumed (in this shard)
+    """
+    __tablename__ = 'entitlement_usage'
+    entitlement_id = Column(db.Integer, db.ForeignKey('entitlements.id'),
+                            primary_key=True)
+    shard = Column(db.Integer, primary_key=True, autoincrement=False)
+    used = Column(db.BigInteger, nullable=False, default=0)
+
+    def __repr__(self):
+        return '<EntitlementUsage({0} {1}: {2})>'.format(
+            self.entitlement_id, self.shard, self.used)
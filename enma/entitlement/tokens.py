@@ -0,0 +1,67 @@
+# -*- coding: utf-8 -*-
+"""
+Module: Issue signed entitlement tokens
+
+An entitlement token asserts the valid entitlements of a user (with their
+capacities and expiries) for ENTITLEMENT_TOKEN_TTL seconds. It is a JSON
+web signature like the authentication tokens, but signed with a key of its
+own, so the key can be handed to downstream services (see verifier)
+without handing out the SECRET_KEY.
+"""
+import calendar
+import hashlib
+import hmac
+
+from flask import current_app
+from itsdangerous import TimedJSONWebSignatureSerializer as Serializer
+
+from enma.entitlement.models import Entitlement
+from enma.entitlement.verifier import SALT
+
+
+def signing_key():
+    """ The key entitlement tokens are signed with
+
+    ENTITLEMENT_TOKEN_KEY if configured, otherwise derived from the
+    SECRET_KEY (which cannot be recovered from it).
+
+    Returns:
+        tuple: (key id, key)
+    """
+    config = current_app.config
+    key = config.get('ENTITLEMENT_TOKEN_KEY') or hmac.new(
+        str(config['SECRET_KEY']), SALT, hashlib.sha256).hexdigest()
+    return hashlib.sha256(key).hexdigest()[:8], key
+
+
+def _epoch(timestamp):
+    if timestamp is None:
+        return None
+    return calendar.timegm(timestamp.utctimetuple())
+
+
+def issue_token(user_id, username, expiration=None):
+    """ Issue the entitlement token of a user
+
+    Args:
+        user_id (int): The id of the user
+        username (str): The username of the user
+        expiration (int): Seconds the token is valid
+          (default ENTITLEMENT_TOKEN_TTL)
+    Returns:
+        str: The signed token
+    """
+    expiration = expiration or current_app.config['ENTITLEMENT_TOKEN_TTL']
+    entitlements = {}
+    for entitlement in Entitlement.valid(user_id).order_by(Entitlement.id):
+        values = {}
+        if entitlement.capacity is not None:
+            values['cap'] = entitlement.capacity
+        if entitlement.expiry is not None:
+            values['exp'] = _epoch(entitlement.expiry)
+        entitlements.setdefault(entitlement.name, values)
+    kid, key = signing_key()
+    serializer = Serializer(key, salt=SALT, expires_in=expiration)
+    return serializer.dumps({'sub': username, 'uid': user_id,
+                             'ent': entitlements},
+                            header_fields={'kid': kid})
@@ -0,0 +1,111 @@
+# -*- coding: utf-8 -*-
+"""
+Module: Offline verification of entitlement tokens
+
+Downstream services verify the entitlement tokens issued by enma
+(``PUT /rest/v1.0/entitlements:token``) locally and only come back to
+enma to refresh them. This module depends on itsdangerous only, so it
+can be copied into any Python service: ::
+
+    keys = requests.get(enma + '/rest/v1.0/entitlements:key',
+                        auth=service_account).json()['keys']
+    verifier = EntitlementVerifier(keys)
+
+    assertion = verifier.verify(token)
+    if assertion.allows('service-one'):
+        ...
+
+The key is a shared secret (HMAC), a service must keep it as secret as
+its own credentials.
+"""
+import json
+import time
+
+from itsdangerous import TimedJSONWebSignatureSerializer as Serializer
+from itsdangerous import BadData, SignatureExpired, base64_decode
+
+#: the salt separates entitlement tokens from the other tokens of enma
+SALT = 'enma.entitlement-token'
+
+
+class InvalidEntitlementToken(Exception):
+    """ Raised if a token is forged, corrupt, expired or of an unknown key """
+    pass
+
+
+class EntitlementAssertion(object):
+    """ The verified content of an entitlement token
+
+    Attributes:
+        user (str): The username of the entitled user
+        user_id (int): The id of the entitled user
+        entitlements (dict): name -> (capacity, expiry), capacity and expiry
+          (seconds since the epoch) are None if unlimited
+        expires_at (int): When the token has to be refreshed (epoch)
+    """
+
+    def __init__(self, payload, header):
+        self.user = payload['sub']
+        self.user_id = payload['uid']
+        self.entitlements = dict(
+            (name, (values.get('cap'), values.get('exp')))
+            for name, values in payload['ent'].items())
+        self.expires_at = header['exp']
+
+    def allows(self, name, now=None):
+        """ Check that the user holds an unexpired entitlement of a name """
+        if name not in self.entitlements:
+            return False
+        expiry = self.entitlements[name][1]
+        return expiry is None or expiry > (now or time.time())
+
+    def capacity(self, name):
+        """ The capacity of an entitlement, None if unlimited or not held """
+        return self.entitlements.get(name, (None, None))[0]
+
+
+class EntitlementVerifier(object):
+    """ Verify entitlement tokens with the keys published by enma
+
+    Args:
+        keys: The 'keys' of the key endpoint - a list of dictionaries with
+          'kid' and 'key' - or a dictionary key id -> key.
+        cache_size (int): Number of verified tokens remembered, so checking
+          the same token again costs a dictionary lookup.
+    """
+
+    def __init__(self, keys, cache_size=1024):
+        if isinstance(keys, list):
+            keys = dict((key['kid'], key['key']) for key in keys)
+        self._serializers = dict((kid, Serializer(key, salt=SALT))
+                                 for kid, key in keys.items())
+        self.cache_size = cache_size
+        self._verified = {}
+
+    def verify(self, token):
+        """ Verify a token
+
+        Returns:
+            EntitlementAssertion: The verified content
+        Raises:
+            InvalidEntitlementToken: if the token must not be trusted
+        """
+        assertion = self._verified.get(token)
+        if assertion is not None and assertion.expires_at >= time.time():
+            return assertion
+        try:
+            kid = json.loads(base64_decode(token.split('.', 1)[0]))['kid']
+            serializer = self._serializers[kid]
+        except (ValueError, KeyError, TypeError, BadData):
+            raise InvalidEntitlementToken('Unknown key')
+        try:
+            assertion = EntitlementAssertion(
+                *serializer.loads(token, return_header=True))
+        except SignatureExpired:
+            raise InvalidEntitlementToken('Token expired')
+        except (BadData, KeyError, TypeError, AttributeError):
+            raise InvalidEntitlementToken('Invalid token')
+        if len(self._verified) >= self.cache_size:
+            self._verified.clear()
+        self._verified[token] = assertion
+        return assertion
@@ -0,0 +1,202 @@
+# -*- coding: utf-8 -*-
+"""
+Module: Per request SQL instrumentation
+
+Counts the statements a request executes and the time spent in the
+database, built on the SQLAlchemy engine events:
+
+* per request: statements, database time and repeated statements - the
+  same statement text (its shape, parameters are bound separately)
+  executed SQL_REPEATED_STATEMENTS times or more, typically an N+1 query
+  pattern (lazy loading per row of a listing)
+* per endpoint: the sums and the maximum over all requests of this worker
+  process, see QueryInstrumentation.stats
+* statements slower than SQL_SLOW_QUERY seconds are logged with a
+  fingerprint of their parameters, so repeated slow calls can be told
+  apart without logging the (personal) values
+* with SQL_HEADERS the numbers of a request are added to the response
+  (X-SQL-Statements, X-SQL-Time in ms, X-SQL-Repeated); the debug toolbar
+  shows them in the SQLStatsDebugPanel
+
+Configuration (read from the application config):
+
+    SQL_INSTRUMENTATION: enable the instrumentation
+    SQL_SLOW_QUERY, SQL_REPEATED_STATEMENTS, SQL_HEADERS: see above
+"""
+import hashlib
+import logging
+import threading
+import time
+from collections import defaultdict
+
+from flask import g, request, has_request_context, render_template
+from flask_debugtoolbar.panels import DebugPanel
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+logger = logging.getLogger(__name__)
+
+
+class RequestStats(object):
+    """ The statements of a request
+
+    Attributes:
+        statements (int): Number of statements executed
+        seconds (float): Time spent executing them
+        shapes (dict): statement text -> number of executions
+    """
+
+    def __init__(self):
+        self.statements = 0
+        self.seconds = 0.0
+        self.shapes = defaultdict(int)
+
+    def repeated(self, threshold):
+        """ (statement, executions) of the statements executed threshold
+        times or more - most often first
+        """
+        return sorted(((shape, count) for shape, count in self.shapes.items()
+                       if count >= threshold), key=lambda item: -item[1])
+
+
+def fingerprint(parameters):
+    """ A short digest of bound parameters - equal for equal values """
+    return hashlib.sha1(repr(parameters)).hexdigest()[:12]
+
+
+class QueryInstrumentation(object):
+    """ Statement counts and database time per request and per endpoint """
+
+    def __init__(self, app=None):
+        self.enabled = False
+        self.slow = 0.5
+        self.threshold = 5
+        self.headers = False
+        self._endpoints = {}
+        self._lock = threading.Lock()
+        self._listening = False
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        config = app.config
+        self.enabled = config.get('SQL_INSTRUMENTATION', self.enabled)
+        if not self.enabled:
+            return
+        self.slow = config.get('SQL_SLOW_QUERY', self.slow)
+        self.threshold = config.get('SQL_REPEATED_STATEMENTS', self.threshold)
+        self.headers = config.get('SQL_HEADERS', self.headers)
+        if not self._listening:
+            event.listen(Engine, 'before_cursor_execute', self._before)
+            event.listen(Engine, 'after_cursor_execute', self._after)
+            self._listening = True
+        app.before_request(self._start)
+        app.after_request(self._finish)
+
+    def current(self):
+        """ The stats of the current request or None if not instrumented """
+        if not has_request_context():
+            return None
+        return g.get('_sql_stats')
+
+    def stats(self):
+        """ The statistics of the endpoints (of this worker process) """
+        with self._lock:
+            endpoints = dict((endpoint, list(values)) for endpoint, values
+                             in self._endpoints.items())
+        return dict((endpoint, {
+            'requests': requests,
+            'statements': statements,
+            'statements_per_request': round(float(statements) / requests, 1),
+            'max_statements': max_statements,
+            'milliseconds': round(seconds * 1000, 1),
+            'repeated': repeated,
+        }) for endpoint, (requests, statements, seconds, max_statements,
+                          repeated) in endpoints.items())
+
+    def reset(self):
+        with self._lock:
+            self._endpoints.clear()
+
+    def _before(self, conn, cursor, statement, parameters, context,
+                executemany):
+        # on the execution context: discarded with it if the statement fails
+        if context is not None:
+            context._sql_started = time.time()
+
+    def _after(self, conn, cursor, statement, parameters, context,
+               executemany):
+        started = getattr(context, '_sql_started', None)
+        seconds = time.time() - started if started is not None else 0.0
+        stats = self.current()
+        if stats is not None:
+            stats.statements += 1
+            stats.seconds += seconds
+            stats.shapes[statement] += 1
+        if self.enabled and seconds >= self.slow:
+            logger.warning('Slow statement (%.3f s, parameters %s): %s',
+                           seconds, fingerprint(parameters), statement)
+
+    def _start(self):
+        g._sql_stats = RequestStats()
+
+    def _finish(self, response):
+        stats = self.current()
+        if stats is None:
+            return response
+        repeated = stats.repeated(self.threshold)
+        for shape, count in repeated:
+            logger.warning('Statement executed %d times by %s (N+1?): %s',
+                           count, request.endpoint, shape)
+        with self._lock:
+            values = self._endpoints.setdefault(request.endpoint,
+                                                [0, 0, 0.0, 0, 0])
+            values[0] += 1
+            values[1] += stats.statements
+            values[2] += stats.seconds
+            values[3] = max(values[3], stats.statements)
+            values[4] += len(repeated)
+        if self.headers:
+            response.headers['X-SQL-Statements'] = str(stats.statements)
+            response.headers['X-SQL-Time'] = '%.1f' % (stats.seconds * 1000)
+            response.headers['X-SQL-Repeated'] = str(len(repeated))
+        return response
+
+
+#: the SQL instrumentation of the process
+query_stats = QueryInstrumentation()
+
+
+class SQLStatsDebugPanel(DebugPanel):
+    """ Debug toolbar panel of the SQL statistics, see QueryInstrumentation
+
+    Add 'enma.instrumentation.SQLStatsDebugPanel' to DEBUG_TB_PANELS.
+    """
+    name = 'SQLStats'
+    has_content = True
+
+    def process_response(self, request, response):
+        self.request_stats = query_stats.current()
+
+    def nav_title(self):
+        return 'SQL statistics'
+
+    def nav_subtitle(self):
+        stats = getattr(self, 'request_stats', None)
+        if stats is None:
+            return 'not instrumented'
+        return '{0} statements in {1:.1f} ms'.format(stats.statements,
+                                                    stats.seconds * 1000)
+
+    def title(self):
+        return 'SQL statistics'
+
+    def url(self):
+        return ''
+
+    def content(self):
+        stats = getattr(self, 'request_stats', None)
+        return render_template(
+            'debug/sql_stats.html', stats=stats,
+            repeated=stats.repeated(query_stats.threshold) if stats else [],
+            endpoints=sorted(query_stats.stats().items()))
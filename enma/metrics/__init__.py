@@ -0,0 +1,4 @@
+# -*- coding: utf-8 -*-
+'''The metrics module: the registry and the scrape endpoint.'''
+
+from . import views
@@ -0,0 +1,393 @@
+# -*- coding: utf-8 -*-
+"""
+Module: Registry of the operational metrics
+
+Counters, gauges and histograms with fixed buckets, exposed in the
+Prometheus text format by the metrics blueprint (GET /metrics).
+
+Recording costs a dictionary update under a lock - the values are kept
+per label values in memory and nothing is formatted on the hot path.
+
+Gunicorn runs several worker processes and a scrape reaches one of them.
+With METRICS_DIR every process writes a snapshot of its values to
+<METRICS_DIR>/<pid>.json (every METRICS_FLUSH_INTERVAL seconds and on
+scrape) and the scrape merges the snapshots of all processes:
+
+* counters and histograms are summed - including those of processes that
+  exited, so the totals never go backwards
+* gauges are aggregated over the live processes (sum, max or min)
+
+A forked process starts with no values, the parent reports its own. Empty
+METRICS_DIR when the server is (re)started, e.g. in gunicorn's on_starting
+hook. Without METRICS_DIR only the scraped process is reported.
+
+Configuration (read from the application config):
+
+    METRICS_ENABLED: record metrics (False: recording does nothing)
+    METRICS_DIR: directory shared by the worker processes or None
+    METRICS_FLUSH_INTERVAL: seconds between two snapshots of a process
+"""
+import bisect
+import glob
+import json
+import logging
+import os
+import threading
+import time
+from collections import defaultdict
+
+from enma.background import Flusher
+
+logger = logging.getLogger(__name__)
+
+COUNTER = 'counter'
+GAUGE = 'gauge'
+HISTOGRAM = 'histogram'
+
+#: default buckets of a histogram of seconds
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0,
+                   10.0)
+
+
+class Metric(object):
+    """ A named metric with values per label values
+
+    Args:
+        registry (MetricsRegistry): The registry that owns the metric
+        name (str): The name, e.g. enma_http_requests_total
+        documentation (str): The help text
+        labels (tuple): The names of the labels
+    """
+    kind = None
+
+    def __init__(self, registry, name, documentation, labels=()):
+        self.registry = registry
+        self.name = name
+        self.documentation = documentation
+        self.labels = tuple(labels)
+        self._values = {}
+
+    def snapshot(self):
+        """ (label values, value) of all label values """
+        with self.registry.lock:
+            return [(list(labels), self._copy(value))
+                    for labels, value in self._values.items()]
+
+    def _copy(self, value):
+        return value
+
+    def reset(self):
+        with self.registry.lock:
+            self._values.clear()
+
+
+class Counter(Metric):
+    """ A value that only goes up, e.g. the number of requests """
+    kind = COUNTER
+
+    def inc(self, labels=(), amount=1):
+        if not self.registry.enabled:
+            return
+        with self.registry.lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def value(self, labels=()):
+        return self._values.get(labels, 0)
+
+
+class Gauge(Metric):
+    """ A value that goes up and down, e.g. the length of a queue
+
+    Args:
+        aggregate (str): How the values of the processes are combined -
+            'sum', 'max' or 'min'
+        function (callable): Returns the value (of no labels) at snapshot
+            time - instead of setting it
+    """
+    kind = GAUGE
+
+    def __init__(self, registry, name, documentation, labels=(),
+                 aggregate='sum', function=None):
+        Metric.__init__(self, registry, name, documentation, labels)
+        if aggregate not in AGGREGATES:
+            raise ValueError('Unknown aggregate: {0}'.format(aggregate))
+        self.aggregate = aggregate
+        self.function = function
+
+    def set(self, value, labels=()):
+        if not self.registry.enabled:
+            return
+        with self.registry.lock:
+            self._values[labels] = value
+
+    def inc(self, labels=(), amount=1):
+        if not self.registry.enabled:
+            return
+        with self.registry.lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def dec(self, labels=(), amount=1):
+        self.inc(labels, -amount)
+
+    def value(self, labels=()):
+        return self._values.get(labels, 0)
+
+    def snapshot(self):
+        if self.function is not None:
+            try:
+                return [([], self.function())]
+            except Exception:
+                logger.exception('Gauge %s failed', self.name)
+                return []
+        return Metric.snapshot(self)
+
+
+class Histogram(Metric):
+    """ Observations counted in fixed buckets, e.g. request durations
+
+    A value is [count per bucket..., count above the last bucket, sum].
+
+    Args:
+        buckets (tuple): The upper bounds of the buckets, ascending
+    """
+    kind = HISTOGRAM
+
+    def __init__(self, registry, name, documentation, labels=(),
+                 buckets=DEFAULT_BUCKETS):
+        Metric.__init__(self, registry, name, documentation, labels)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value, labels=()):
+        if not self.registry.enabled:
+            return
+        index = bisect.bisect_left(self.buckets, value)
+        with self.registry.lock:
+            counts = self._values.get(labels)
+            if counts is None:
+                counts = self._values[labels] = \
+                    [0] * (len(self.buckets) + 1) + [0.0]
+            counts[index] += 1
+            counts[-1] += value
+
+    def time(self, labels=()):
+        """ Observe the seconds a with block takes """
+        return _Timer(self, labels)
+
+    def count(self, labels=()):
+        return sum(self._values.get(labels, [0])[:-1])
+
+    def _copy(self, value):
+        return list(value)
+
+
+class _Timer(object):
+
+    def __init__(self, histogram, labels):
+        self.histogram = histogram
+        self.labels = labels
+
+    def __enter__(self):
+        self.started = time.time()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.histogram.observe(time.time() - self.started, self.labels)
+
+
+AGGREGATES = {'sum': sum, 'max': max, 'min': min}
+
+
+class MetricsRegistry(Flusher):
+    """ The metrics of the process and their snapshots in METRICS_DIR
+
+    The worker (with METRICS_DIR only) writes the snapshots, see
+    enma.background.
+    """
+    worker_name = 'metrics'
+
+    def __init__(self, app=None):
+        Flusher.__init__(self)
+        self.enabled = True
+        self.directory = None
+        self.flush_interval = 5.0
+        self.lock = threading.Lock()
+        self._metrics = {}
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        config = app.config
+        Flusher.init_app(self, app)
+        self.enabled = config.get('METRICS_ENABLED', self.enabled)
+        self.directory = config.get('METRICS_DIR', self.directory)
+        self.flush_interval = config.get('METRICS_FLUSH_INTERVAL',
+                                         self.flush_interval)
+
+    def _register(self, cls, name, *args, **kwargs):
+        with self.lock:
+            metric = self._metrics.get(name)
+            if metric is None:
+                metric = self._metrics[name] = cls(self, name, *args,
+                                                   **kwargs)
+            elif not isinstance(metric, cls):
+                raise ValueError('{0} is a {1}'.format(name, metric.kind))
+        return metric
+
+    def counter(self, name, documentation, labels=()):
+        """ Get or define a counter """
+        return self._register(Counter, name, documentation, labels)
+
+    def gauge(self, name, documentation, labels=(), aggregate='sum',
+              function=None):
+        """ Get or define a gauge """
+        return self._register(Gauge, name, documentation, labels,
+                              aggregate=aggregate, function=function)
+
+    def histogram(self, name, documentation, labels=(),
+                  buckets=DEFAULT_BUCKETS):
+        """ Get or define a histogram """
+        return self._register(Histogram, name, documentation, labels,
+                              buckets=buckets)
+
+    def get(self, name):
+        return self._metrics.get(name)
+
+    def reset(self):
+        """ Forget all values (of this process) """
+        for metric in list(self._metrics.values()):
+            metric.reset()
+
+    def snapshot(self):
+        """ The values of this process
+
+        Returns:
+            dict: name -> {'kind', 'values': [[label values, value]]}
+        """
+        return dict((metric.name, {'kind': metric.kind,
+                                   'values': metric.snapshot()})
+                    for metric in list(self._metrics.values()))
+
+    def write_snapshot(self):
+        """ Write the snapshot of this process to METRICS_DIR """
+        if not self.directory:
+            return
+        path = os.path.join(self.directory, '{0}.json'.format(os.getpid()))
+        temporary = path + '.tmp'
+        try:
+            with open(temporary, 'w') as snapshot:
+                json.dump({'pid': os.getpid(), 'metrics': self.snapshot()},
+                          snapshot)
+            os.rename(temporary, path)  # atomic, readers never see a part
+        except (IOError, OSError):
+            logger.exception('Writing the metrics to %s failed', path)
+
+    def collect(self):
+        """ The values of all processes, merged
+
+        Returns:
+            dict: name -> {label values tuple: value}
+        """
+        if not self.directory:
+            return dict((name, dict((tuple(labels), value)
+                                    for labels, value in values['values']))
+                        for name, values in self.snapshot().items())
+        self.write_snapshot()
+        merged = defaultdict(dict)
+        gauges = defaultdict(lambda: defaultdict(list))
+        for path in glob.glob(os.path.join(self.directory, '*.json')):
+            try:
+                with open(path) as snapshot:
+                    process = json.load(snapshot)
+            except (IOError, OSError, ValueError):
+                continue  # vanished or not a snapshot
+            alive = _alive(process.get('pid'))
+            for name, values in process.get('metrics', {}).items():
+                metric = self._metrics.get(name)
+                if metric is None:
+                    continue
+                for labels, value in values['values']:
+                    labels = tuple(labels)
+                    if metric.kind == GAUGE:
+                        if alive:
+                            gauges[name][labels].append(value)
+                    elif metric.kind == COUNTER:
+                        merged[name][labels] = \
+                            merged[name].get(labels, 0) + value
+                    elif len(value) == len(metric.buckets) + 2:
+                        total = merged[name].get(labels)
+                        merged[name][labels] = value if total is None else \
+                            [a + b for a, b in zip(total, value)]
+        for name, values in gauges.items():
+            aggregate = AGGREGATES[self._metrics[name].aggregate]
+            merged[name] = dict((labels, aggregate(value))
+                                for labels, value in values.items())
+        return merged
+
+    def exposition(self):
+        """ The merged values in the Prometheus text format (0.0.4) """
+        collected = self.collect()
+        lines = []
+        for name in sorted(self._metrics):
+            metric = self._metrics[name]
+            lines.append('# HELP {0} {1}'.format(
+                name, metric.documentation.replace('\\', r'\\')
+                .replace('\n', r'\n')))
+            lines.append('# TYPE {0} {1}'.format(name, metric.kind))
+            for labels, value in sorted(collected.get(name, {}).items()):
+                pairs = list(zip(metric.labels, labels))
+                if metric.kind != HISTOGRAM:
+                    lines.append(_sample(name, pairs, value))
+                    continue
+                cumulative = 0
+                bounds = [_number(bound) for bound in metric.buckets]
+                for bound, count in zip(bounds + ['+Inf'], value[:-1]):
+                    cumulative += count
+                    lines.append(_sample(name + '_bucket',
+                                         pairs + [('le', bound)],
+                                         cumulative))
+                lines.append(_sample(name + '_sum', pairs, value[-1]))
+                lines.append(_sample(name + '_count', pairs, cumulative))
+        return '\n'.join(lines) + '\n'
+
+    def _pending(self):
+        return bool(self.directory)
+
+    def _forget(self):
+        # forked (e.g. gunicorn worker): the parent reports its values
+        self.reset()
+
+    def _background(self):
+        return bool(self.directory)
+
+    def _flush_now(self):
+        self.write_snapshot()
+
+
+def _alive(pid):
+    if pid == os.getpid():
+        return True
+    try:
+        os.kill(pid, 0)
+    except (OSError, TypeError):
+        return False
+    return True
+
+
+def _number(value):
+    return repr(value) if isinstance(value, float) else str(value)
+
+
+def _escape(value):
+    return u'{0}'.format(value).replace('\\', r'\\').replace('"', r'\"') \
+        .replace('\n', r'\n')
+
+
+def _sample(name, pairs, value):
+    if pairs:
+        name += '{' + ','.join(u'{0}="{1}"'.format(label, _escape(text))
+                               for label, text in pairs) + '}'
+    return u'{0} {1}'.format(name, _number(value))
+
+
+#: the metrics of the process
+metrics = MetricsRegistry()
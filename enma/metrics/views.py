@@ -0,0 +1,73 @@
+# -*- coding: utf-8 -*-
+"""
+The scrape endpoint of the metrics and the request metrics of all
+blueprints (latency per endpoint, requests per status, exceptions)
+
+The durations are measured until the response is returned by the view -
+streamed responses are sent afterwards.
+"""
+import hmac
+import time
+
+from flask import Blueprint, Response, current_app, request, g, abort
+
+from enma.metrics.registry import metrics
+
+blueprint = Blueprint("metrics", __name__)
+
+requests_total = metrics.counter(
+    'enma_http_requests_total', 'HTTP requests by endpoint, method, status',
+    ('endpoint', 'method', 'status'))
+request_seconds = metrics.histogram(
+    'enma_http_request_duration_seconds', 'Latency of the HTTP requests',
+    ('endpoint',))
+exceptions_total = metrics.counter(
+    'enma_http_exceptions_total', 'Requests failed by an unhandled exception',
+    ('endpoint',))
+
+
+def _endpoint():
+    return request.endpoint or 'unmatched'
+
+
+@blueprint.before_app_request
+def start_request():
+    # before recording: a forked process forgets the inherited values here
+    metrics.ensure_worker()
+    g.metrics_started = time.time()
+
+
+@blueprint.after_app_request
+def finish_request(response):
+    started = g.get('metrics_started')
+    if started is not None:
+        endpoint = _endpoint()
+        request_seconds.observe(time.time() - started, (endpoint,))
+        requests_total.inc((endpoint, request.method,
+                            str(response.status_code)))
+    return response
+
+
+@blueprint.teardown_app_request
+def teardown_request(exception):
+    if exception is not None:
+        exceptions_total.inc((_endpoint(),))
+
+
+@blueprint.route("/metrics")
+def scrape():
+    """
+    The metrics of all worker processes in the Prometheus text format.
+    Requires 'Authorization: Bearer <METRICS_TOKEN>'. Without a token the
+    metrics are served in development and testing only.
+    """
+    token = current_app.config.get('METRICS_TOKEN')
+    if not token:
+        if not (current_app.debug or current_app.testing):
+            abort(403)
+    elif not hmac.compare_digest(
+            str(request.headers.get('Authorization', '')),
+            str('Bearer ' + token)):
+        abort(401)
+    return Response(metrics.exposition(),
+                    mimetype='text/plain; version=0.0.4')
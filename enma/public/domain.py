@@ -25,6 +25,18 @@ def compose_username(nick, email, provider):
     return None
 
 
+def split_username(username):
+    """
+    @brief Split the username into nick name and authentication provider
+    @param username The composed username (see compose_username)
+    @return tupel of (nick, provider), provider is 'not-set' if missing
+    """
+    parts = username.split('%')
+    if len(parts) < 2:
+        return (username, 'not-set')
+    return (parts[0], parts[1])
+
+
 def get_first_last_name(fullname):
     """
     @brief Extract first and last name from full name
@@ -6,7 +6,7 @@ from flask import (Blueprint, request, render_template, flash, url_for,
 from flask.ext.login import login_user, login_required, logout_user
 
 from enma.extensions import login_manager
-from enma.user.models import User, AnonymousUser
+from enma.user.models import User, AnonymousUser, load_identity
 from enma.public.forms import LoginUserPasswordForm, \
     RegisterUserPasswordForm, RequestPasswordChangeForm
 from enma.utils import flash_errors
@@ -45,7 +45,7 @@ def get_oauth2_providers(flag='login'):
 
 @login_manager.user_loader
 def load_user(id):
-    return User.get_by_id(int(id))
+    return load_identity(int(id))
 
 
 @blueprint.route("/", methods=["GET", "POST"])
@@ -0,0 +1,114 @@
+# -*- coding: utf-8 -*-
+"""In-process publish/subscribe of messages by channel.
+
+Every subscription has a bounded queue of its own, publishing copies the
+message to the queues of the channel's subscribers and never blocks. A
+subscriber that does not keep up loses messages; it is told so by the
+``overflowed`` flag and has to resynchronize (e.g. refetch the resource).
+
+The queues are standard library queues, so with a cooperative worker
+(gevent monkey patching) waiting subscribers cost a greenlet each, not a
+thread. Messages only reach the subscribers of the same process.
+"""
+import threading
+from Queue import Queue, Empty, Full
+
+
+class Subscription(object):
+    """ The subscription of a channel, see PubSub.subscribe
+
+    Attributes:
+        channel (str): The subscribed channel
+        overflowed (boolean): Messages were lost since the last get
+    """
+
+    def __init__(self, pubsub, channel, maxsize):
+        self.pubsub = pubsub
+        self.channel = channel
+        self.overflowed = False
+        self._queue = Queue(maxsize)
+
+    def put(self, message):
+        try:
+            self._queue.put_nowait(message)
+        except Full:
+            self.overflowed = True
+
+    def get(self, timeout=None):
+        """ Wait for the next message
+
+        Returns:
+            The message or None if there was none within the timeout
+        """
+        try:
+            return self._queue.get(timeout=timeout)
+        except Empty:
+            return None
+
+    def get_nowait(self):
+        """ The next message or None if there is none """
+        return self.get(timeout=0) if not self._queue.empty() else None
+
+    def close(self):
+        self.pubsub.unsubscribe(self)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+class PubSub(object):
+    """ Channels of messages with any number of subscribers
+
+    Attributes:
+        published (int): Number of messages published
+        delivered (int): Number of messages put into subscription queues
+    """
+
+    def __init__(self, maxsize=100):
+        self.maxsize = maxsize
+        self.published = 0
+        self.delivered = 0
+        self._channels = {}
+        self._lock = threading.Lock()
+
+    def subscribe(self, channel):
+        """ Subscribe a channel - close the subscription when done
+
+        Returns:
+            Subscription: to get the messages published from now on
+        """
+        subscription = Subscription(self, channel, self.maxsize)
+        with self._lock:
+            self._channels.setdefault(channel, set()).add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            subscriptions = self._channels.get(subscription.channel, set())
+            subscriptions.discard(subscription)
+            if not subscriptions:
+                self._channels.pop(subscription.channel, None)
+
+    def publish(self, channel, message):
+        """ Publish a message to the current subscribers of a channel
+
+        Returns:
+            int: The number of subscribers
+        """
+        with self._lock:
+            subscriptions = list(self._channels.get(channel, ()))
+        for subscription in subscriptions:
+            subscription.put(message)
+        self.published += 1
+        self.delivered += len(subscriptions)
+        return len(subscriptions)
+
+    def subscribers(self, channel=None):
+        """ The number of subscriptions of a channel or of all channels """
+        with self._lock:
+            if channel is not None:
+                return len(self._channels.get(channel, ()))
+            return sum(len(s) for s in self._channels.values())
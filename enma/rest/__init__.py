@@ -2,4 +2,4 @@ from flask import Blueprint
 
 api = Blueprint('api', __name__, url_prefix='/rest/v1.0')
 
-from . import authentication, errors, views
\ No newline at end of file
+from . import authentication, errors, views, users, activities
\ No newline at end of file
@@ -0,0 +1,102 @@
+# -*- coding: utf-8 -*-
+'''REST resources of the activity log - for audit log shipping.'''
+import datetime as dt
+
+from flask import g, request, current_app, Response, stream_with_context
+
+from enma.database import db, KeysetPagination
+from enma.extensions import auth
+from enma.user.models import Permission
+from enma.activity.models import Activity, activity_writer
+from enma.activity.export import COLUMNS, MIMETYPES, parse_time
+from . import api
+from .serialization import dumps, extractor, stream_list
+from .errors import bad_request, forbidden
+
+#: the order activities are tailed in - unique
+ORDER = (Activity.timestamp, Activity.id)
+
+to_dict = extractor(Activity, COLUMNS)
+
+
+def _activities():
+    """ Query the activity rows matching the request (unordered)
+
+    Activities are written in bulk, after they happened. Younger ones than
+    ACTIVITY_API_SETTLE seconds and those since the oldest activity this
+    process has not written yet are left out, so a client tailing the log
+    by its cursor does not skip an activity written late.
+    """
+    settled = dt.datetime.utcnow() - dt.timedelta(
+        seconds=current_app.config['ACTIVITY_API_SETTLE'])
+    pending = activity_writer.pending_since()
+    if pending is not None and pending < settled:
+        settled = pending
+    query = db.session.query(*[getattr(Activity, name) for name in COLUMNS]) \
+        .filter(Activity.timestamp < settled)
+    actors = request.args.getlist('actor')
+    if actors:
+        query = query.filter(Activity.actor.in_(actors))
+    categories = request.args.getlist('category')
+    if categories:
+        query = query.filter(Activity.category.in_(categories))
+    return query
+
+
+def _ndjson(query, page):
+    """ Stream the page and all following ones - every line carries the
+    cursor to continue after it
+    """
+    while True:
+        lines = []
+        for row in page.items:
+            activity = to_dict(row)
+            activity['cursor'] = page.encode(row)
+            lines.append(dumps(activity) + '\n')
+        yield ''.join(lines)
+        if not page.has_next:
+            return
+        page = KeysetPagination(query, ORDER, after=page.next_cursor,
+                                per_page=page.per_page, descending=False)
+
+
+@api.route('/activities', methods=['GET'])
+@auth.login_required
+def get_activities():
+    """
+    Respond with the activities in the order they happened
+
+    since is the cursor of a previous response (or a point in time to
+    start at); actor and category filter (repeatable). Up to limit
+    activities are responded with and the cursor to continue after them.
+    With format=ndjson (or Accept: application/x-ndjson) all activities
+    up to now are streamed as newline delimited JSON instead.
+    """
+    if not g.current_user.can(Permission.READ_ACTIVITY):
+        return forbidden('Activities')
+    config = current_app.config
+    ndjson = request.args.get('format') == 'ndjson' or \
+        request.accept_mimetypes.best == MIMETYPES['ndjson']
+    limit = request.args.get('limit', config['ACTIVITY_API_PAGE'], type=int)
+    if not 0 < limit <= config['ACTIVITY_API_PAGE_LIMIT']:
+        return bad_request('Limit exceeds {0}'.format(
+            config['ACTIVITY_API_PAGE_LIMIT']))
+    query = _activities()
+    since = request.args.get('since')
+    after = None
+    if since:
+        try:
+            query = query.filter(Activity.timestamp >= parse_time(since))
+        except ValueError:
+            after = since
+    page = KeysetPagination(query, ORDER, after=after,
+                            per_page=config['ACTIVITY_EXPORT_BATCH']
+                            if ndjson else limit, descending=False)
+    if after and page.cursor is None:
+        return bad_request('Invalid cursor {0}'.format(since))
+    if ndjson:
+        return Response(stream_with_context(_ndjson(query, page)),
+                        mimetype=MIMETYPES['ndjson'])
+    return stream_list('activities', page.items, to_dict, lambda: {
+        'cursor': page.encode(page.items[-1]) if page.items else since,
+        'more': page.has_next})
@@ -1,27 +1,47 @@
 from flask import g
 
 from enma.extensions import auth
+from enma.metrics.registry import metrics
 from enma.user.models import User, AnonymousUser
+from enma.user.credentials import credentials, CredentialsBusy
 
 from . import api
-from .errors import unauthorized, forbidden, not_found
+from .errors import unauthorized, forbidden, not_found, service_unavailable
+
+authentications = metrics.counter(
+    'enma_rest_authentications_total',
+    'REST authentications by method (anonymous, token, password, cached)'
+    ' and result (success, failure)', ('method', 'result'))
 
 
 @auth.verify_password
 def verify_password(username_or_token, password):
+    method, verified = _verify_password(username_or_token, password)
+    authentications.inc((method, 'success' if verified else 'failure'))
+    return verified
+
+
+def _verify_password(username_or_token, password):
     if username_or_token == '':
         g.current_user = AnonymousUser()
-        return True
+        return 'anonymous', True
     if password == '':
-        g.current_user = User.verify_auth_token(username_or_token)
+        g.current_user = User.identify_auth_token(username_or_token)
         g.token_used = True
-        return g.current_user is not None
+        return 'token', g.current_user is not None
+    g.token_used = False
+    identity = credentials.lookup(username_or_token, password)
+    if identity is not None:
+        g.current_user = identity
+        return 'cached', True
     user = User.query.filter_by(username=username_or_token).first()
     if not user:
-        return False
-    g.current_user = user
-    g.token_used = False
-    return user.check_password(password)
+        return 'password', False
+    identity = credentials.verify(user, password)
+    if identity is None:
+        return 'password', False
+    g.current_user = identity
+    return 'password', True
 
 
 @auth.error_handler
@@ -29,6 +49,11 @@ def auth_error():
     return unauthorized('Invalid credentials')
 
 
+@api.errorhandler(CredentialsBusy)
+def credentials_busy(e):
+    return service_unavailable('Too many pending logins')
+
+
 @api.before_request
 @auth.login_required
 def before_request():
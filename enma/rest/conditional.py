@@ -0,0 +1,47 @@
+# -*- coding: utf-8 -*-
+"""Conditional GET of REST resources (ETag / If-None-Match)"""
+import hashlib
+from functools import wraps
+
+from flask import request, g, make_response
+
+
+def etag_of(version):
+    """ The entity tag of the requested representation in a version """
+    user_id = getattr(g.get('current_user'), 'id', None)
+    return hashlib.sha1('{0}?{1}#{2}:{3}'.format(
+        request.path, request.query_string, user_id, version)).hexdigest()
+
+
+def conditional(version):
+    """ Decorator answering conditional GET requests of a resource
+
+    The version function is called with the arguments of the view and
+    returns the version of the resource (see enma.versions) - anything
+    that changes whenever the representation changes. If the client
+    already holds the representation of this version (If-None-Match),
+    the response is 304 - Not Modified and the view is not called.
+    Otherwise the response of the view gets the ETag.
+
+    Use it below the authentication (the ETag depends on the user): ::
+
+        @api.route('/entitlements', methods=['GET'])
+        @auth.login_required
+        @conditional(lambda: current_version('entitlements', g.current_user.id))
+        def get_entitlements():
+            ...
+    """
+    def decorator(view):
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            etag = etag_of(version(*args, **kwargs))
+            if etag in request.if_none_match:
+                response = make_response('', 304)
+                response.set_etag(etag)
+                return response
+            response = make_response(view(*args, **kwargs))
+            if response.status_code == 200:
+                response.set_etag(etag)
+            return response
+        return wrapper
+    return decorator
@@ -1,5 +1,5 @@
-from flask import jsonify
 from . import api
+from .serialization import json_response
 
 
 class ValidationError(ValueError):
@@ -7,26 +7,27 @@ class ValidationError(ValueError):
 
 
 def bad_request(message):
-    response = jsonify({'error': 'bad request', 'message': message})
-    response.status_code = 400
-    return response
+    return json_response({'error': 'bad request', 'message': message}, 400)
 
 
 def unauthorized(message='Invalid credentials'):
-    response = jsonify({'error': 'unauthorized', 'message': message})
-    response.status_code = 401
-    return response
+    return json_response({'error': 'unauthorized', 'message': message}, 401)
 
 
 def forbidden(message='This request'):
-    response = jsonify({'error': 'forbidden', 'message': message})
-    response.status_code = 403
-    return response
+    return json_response({'error': 'forbidden', 'message': message}, 403)
 
 def not_found(message='REST Object'):
-    response = jsonify({'error': 'not_found', 'message': message})
-    response.status_code = 404
-    return response
+    return json_response({'error': 'not_found', 'message': message}, 404)
+
+
+def conflict(message='REST Object exists'):
+    return json_response({'error': 'conflict', 'message': message}, 409)
+
+
+def service_unavailable(message='Try again later'):
+    return json_response({'error': 'service unavailable',
+                          'message': message}, 503)
 
 
 @api.errorhandler(ValidationError)
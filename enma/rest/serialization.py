@@ -0,0 +1,144 @@
+# -*- coding: utf-8 -*-
+"""
+Module: Serialization of the REST responses
+
+A replacement of flask.jsonify for the api blueprint that costs less per
+response:
+
+* the fastest JSON encoder installed is used - ujson, simplejson (with its
+  C speedups) or the standard library json
+* responses are compact, they are indented only in debug mode or with
+  REST_JSON_PRETTY (jsonify indents all non-XHR responses)
+* rows and entities are turned into dictionaries by extractors compiled
+  once per (model, fields): the attribute getters and the converters of
+  the date and time columns are looked up at compile time, not per row
+* large lists are encoded and sent in chunks (stream_list), so the whole
+  list is never held in memory as one string
+"""
+import datetime as dt
+from operator import attrgetter
+
+from flask import current_app, Response, stream_with_context
+
+try:
+    import ujson as _json
+    ENCODER = 'ujson'
+except ImportError:
+    try:
+        import simplejson as _json
+        ENCODER = 'simplejson'
+    except ImportError:
+        import json as _json
+        ENCODER = 'json'
+
+MIMETYPE = 'application/json'
+STREAM_CHUNK = 500  # items encoded per chunk of a streamed list
+
+
+def _default(value):
+    if isinstance(value, (dt.datetime, dt.date, dt.time)):
+        return value.isoformat()
+    raise TypeError('{0!r} is not JSON serializable'.format(value))
+
+
+def dumps(obj, pretty=False):
+    """ Encode an object of JSON types compactly (indented if pretty)
+
+    Dates and times are only converted by the standard library and
+    simplejson encoders - the extractors convert them beforehand.
+    """
+    if ENCODER == 'ujson':
+        return _json.dumps(obj, indent=2 if pretty else 0)
+    if pretty:
+        return _json.dumps(obj, indent=2, sort_keys=True, default=_default)
+    return _json.dumps(obj, separators=(',', ':'), default=_default)
+
+
+def _pretty():
+    config = current_app.config
+    return current_app.debug or config.get('REST_JSON_PRETTY', False)
+
+
+def json_response(obj, status=200, headers=None):
+    """ Make a JSON response - use it like flask.jsonify """
+    return Response(dumps(obj, _pretty()), status=status, headers=headers,
+                    mimetype=MIMETYPE)
+
+
+def stream_list(key, items, extract=None, extra=None,
+                chunk_size=STREAM_CHUNK):
+    """ Make a JSON response of a large list streamed in chunks
+
+    The response is {key: [items], **extra} - extra is sent after the list,
+    so it may be computed while the list is streamed (e.g. a cursor).
+
+    Args:
+        key (str): The name of the list
+        items (iterable): The items, e.g. a query yielding rows
+        extract (callable): Turns an item into a dictionary (Extractor)
+        extra (callable): Returns the dictionary of the other keys
+        chunk_size (int): Items encoded per chunk
+    """
+    return Response(stream_with_context(
+        _chunks(key, items, extract, extra, chunk_size)), mimetype=MIMETYPE)
+
+
+def _chunks(key, items, extract, extra, chunk_size):
+    yield '{' + dumps(key) + ':['
+    separator = ''
+    chunk = []
+    for item in items:
+        chunk.append(dumps(extract(item) if extract else item))
+        if len(chunk) >= chunk_size:
+            yield separator + ','.join(chunk)
+            separator = ','
+            chunk = []
+    if chunk:
+        yield separator + ','.join(chunk)
+    tail = dumps(extra() if extra else {})
+    yield ']' + (',' + tail[1:] if tail != '{}' else '}')
+
+
+class Extractor(object):
+    """ Precompiled extraction of some fields of rows or entities of a model
+
+    Date and time columns are converted to ISO 8601 strings, everything
+    else is taken as is. Use extractor() to share the compiled ones.
+
+    Args:
+        model: The mapped class the fields are columns of
+        fields (tuple): The names of the fields, in the order of the keys
+    """
+
+    def __init__(self, model, fields):
+        self.fields = tuple(fields)
+        columns = model.__table__.columns
+        self._dates = tuple(
+            index for index, name in enumerate(self.fields)
+            if name in columns and columns[name].type.python_type in
+            (dt.datetime, dt.date, dt.time))
+        getter = attrgetter(*self.fields)
+        # attrgetter of a single name returns the value, not a tuple
+        self._values = getter if len(self.fields) > 1 else \
+            lambda item: (getter(item),)
+
+    def __call__(self, item):
+        values = self._values(item)
+        if self._dates:
+            values = list(values)
+            for index in self._dates:
+                if values[index] is not None:
+                    values[index] = values[index].isoformat()
+        return dict(zip(self.fields, values))
+
+
+_extractors = {}
+
+
+def extractor(model, fields):
+    """ The (shared) Extractor of some fields of a model """
+    key = (model, tuple(fields))
+    compiled = _extractors.get(key)
+    if compiled is None:
+        compiled = _extractors[key] = Extractor(model, fields)
+    return compiled
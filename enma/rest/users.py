@@ -0,0 +1,379 @@
+# -*- coding: utf-8 -*-
+'''REST resources of the users - for provisioning automation.'''
+from flask import g, request, current_app, url_for
+from sqlalchemy.exc import IntegrityError
+
+from enma.compat import basestring, text_type
+from enma.database import db, KeysetPagination
+from enma.extensions import auth
+from enma.user.models import User, Role, Permission
+from enma.user.importer import import_users, parse_csv, parse_json
+from enma.user.mail import request_email_confirmation
+from enma.user.queries import user_listing, filter_users, parse_flag, \
+    projection, project_row, SORT_COLUMNS
+from enma.activity.models import record_api, record_import
+from . import api
+from .serialization import json_response
+from .errors import ValidationError, bad_request, conflict, forbidden, \
+    not_found
+
+#: fields of a user if no fields=a,b,c are requested
+DEFAULT_FIELDS = ('username', 'email', 'email_validated', 'first_name',
+                  'last_name', 'active', 'role', 'created_at')
+
+#: fields users may change of themselves, others need UPDATE_USER
+PROFILE_FIELDS = ('email', 'first_name', 'last_name')
+#: fields that always need UPDATE_USER
+PRIVILEGE_FIELDS = ('active', 'role')
+LENGTHS = {'email': 80, 'first_name': 40, 'last_name': 40}
+
+
+def _requested_fields():
+    fields = request.args.get('fields')
+    if not fields:
+        return DEFAULT_FIELDS
+    return [field.strip() for field in fields.split(',') if field.strip()]
+
+
+def _flag(name):
+    value = request.args.get(name)
+    flag = parse_flag(value)
+    if value and flag is None:
+        raise ValidationError('Invalid {0} flag: {1}'.format(name, value))
+    return flag
+
+
+def _user(user_id, fields):
+    """ The projection of a user or None if there is none """
+    row = user_listing(projection(fields)).filter(User.id == user_id).first()
+    return project_row(row, fields) if row else None
+
+
+def _roles():
+    """ role name -> (id, permissions) """
+    return dict((name, (role_id, permissions)) for name, role_id, permissions
+                in db.session.query(Role.name, Role.id, Role.permissions))
+
+
+def _validated(changes, roles):
+    """ Check and normalize the changes of a user
+
+    Returns:
+        dict: The attributes to set
+    Raises:
+        ValidationError: if a change is not valid
+    """
+    if not isinstance(changes, dict):
+        raise ValidationError('Expected a user object')
+    unknown = set(changes) - set(PROFILE_FIELDS + PRIVILEGE_FIELDS + ('id',))
+    if unknown:
+        raise ValidationError('Not changeable: ' + ', '.join(sorted(unknown)))
+    result = {}
+    for key in PROFILE_FIELDS:
+        if key not in changes:
+            continue
+        value = changes[key]
+        if value is not None and not isinstance(value, basestring):
+            raise ValidationError('Invalid ' + key)
+        value = value.strip() if value else None
+        if len(value or '') > LENGTHS[key]:
+            raise ValidationError('Too long: ' + key)
+        result[key] = value
+    if 'email' in result and '@' not in (result['email'] or ''):
+        raise ValidationError('Invalid email')
+    if 'active' in changes:
+        if not isinstance(changes['active'], bool):
+            raise ValidationError('Invalid active')
+        result['active'] = changes['active']
+    if 'role' in changes:
+        if not isinstance(changes['role'], basestring) or \
+                changes['role'] not in roles:
+            raise ValidationError('Unknown role {0}'.format(changes['role']))
+        result['role_id'] = roles[changes['role']][0]
+    return result
+
+
+def _forbidden_change(user_id, changes, roles):
+    """ Why the current user may not change a user or None if it may
+
+    Users change their own profile, anything else needs UPDATE_USER. Only
+    roles whose permissions the current user holds may be assigned.
+    """
+    current = g.current_user
+    if (user_id != current.id or set(changes) & set(PRIVILEGE_FIELDS)) and \
+            not current.can(Permission.UPDATE_USER):
+        return 'Change of user {0}'.format(user_id)
+    role = changes.get('role')
+    if isinstance(role, basestring) and role in roles and \
+            not current.can(roles[role][1]):
+        return 'Assignment of role {0}'.format(role)
+    return None
+
+
+def _forbidden_roles(records, roles):
+    """ Why the current user may not create the users of import records
+    or None if it may - only roles whose permissions the current user
+    holds may be assigned
+    """
+    for record in records:
+        role = record.get('role') if isinstance(record, dict) else None
+        if not role:
+            continue
+        role = text_type(role).strip()  # as the importer reads it
+        if role in roles and not g.current_user.can(roles[role][1]):
+            return 'Assignment of role {0}'.format(role)
+    return None
+
+
+def _apply(user, changes):
+    """ Set the changes
+
+    Returns:
+        boolean: True if the email address changed (needs a confirmation)
+    """
+    email_changed = 'email' in changes and changes['email'] != user.email
+    if email_changed:
+        user.email_validated = False
+    for key, value in changes.items():
+        setattr(user, key, value)
+    return email_changed
+
+
+def _emails_taken(changes):
+    """ The changed email addresses registered for other users """
+    emails = dict((user_id, values['email'])
+                  for user_id, values in changes.items() if 'email' in values)
+    if not emails:
+        return []
+    return sorted(email for user_id, email in
+                  db.session.query(User.id, User.email)
+                  .filter(User.email.in_(set(emails.values())))
+                  if emails.get(user_id) != email)
+
+
+def _commit(users, confirm):
+    """ Commit the changed users, request the confirmation of new emails
+
+    Returns:
+        A conflict response if an email is registered meanwhile or None
+    """
+    try:
+        db.session.commit()
+    except IntegrityError:
+        db.session.rollback()
+        return conflict('Email already registered')
+    for user in users:
+        if user.id in confirm:
+            request_email_confirmation(user)
+    return None
+
+
+@api.route('/users', methods=['GET'])
+@auth.login_required
+def get_users():
+    """
+    Respond with a page of users
+
+    The users are projected to the fields=a,b,c requested (see
+    FIELD_COLUMNS), filtered by active, validated, role and provider,
+    ordered by sort and paged by the next/prev cursor of the previous
+    response (after, before). Only the rows of one page are read.
+    """
+    if not g.current_user.can(Permission.READ_USER):
+        return forbidden('List of users')
+    config = current_app.config
+    sort = request.args.get('sort', 'username')
+    if sort not in SORT_COLUMNS:
+        return bad_request('Unknown sort key {0}'.format(sort))
+    limit = request.args.get('limit', config['MEMBERS_PER_PAGE'], type=int)
+    if not 0 < limit <= config['USERS_PAGE_LIMIT']:
+        return bad_request('Limit exceeds {0}'.format(
+            config['USERS_PAGE_LIMIT']))
+    fields = _requested_fields()
+    try:
+        columns = projection(fields, SORT_COLUMNS[sort])
+    except ValueError as e:
+        return bad_request(e.args[0])
+    query = filter_users(user_listing(columns),
+                         active=_flag('active'), validated=_flag('validated'),
+                         role=request.args.get('role'),
+                         provider=request.args.get('provider'))
+    pagination = KeysetPagination(query, SORT_COLUMNS[sort],
+                                  after=request.args.get('after'),
+                                  before=request.args.get('before'),
+                                  per_page=limit, descending=False)
+    return json_response({'users': [project_row(row, fields)
+                                    for row in pagination.items],
+                          'next': pagination.next_cursor,
+                          'prev': pagination.prev_cursor})
+
+
+@api.route('/users/<int:user_id>', methods=['GET'])
+@auth.login_required
+def get_user(user_id):
+    """
+    Respond with the fields=a,b,c of a user - users may read themselves
+    """
+    if user_id != g.current_user.id and \
+            not g.current_user.can(Permission.READ_USER):
+        return forbidden('User')
+    try:
+        user = _user(user_id, _requested_fields())
+    except ValueError as e:
+        return bad_request(e.args[0])
+    if user is None:
+        return not_found('User')
+    return json_response({'user': user})
+
+
+@api.route('/users', methods=['POST'])
+@auth.login_required
+def post_user():
+    """
+    Create a (locally authenticated) user from the keys of an import
+    record (see enma.user.importer) and respond with the user
+    """
+    if not g.current_user.can(Permission.CREATE_USER):
+        return forbidden('Creation of users')
+    record = request.get_json(force=True, silent=True)
+    if not isinstance(record, dict):
+        return bad_request('Expected a user object')
+    reason = _forbidden_roles([record], _roles())
+    if reason:
+        return forbidden(reason)
+    report = import_users([record], processes=0)
+    if report.errors:
+        message = report.errors[0][1]
+        if message.endswith('already registered'):
+            return conflict(message)
+        return bad_request(message)
+    user = User.query.filter_by(
+        email=text_type(record['email']).strip()).first()
+    record_api('Create user', acted_on=user, actor=g.current_user)
+    return json_response({'user': _user(user.id, DEFAULT_FIELDS)}), 201, \
+        {'Location': url_for('api.get_user', user_id=user.id,
+                             _external=True)}
+
+
+@api.route('/users/import', methods=['POST'])
+@auth.login_required
+def post_users_import():
+    """
+    Import users in bulk from a CSV (text/csv) or JSON body and respond
+    with the import report - at most USER_IMPORT_LIMIT records
+
+    The passwords are hashed in this process, the pool of processes is
+    left to the import by manage.py.
+    """
+    if not g.current_user.can(Permission.CREATE_USER):
+        return forbidden('Import of users')
+    try:
+        if request.mimetype == 'text/csv':
+            records = parse_csv(request.get_data().splitlines())
+        else:
+            records = parse_json(request.get_data())
+    except ValueError as e:
+        return bad_request('Invalid import data: %s' % e)
+    limit = current_app.config['USER_IMPORT_LIMIT']
+    if len(records) > limit:
+        return bad_request('At most %d users at once' % limit)
+    reason = _forbidden_roles(records, _roles())
+    if reason:
+        return forbidden(reason)
+    report = import_users(records, processes=0)
+    record_import('Import %d users' % report.created,
+                  actor=g.current_user)
+    return json_response(report.as_dict()), 201
+
+
+@api.route('/users/<int:user_id>', methods=['PATCH'])
+@auth.login_required
+def patch_user(user_id):
+    """
+    Change the email, names, active flag or role of a user and respond
+    with the user
+    """
+    changes = request.get_json(force=True, silent=True)
+    if not isinstance(changes, dict):
+        return bad_request('Expected a user object')
+    roles = _roles()
+    reason = _forbidden_change(user_id, changes, roles)
+    if reason:
+        return forbidden(reason)
+    values = _validated(changes, roles)
+    user = User.query.get(user_id)
+    if user is None:
+        return not_found('User')
+    if _emails_taken({user_id: values}):
+        return conflict('Email already registered')
+    confirm = set([user_id]) if _apply(user, values) else set()
+    error = _commit([user], confirm)
+    if error:
+        return error
+    record_api('Update user', acted_on=user, actor=g.current_user)
+    return json_response({'user': _user(user_id, DEFAULT_FIELDS)})
+
+
+@api.route('/users', methods=['PATCH'])
+@auth.login_required
+def patch_users():
+    """
+    Change several users at once - the body is {"users": [changes]} with
+    the id of the user in every changes object. All changes are applied in
+    one transaction or none is; the users are read by a single query.
+    """
+    if not g.current_user.can(Permission.UPDATE_USER):
+        return forbidden('Change of users')
+    body = request.get_json(force=True, silent=True)
+    items = body.get('users') if isinstance(body, dict) else None
+    if not isinstance(items, list):
+        return bad_request('Expected {"users": [changes]}')
+    limit = current_app.config['USERS_BULK_LIMIT']
+    if len(items) > limit:
+        return bad_request('More than {0} users'.format(limit))
+    roles = _roles()
+    changes = {}
+    for number, item in enumerate(items, 1):
+        user_id = item.get('id') if isinstance(item, dict) else None
+        if not isinstance(user_id, int) or isinstance(user_id, bool):
+            return bad_request('User {0}: id required'.format(number))
+        if user_id in changes:
+            return bad_request('User {0}: duplicate id'.format(number))
+        reason = _forbidden_change(user_id, item, roles)
+        if reason:
+            return forbidden(reason)
+        try:
+            changes[user_id] = _validated(item, roles)
+        except ValidationError as e:
+            return bad_request('User {0}: {1}'.format(number, e.args[0]))
+    users = User.query.filter(User.id.in_(changes)).all() if changes else []
+    missing = set(changes) - set(user.id for user in users)
+    if missing:
+        return not_found('Users ' + ', '.join(str(i) for i in sorted(missing)))
+    taken = _emails_taken(changes)
+    if taken:
+        return conflict('Email already registered: ' + ', '.join(taken))
+    confirm = set(user.id for user in users if _apply(user, changes[user.id]))
+    error = _commit(users, confirm)
+    if error:
+        return error
+    record_api('Update {0} users'.format(len(users)),
+               actor=g.current_user)
+    return json_response({'updated': len(users)})
+
+
+@api.route('/users/<int:user_id>', methods=['DELETE'])
+@auth.login_required
+def delete_user(user_id):
+    """
+    Delete a user
+    """
+    if not g.current_user.can(Permission.DELETE_USER):
+        return forbidden('Deletion of users')
+    user = User.query.get(user_id)
+    if user is None:
+        return not_found('User')
+    db.session.delete(user)
+    db.session.commit()
+    record_api('Delete user', acted_on=user, actor=g.current_user)
+    return '', 204
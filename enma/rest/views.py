@@ -1,59 +1,245 @@
 # -*- coding: utf-8 -*-
 '''Public section, including homepage and signup.'''
-from flask import g, jsonify
+from collections import OrderedDict
 
+from flask import g, request, current_app, Response, stream_with_context
+
+from enma.compat import basestring, integer_types
+from enma.database import db
 from enma.extensions import auth
+from enma.user.models import User, token_cache, \
+    identity_cache, role_table
+from enma.user.credentials import credentials
+from enma.entitlement.models import Entitlement
+from enma.entitlement.decisions import decisions
+from enma.entitlement.tokens import issue_token, signing_key
+from enma.entitlement.metering import usage_meter
+from enma.entitlement.feed import Feed, RESYNC
 from . import api
-from .errors import not_found
+from .conditional import conditional
+from .serialization import json_response
+from .errors import not_found, forbidden, bad_request
 
 
 @api.route("/token", methods=["PUT"])
 @auth.login_required
 def token():
-    return jsonify({
+    return json_response({
         'token': g.current_user.generate_auth_token(expiration=3600),
         'expiration': 3600}), 201
 
 
-entitlements = [
-    {
-        'name': u'service-one',
-        'type': u'service-one',
-        'status': u'granted',
-        'description': u'Use service one',
-        'expiry': u'2014-09-20'
-    },
-    {
-        'name': u'service-two',
-        'type': u'service-two',
-        'status': u'rewoked',
-        'description': u'Use service two',
-        'capacity': 500,
-        'expiry': u'2014-09-20'
-    },
-]
-
-
 @api.route('/entitlements', methods=['GET'])
 @auth.login_required
+@conditional(lambda: Entitlement.version(g.current_user.id))
 def get_entitlements():
     """
-    Respond with the list of all entitlements
+    Respond with the list of all entitlements of the user
     """
-    return jsonify({'entitlements': entitlements})
+    entitlements = Entitlement.query \
+        .filter_by(user_id=g.current_user.id) \
+        .order_by(Entitlement.name, Entitlement.id).all()
+    return json_response({'entitlements': [e.to_dict() for e in entitlements]})
+
+
+def _entitlement_version(name):
+    # an entitlement also turns invalid by expiry - without a new version
+    return '{0}.{1}'.format(Entitlement.version(g.current_user.id),
+                            decisions.decide(g.current_user.id, name).granted)
 
 
 @api.route('/entitlements/<name>', methods=['GET'])
 @auth.login_required
+@conditional(_entitlement_version)
 def get_entitlement(name):
     """
     Respond with the granted i.e. valid entitlement by name or with
-    404 - Not found 
+    404 - Not found
+    """
+    decision = decisions.decide(g.current_user.id, name)
+    if not decision.granted:
+        return not_found('entitlement named %s' % name)
+    return json_response({'entitlements': decision.entitlement})
+
+
+@api.route('/entitlements/<name>/usage', methods=['GET'])
+@auth.login_required
+def get_entitlement_usage(name):
+    """
+    Respond with the used and the remaining capacity of the valid
+    entitlement by name (may lag behind by ENTITLEMENT_USAGE_CACHE_TTL)
+    """
+    decision = decisions.decide(g.current_user.id, name)
+    if not decision.granted:
+        return not_found('entitlement named %s' % name)
+    return json_response(_usage(name, decision))
+
+
+@api.route('/entitlements/<name>/usage', methods=['POST'])
+@auth.login_required
+def post_entitlement_usage(name):
+    """
+    Report the use of an amount of the capacity of the valid entitlement
+    by name and respond with the used and the remaining capacity
     """
-    tmp = filter(lambda x: x['name'] == name and x['status'] == 'granted',
-                 entitlements)
-    if len(tmp) == 0:
+    decision = decisions.decide(g.current_user.id, name)
+    if not decision.granted:
         return not_found('entitlement named %s' % name)
-    return jsonify({'entitlements': tmp[0]})
+    data = request.get_json(force=True, silent=True)
+    amount = data.get('amount') if isinstance(data, dict) else None
+    if not isinstance(amount, integer_types) or isinstance(amount, bool) or \
+            amount <= 0:
+        return bad_request('Expected a positive integer amount')
+    usage_meter.record(decision.id, amount)
+    return json_response(_usage(name, decision)), 202
+
+
+def _usage(name, decision):
+    used = usage_meter.used(decision.id)
+    remaining = None
+    if decision.capacity is not None:
+        remaining = max(0, decision.capacity - used)
+    return {'name': name, 'capacity': decision.capacity, 'used': used,
+            'remaining': remaining}
+
+
+@api.route('/entitlements:check', methods=['POST'])
+@auth.login_required
+def check_entitlements():
+    """
+    Check several entitlements at once
+
+    The body is a JSON object with the list of entitlement 'names' and
+    optionally the list of 'users' (usernames) whose entitlements are
+    checked - administrators only, default is the authenticated user.
+    Respond with one check result per user and name.
+    """
+    data = request.get_json(force=True, silent=True)
+    if not isinstance(data, dict):
+        return bad_request('Expected a JSON object')
+    names = data.get('names')
+    usernames = data.get('users')
+    if not _is_list_of_strings(names) or \
+            not (usernames is None or _is_list_of_strings(usernames)):
+        return bad_request('Expected lists of names and users')
+    limit = current_app.config['ENTITLEMENT_CHECK_LIMIT']
+    if len(names) * len(usernames or [None]) > limit:
+        return bad_request('At most %d checks at once' % limit)
+    names = _unique(names)
+    if usernames is None:
+        users = [(g.current_user.id, g.current_user.username)]
+    else:
+        if not g.current_user.is_administrator():
+            return forbidden('Check of the entitlements of other users')
+        usernames = _unique(usernames)
+        found = dict(db.session.query(User.username, User.id)
+                     .filter(User.username.in_(usernames)))
+        unknown = [username for username in usernames
+                   if username not in found]
+        if unknown:
+            return bad_request('Unknown users: %s' % ', '.join(unknown))
+        users = [(found[username], username) for username in usernames]
+    result = decisions.decide_many([user_id for user_id, _ in users], names)
+    checks = []
+    for user_id, username in users:
+        for name in names:
+            decision = result[(user_id, name)]
+            checks.append({'user': username, 'name': name,
+                           'granted': decision.granted,
+                           'entitlement': decision.entitlement})
+    return json_response({'checks': checks})
+
+
+def _is_list_of_strings(value):
+    return isinstance(value, list) and \
+        all(isinstance(item, basestring) for item in value)
+
+
+def _unique(values):
+    """ The values without duplicates, in order """
+    return list(OrderedDict.fromkeys(values))
+
+
+@api.route('/entitlements:token', methods=['PUT'])
+@auth.login_required
+def entitlements_token():
+    """
+    Issue a signed token of the valid entitlements of the user, that
+    downstream services verify offline (see enma.entitlement.verifier)
+    """
+    expiration = current_app.config['ENTITLEMENT_TOKEN_TTL']
+    return json_response({
+        'token': issue_token(g.current_user.id, g.current_user.username,
+                             expiration),
+        'expiration': expiration}), 201
+
+
+@api.route('/entitlements:key', methods=['GET'])
+@auth.login_required
+def entitlements_key():
+    """
+    Respond with the key to verify entitlement tokens with - the key is a
+    shared secret, so only administrators (service accounts) get it
+    """
+    if not g.current_user.is_administrator():
+        return forbidden('Entitlement token key')
+    kid, key = signing_key()
+    return json_response({'keys': [{'kid': kid, 'alg': 'HS256', 'key': key}]})
+
+
+@api.route('/entitlements:feed', methods=['GET'])
+@auth.login_required
+def entitlements_feed():
+    """
+    Respond with the changes of the entitlements of the user as they happen
+
+    Clients accepting text/event-stream get server-sent events for
+    ENTITLEMENT_FEED_DURATION seconds. Other clients long poll: the
+    response is sent with the first events or after timeout seconds (at
+    most ENTITLEMENT_FEED_TIMEOUT) without events. Clients pass the version
+    of their last response; if it is outdated a resync event is sent at
+    once, the changes happened while the client was not listening.
+    """
+    config = current_app.config
+    feed = Feed(g.current_user.id)
+    # the feed reads on its own connections, release the request's one
+    # before waiting
+    db.session.close()
+    if request.accept_mimetypes.best_match(
+            ['application/json', 'text/event-stream']) == 'text/event-stream':
+        return Response(
+            stream_with_context(feed.stream(
+                config['ENTITLEMENT_FEED_DURATION'],
+                config['ENTITLEMENT_FEED_HEARTBEAT'])),
+            mimetype='text/event-stream',
+            headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+    try:
+        limit = config['ENTITLEMENT_FEED_TIMEOUT']
+        timeout = min(request.args.get('timeout', limit, type=float), limit)
+        known = request.args.get('version', type=int)
+        version = feed.version()
+        if known is not None and known != version:
+            events = [{'type': RESYNC, 'name': None, 'expiry': None}]
+        else:
+            events = feed.wait(max(0, timeout))
+            if events:
+                version = feed.version()
+    finally:
+        feed.close()
+    return json_response({'events': events, 'version': version})
 
 
+@api.route('/caches', methods=['GET'])
+@auth.login_required
+def get_caches():
+    """
+    Respond with the statistics of the in-process caches (of this worker
+    process) - for sizing them
+    """
+    if not g.current_user.is_administrator():
+        return forbidden('Cache statistics')
+    return json_response({'entitlement_decisions': decisions.stats(),
+                          'auth_tokens': token_cache.stats(),
+                          'identities': identity_cache.stats(),
+                          'credentials': credentials.cache.stats(),
+                          'roles': role_table.stats()})
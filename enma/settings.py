@@ -13,6 +13,90 @@ class Config(object):
     DEBUG_TB_INTERCEPT_REDIRECTS = False
     CACHE_TYPE = 'simple'  # Can be "memcached", "redis", etc.
 
+    # Activities are buffered and written in bulk by a background worker
+    ACTIVITY_WRITER_SYNC = False  # True: write every activity immediately
+    ACTIVITY_QUEUE_SIZE = 10000  # max. number of buffered activities
+    ACTIVITY_BATCH_SIZE = 500  # a full batch triggers a flush
+    ACTIVITY_FLUSH_INTERVAL = 2.0  # seconds between two flushes
+    ACTIVITY_OVERFLOW = 'inline'  # if the buffer is full: inline|block|drop
+    ACTIVITY_BLOCK_TIMEOUT = 1.0  # seconds to wait for the 'block' policy
+    ACTIVITY_COUNT_CACHE_TTL = 300  # seconds the shown total may lag behind
+    # Older activities are moved to monthly archive segments (compaction)
+    ACTIVITY_RETENTION_DAYS = 365
+    ACTIVITY_ARCHIVE_DIR = os.path.join(PROJECT_ROOT, 'archive')
+    ACTIVITY_COMPACTION_BATCH = 1000  # activities moved per transaction
+    ACTIVITY_EXPORT_BATCH = 1000  # activities read per query when exporting
+    # REST API of the activities (log shipping)
+    ACTIVITY_API_PAGE = 1000  # activities per page by default
+    ACTIVITY_API_PAGE_LIMIT = 10000  # max. activities per page
+    # seconds until activities of other processes are surely written - more
+    # than ACTIVITY_FLUSH_INTERVAL plus the time failed writes are retried
+    # (the activities this process has not written yet are waited for)
+    ACTIVITY_API_SETTLE = 60
+
+    # Role permissions are kept in memory, reloaded after changes or TTL
+    ROLE_TABLE_TTL = 60  # seconds
+
+    # Verified REST tokens are cached until expiry but at most TTL seconds
+    AUTH_TOKEN_CACHE_SIZE = 10000  # 0 disables the cache
+    AUTH_TOKEN_CACHE_TTL = 10  # seconds changes in other processes may lag
+    # Users of browser sessions, loaded without a query on every page view
+    IDENTITY_CACHE_SIZE = 10000  # 0 disables the cache
+    IDENTITY_CACHE_TTL = 60  # seconds changes in other processes may lag
+    # Successful HTTP Basic verifications (REST) are cached for a short time
+    CREDENTIAL_CACHE_SIZE = 1000  # 0 disables the cache
+    CREDENTIAL_CACHE_TTL = 60
+    # bcrypt checks of the REST API run on a bounded pool of threads
+    BCRYPT_POOL_SIZE = 4  # 0 checks on the request thread
+    BCRYPT_POOL_BACKLOG = 16  # more pending checks are rejected (503)
+    BCRYPT_POOL_TIMEOUT = 10  # seconds
+
+    # Entitlement decisions of the REST API are cached in memory
+    ENTITLEMENT_CACHE_SIZE = 100000  # 0 disables the cache
+    # seconds other processes' changes may lag (invalidation is per process),
+    # entries expire with their entitlement at the latest
+    ENTITLEMENT_CACHE_TTL = 5
+    ENTITLEMENT_CHECK_LIMIT = 1000  # max. users x names of a batch check
+    # Signed entitlement tokens, verified offline by downstream services
+    ENTITLEMENT_TOKEN_TTL = 300  # seconds until a token must be refreshed
+    ENTITLEMENT_TOKEN_KEY = None  # None: derived from SECRET_KEY
+    # Reported usage is counted in memory and written in bulk
+    ENTITLEMENT_USAGE_SYNC = False  # True: write every report immediately
+    ENTITLEMENT_USAGE_SHARDS = 8  # rows per entitlement, one per process
+    ENTITLEMENT_USAGE_FLUSH_INTERVAL = 1.0  # seconds
+    ENTITLEMENT_USAGE_CACHE_SIZE = 100000
+    ENTITLEMENT_USAGE_CACHE_TTL = 5  # seconds other processes' usage may lag
+    # Change feed of the entitlements (long polling, server-sent events)
+    ENTITLEMENT_FEED_TIMEOUT = 30  # max. seconds a long poll waits
+    ENTITLEMENT_FEED_HEARTBEAT = 15  # seconds between heartbeat events
+    ENTITLEMENT_FEED_DURATION = 300  # seconds until the client reconnects
+
+    REST_JSON_PRETTY = False  # indent REST responses (always in debug)
+
+    MEMBERS_PER_PAGE = 50  # users per page of the user list
+    # Last seen of the users is marked in memory and written in bulk
+    LAST_SEEN_ENABLED = True
+    LAST_SEEN_INTERVAL = 60  # seconds, at most one write per user
+    LAST_SEEN_FLUSH_INTERVAL = 5.0  # seconds between two writes
+    USERS_PAGE_LIMIT = 1000  # max. users per page of the REST user list
+    USERS_BULK_LIMIT = 1000  # max. users changed by one bulk PATCH
+    # SQL statements and database time per request and endpoint
+    SQL_INSTRUMENTATION = False
+    SQL_SLOW_QUERY = 0.5  # seconds, slower statements are logged
+    SQL_REPEATED_STATEMENTS = 5  # executions of a statement flagged as N+1
+    SQL_HEADERS = False  # add X-SQL-Statements/-Time/-Repeated to responses
+    # Metrics scraped from /metrics (Prometheus text format)
+    METRICS_ENABLED = True
+    METRICS_DIR = os_env.get('METRICS_DIR')  # shared by gunicorn workers
+    METRICS_FLUSH_INTERVAL = 5.0  # seconds between two process snapshots
+    # None: scraping is open in dev/test and refused otherwise
+    METRICS_TOKEN = os_env.get('METRICS_TOKEN')
+
+    # Bulk import of users
+    USER_IMPORT_BATCH = 1000  # users inserted per transaction
+    USER_IMPORT_PROCESSES = 4  # manage.py import: hashing processes, 0: none
+    USER_IMPORT_LIMIT = 1000  # max. records of an import by the REST API
+
     DB_NAME = 'enma'
 
     DB_PROTOCOL = 'mysql://'
@@ -62,6 +146,13 @@ class Config(object):
     MAIL_PASSWORD = os_env['MAIL_PASSWORD']
     MAIL_DEFAULT_SENDER = MAIL_USERNAME
     MAIL_SUBJECT_PREFIX = '[ENMA] '
+    # Emails are queued in the outbox and sent by: manage.py mail_worker
+    MAIL_OUTBOX_SYNC = False  # True: send at once on the request thread
+    MAIL_OUTBOX_BATCH = 50  # messages sent per batch
+    MAIL_OUTBOX_POLL = 5  # seconds between two looks at an empty outbox
+    MAIL_OUTBOX_LEASE = 300  # seconds until a claimed batch is sent again
+    MAIL_OUTBOX_MAX_ATTEMPTS = 8
+    MAIL_OUTBOX_BACKOFF = 60  # seconds until the first retry, then doubled
 
     # Oauth2 Authentication Provider and Switches
     # if the respective *_ID is set the privider is switched on/off
@@ -93,6 +184,20 @@ class DevConfig(Config):
     #DB_PATH = os.path.join(Config.PROJECT_ROOT, DB_NAME)
     #SQLALCHEMY_DATABASE_URI = 'sqlite:///{0}'.format(DB_PATH)
     DEBUG_TB_ENABLED = True
+    DEBUG_TB_PANELS = (
+        'flask_debugtoolbar.panels.versions.VersionDebugPanel',
+        'flask_debugtoolbar.panels.timer.TimerDebugPanel',
+        'flask_debugtoolbar.panels.headers.HeaderDebugPanel',
+        'flask_debugtoolbar.panels.request_vars.RequestVarsDebugPanel',
+        'flask_debugtoolbar.panels.config_vars.ConfigVarsDebugPanel',
+        'flask_debugtoolbar.panels.template.TemplateDebugPanel',
+        'flask_debugtoolbar.panels.sqlalchemy.SQLAlchemyDebugPanel',
+        'enma.instrumentation.SQLStatsDebugPanel',
+        'flask_debugtoolbar.panels.logger.LoggingPanel',
+        'flask_debugtoolbar.panels.profiler.ProfilerDebugPanel',
+    )
+    SQL_INSTRUMENTATION = True
+    SQL_HEADERS = True
 
     ASSETS_DEBUG = True  # Don't bundle/minify static assets
     CACHE_TYPE = 'simple'  # Can be "memcached", "redis", etc.
@@ -112,4 +217,10 @@ class TestConfig(Config):
     MAIL_DEFAULT_SENDER = 'test@test.org'
     SQLALCHEMY_DATABASE_URI = 'sqlite://'
     BCRYPT_LOG_ROUNDS = 1  # For faster tests
+    ACTIVITY_WRITER_SYNC = True  # Recorded activities are visible at once
+    ACTIVITY_API_SETTLE = 0  # Written synchronously
+    USER_IMPORT_PROCESSES = 0  # Do not fork while testing
+    MAIL_OUTBOX_SYNC = True  # Sent emails are recorded at once
+    ENTITLEMENT_USAGE_SYNC = True  # Reported usage is visible at once
+    LAST_SEEN_ENABLED = False  # No background writes to the test database
     WTF_CSRF_ENABLED = False  # Allows form testing
\ No newline at end of file
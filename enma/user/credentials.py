@@ -0,0 +1,133 @@
+# -*- coding: utf-8 -*-
+"""
+Module: Verification of username/password credentials for the REST API
+
+Checking a bcrypt password hash is expensive on purpose. API clients using
+HTTP Basic authentication send their credentials with every request, so
+
+* successful verifications are cached for a short time, the cache key is a
+  keyed digest of username and password - the password itself is never
+  stored; set_password invalidates the cached entries of a user.
+* the remaining bcrypt work runs on a small pool of threads with a bounded
+  backlog. A burst of (bad) logins is rejected once the backlog is full
+  instead of tying up all request workers.
+"""
+import hashlib
+import hmac
+import os
+import threading
+from multiprocessing import TimeoutError
+from multiprocessing.pool import ThreadPool
+
+from enma.caching import TTLCache
+from enma.compat import text_type
+from enma.user.models import UserIdentity, check_password_hash
+
+
+class CredentialsBusy(Exception):
+    """ Raised if the bcrypt pool has no capacity left """
+    pass
+
+
+class CredentialVerifier(object):
+    """ Verify passwords on a bounded pool and remember the successes
+
+    Configuration (read from the application config):
+
+        CREDENTIAL_CACHE_SIZE, CREDENTIAL_CACHE_TTL: see TTLCache
+        BCRYPT_POOL_SIZE: number of bcrypt threads, 0 checks in the caller
+        BCRYPT_POOL_BACKLOG: max. number of pending checks
+        BCRYPT_POOL_TIMEOUT: seconds to wait for a check
+    """
+
+    def __init__(self, app=None):
+        self.cache = TTLCache('CREDENTIAL_CACHE', maxsize=1000, ttl=60)
+        self.pool_size = 4
+        self.backlog = 16
+        self.timeout = 10
+        self._secret = ''
+        self._pool = None
+        self._pid = None
+        self._slots = threading.BoundedSemaphore(self.backlog)
+        self._lock = threading.Lock()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.cache.init_app(app)
+        self.pool_size = app.config.get('BCRYPT_POOL_SIZE', self.pool_size)
+        self.backlog = app.config.get('BCRYPT_POOL_BACKLOG', self.backlog)
+        self.timeout = app.config.get('BCRYPT_POOL_TIMEOUT', self.timeout)
+        self._secret = app.config['SECRET_KEY']
+        self._slots = threading.BoundedSemaphore(self.backlog)
+
+    def _key(self, username, password):
+        message = b'\0'.join(
+            part.encode('utf-8') if isinstance(part, text_type) else part
+            for part in (username, password))
+        return hmac.new(self._secret, message, hashlib.sha256).hexdigest()
+
+    def lookup(self, username, password):
+        """ Get the identity of previously verified credentials
+
+        Returns:
+            UserIdentity: or None if not cached (or invalidated meanwhile)
+        """
+        identity = self.cache.get(self._key(username, password))
+        if identity is not None and identity.is_current():
+            return identity
+        return None
+
+    def verify(self, user, password):
+        """ Check the password of a user (on the bcrypt pool)
+
+        A successful check is cached.
+
+        Returns:
+            UserIdentity: if the password matches, otherwise None
+        Raises:
+            CredentialsBusy: if the pool is exhausted
+        """
+        if not self._check_password(user, password):
+            return None
+        identity = UserIdentity.from_user(user)
+        self.cache.set(self._key(user.username, password), identity)
+        return identity
+
+    def _check_password(self, user, password):
+        if user.password is None:
+            return False
+        if self.pool_size <= 0:
+            return user.check_password(password)
+        if not self._slots.acquire(False):
+            raise CredentialsBusy()
+        try:
+            result = self._get_pool().apply_async(
+                self._checked, (user.password, password))
+        except Exception:
+            self._slots.release()
+            raise
+        try:
+            return result.get(self.timeout)
+        except TimeoutError:
+            raise CredentialsBusy()
+
+    def _checked(self, password_hash, password):
+        # the slot is held until the check is done, also if the caller
+        # gave up waiting - the bcrypt work keeps running on the pool
+        try:
+            return check_password_hash(password_hash, password)
+        finally:
+            self._slots.release()
+
+    def _get_pool(self):
+        pid = os.getpid()
+        with self._lock:
+            if self._pool is None or self._pid != pid:
+                # a pool does not survive a fork (e.g. gunicorn worker)
+                self._pool = ThreadPool(self.pool_size)
+                self._pid = pid
+        return self._pool
+
+
+credentials = CredentialVerifier()
@@ -0,0 +1,242 @@
+# -*- coding: utf-8 -*-
+"""
+Module: Bulk import of (locally authenticated) users
+
+Users are imported from CSV or JSON records with the keys username, email
+and optionally password, first_name, last_name, active and role.
+
+The import is built for tens of thousands of users at a time:
+
+* records are deduplicated within the import and against the database with
+  set based queries (one IN query per chunk, not one query per user)
+* passwords are bcrypt hashed in parallel by a pool of processes
+* users are inserted in large batches, each committed on its own; the rows
+  of a batch that conflict with users inserted meanwhile are reported
+* the report counts created users, lists per row errors and the throughput
+"""
+import csv
+import json
+import time
+from multiprocessing import Pool
+
+from flask import current_app
+from flask.ext.bcrypt import generate_password_hash
+from sqlalchemy.exc import IntegrityError
+
+from enma.database import db
+from enma.compat import text_type
+from enma.public.domain import compose_username
+from enma.user.models import User, Role
+
+FIELDS = ('username', 'email', 'password', 'first_name', 'last_name',
+          'active', 'role')
+LENGTHS = {'username': 80, 'email': 80, 'first_name': 40, 'last_name': 40}
+TRUE_VALUES = ('1', 'true', 'yes', 'y')
+
+
+class ImportReport(object):
+    """ The outcome of an import
+
+    Attributes:
+        created (int): Number of users created
+        errors (list): (row number, message) of rows that were not imported
+        seconds (float): Duration of the import
+    """
+
+    def __init__(self):
+        self.created = 0
+        self.errors = []
+        self.seconds = 0.0
+
+    @property
+    def rate(self):
+        """ Throughput in users per second """
+        return self.created / self.seconds if self.seconds else 0.0
+
+    def as_dict(self):
+        return {'created': self.created, 'failed': len(self.errors),
+                'errors': [{'row': row, 'message': message}
+                           for row, message in self.errors],
+                'seconds': round(self.seconds, 3),
+                'users_per_second': round(self.rate, 1)}
+
+
+def parse_csv(lines):
+    """ Read records from CSV lines with a header row """
+    return [dict((key, value.decode('utf-8') if value else value)
+                 for key, value in row.items() if key is not None)
+            for row in csv.DictReader(lines)]
+
+
+def parse_json(text):
+    """ Read records from a JSON list or an object with a 'users' list """
+    data = json.loads(text)
+    if isinstance(data, dict):
+        data = data.get('users', [])
+    if not isinstance(data, list):
+        raise ValueError('Expected a list of users')
+    return data
+
+
+def _hash_password(args):
+    password, rounds = args
+    return generate_password_hash(password, rounds)
+
+
+def _chunks(items, size):
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
+
+
+def _existing(column, values, chunk_size=500):
+    """ The subset of values that exist in a column - set based """
+    existing = set()
+    for chunk in _chunks(list(values), chunk_size):
+        existing.update(value for (value,) in
+                        db.session.query(column).filter(column.in_(chunk)))
+    return existing
+
+
+def _validate(records, report):
+    """ Normalize the records, report and drop the invalid ones
+
+    Returns:
+        list: (row number, record) of the valid records
+    """
+    valid = []
+    for number, record in enumerate(records, 1):
+        if not isinstance(record, dict):
+            report.errors.append((number, 'Not a record'))
+            continue
+        record = dict((key, record.get(key)) for key in FIELDS)
+        for key in FIELDS:
+            if record[key] is not None and not isinstance(record[key], bool):
+                record[key] = text_type(record[key]).strip()
+        username = record['username'] or ''
+        if username and '%' not in username:
+            username = compose_username(username, None, 'local')
+        record['username'] = username
+        record['email'] = record['email'] or ''
+        if not username or '@' not in record['email']:
+            report.errors.append((number, 'Username and email required'))
+            continue
+        too_long = [key for key, length in LENGTHS.items()
+                    if len(record[key] or '') > length]
+        if too_long:
+            report.errors.append((number, 'Too long: ' + ', '.join(too_long)))
+            continue
+        active = record['active']
+        if not isinstance(active, bool):
+            active = (active or '').lower() in TRUE_VALUES
+        record['active'] = active
+        valid.append((number, record))
+    return valid
+
+
+def _deduplicate(valid, report):
+    """ Drop records whose username or email is taken """
+    usernames = _existing(User.username, [r['username'] for _, r in valid])
+    emails = _existing(User.email, [r['email'] for _, r in valid])
+    unique = []
+    for number, record in valid:
+        if record['username'] in usernames:
+            report.errors.append((number, 'Username already registered'))
+        elif record['email'] in emails:
+            report.errors.append((number, 'Email already registered'))
+        else:
+            usernames.add(record['username'])
+            emails.add(record['email'])
+            unique.append((number, record))
+    return unique
+
+
+def _hash_passwords(records, processes, rounds):
+    passwords = [(record['password'], rounds) for record in records
+                 if record['password']]
+    if not passwords:
+        return
+    if processes > 0:
+        pool = Pool(processes)
+        try:
+            hashes = pool.map(_hash_password, passwords,
+                              chunksize=max(1, len(passwords) // processes))
+        finally:
+            pool.close()
+            pool.join()
+    else:
+        hashes = map(_hash_password, passwords)
+    hashes = iter(hashes)
+    for record in records:
+        record['password'] = next(hashes) if record['password'] else None
+
+
+def _insert(batch, report):
+    """ Insert a batch of (row number, record) in a transaction of its own
+
+    A user inserted concurrently since the deduplication fails the batch:
+    its records are deduplicated again, the conflicts reported and the rest
+    inserted once more.
+    """
+    try:
+        _insert_records(batch)
+    except IntegrityError:
+        db.session.rollback()
+        batch = _deduplicate(batch, report)
+        try:
+            _insert_records(batch)
+        except IntegrityError:
+            db.session.rollback()
+            report.errors.extend((number, 'Conflicting concurrent import')
+                                 for number, _ in batch)
+            return
+    report.created += len(batch)
+
+
+def _insert_records(batch):
+    if batch:
+        db.session.execute(User.__table__.insert(),
+                           [record for _, record in batch])
+        db.session.commit()
+
+
+def import_users(records, batch_size=None, processes=None):
+    """ Import users in bulk
+
+    Args:
+        records (list): dictionaries with the keys of FIELDS
+        batch_size (int): users inserted per transaction
+          (default USER_IMPORT_BATCH)
+        processes (int): processes hashing passwords, 0 hashes in this
+          process (default USER_IMPORT_PROCESSES)
+    Returns:
+        ImportReport: The outcome of the import
+    """
+    config = current_app.config
+    if batch_size is None:
+        batch_size = config['USER_IMPORT_BATCH']
+    if processes is None:
+        processes = config['USER_IMPORT_PROCESSES']
+    report = ImportReport()
+    started = time.time()
+
+    valid = _deduplicate(_validate(records, report), report)
+    roles = dict(db.session.query(Role.name, Role.id))
+    default_role = db.session.query(Role.id).filter_by(default=True).scalar()
+    rows = []
+    for number, record in valid:
+        role_id = roles.get(record['role']) if record['role'] else default_role
+        if record['role'] and role_id is None:
+            report.errors.append((number, 'Unknown role %s' % record['role']))
+            continue
+        del record['role']
+        record['role_id'] = role_id
+        rows.append((number, record))
+
+    _hash_passwords([record for _, record in rows], processes,
+                    config['BCRYPT_LOG_ROUNDS'])
+    for batch in _chunks(rows, batch_size):
+        _insert(batch, report)
+
+    report.errors.sort()
+    report.seconds = time.time() - started
+    return report
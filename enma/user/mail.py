@@ -2,17 +2,21 @@
 from flask.ext.mail import Message
 from flask import current_app, url_for
 from flask.ext.login import current_user
-from enma.extensions import mail
 from flask.templating import render_template
-from threading import Thread
 import time
 from enma.activity.models import record_user
+from enma.user.outbox import enqueue
+from enma.metrics.registry import metrics
+
+mails_queued = metrics.counter('enma_mail_queued_total',
+                               'Emails queued by template', ('template',))
 
 def send_email(to, subject, template, **kwargs):
     """
     @brief Send any email
-    
+
     All emails are prefixed and will be send from one general account.
+    The email is only queued, the mail worker sends it (see outbox).
     @param to addressee email address
     @param subject the subject of the email
     @param template the base path of the template without extension.
@@ -25,18 +29,8 @@ def send_email(to, subject, template, **kwargs):
                 recipients=[to])
     message.body = render_template(template + '.txt', **kwargs)
     message.html = render_template(template + '.html', **kwargs)
-    #with current_app.app_context():
-    mail.send(message)
-    #worker = Thread(target=send_async_email, args=[current_app, message])
-    #worker.start()
-
-
-def send_async_email(app, message):
-    """
-    Send emails asynchronously to have a responsive web application
-    """
-    with app.app_context():
-        mail.send(message)
+    enqueue(message)
+    mails_queued.inc((template,))
 
 
 def request_email_confirmation(user=None):
@@ -3,12 +3,21 @@
 Module: User (and related) data and domain models
 """
 import datetime as dt
+import hashlib
+import logging
+import threading
+import time
 
 from flask.ext.login import UserMixin, AnonymousUserMixin
 from itsdangerous  import TimedJSONWebSignatureSerializer as Serializer
 from flask import current_app
+from sqlalchemy import event, inspect
+from sqlalchemy.orm import Session, object_session
 
 from enma.extensions import bcrypt
+from enma.caching import TTLCache
+from enma.metrics.registry import metrics
+from sqlalchemy.exc import SQLAlchemyError
 from enma.database import (
     Column,
     db,
@@ -19,6 +28,17 @@ from enma.database import (
 )
 
 
+bcrypt_seconds = metrics.histogram(
+    'enma_bcrypt_seconds', 'Time of the bcrypt password hash checks',
+    buckets=(0.01, 0.025, 0.05, 0.1, 0.2, 0.3, 0.5, 1.0, 2.0))
+
+
+def check_password_hash(password_hash, value):
+    """ Check a password against its bcrypt hash (timed) """
+    with bcrypt_seconds.time():
+        return bcrypt.check_password_hash(password_hash, value)
+
+
 class Permission:
     """ Mapping of a symbolic name to a permission integer
 
@@ -93,6 +113,7 @@ class Role(SurrogatePK, Model):
             role.default = roles[r][1]
             db.session.add(role)
             db.session.commit()
+        role_table.invalidate()
 
 
     @staticmethod
@@ -105,6 +126,76 @@ class Role(SurrogatePK, Model):
         return map(lambda x: x.name, Role.query.all())
 
 
+class RoleTable(object):
+    """ Process wide, versioned table of role permissions
+
+    Permission checks resolve the role of a user against this table, so
+    the role row is not loaded again and again. The table is loaded once
+    (at the first request) and reloaded after a change of the roles
+    (version bump) or at the latest after ROLE_TABLE_TTL seconds, to pick
+    up changes made by other worker processes.
+
+    Attributes:
+        version (int): Bumped by every invalidation
+        loads (int): Number of times the table has been loaded
+        avoided (int): Number of role loads avoided by using the table
+    """
+
+    def __init__(self, ttl=60):
+        self.ttl = ttl
+        self.version = 0
+        self.loads = 0
+        self.avoided = 0
+        self._loaded = (None, 0)  # version and time of the last load
+        self._permissions = {}
+        self._lock = threading.Lock()
+
+    def init_app(self, app):
+        self.ttl = app.config.get('ROLE_TABLE_TTL', self.ttl)
+        self.invalidate()
+        app.before_first_request(self._warm_up)
+
+    def invalidate(self):
+        """ Force a reload of the table at the next permission check """
+        with self._lock:
+            self.version += 1
+
+    def permissions(self, role_id):
+        """ The permissions of a role
+
+        Returns:
+            int: or-ed field of permissions or None if the role is unknown
+        """
+        version, loaded_at = self._loaded
+        if version != self.version or loaded_at + self.ttl < time.time():
+            self._load()
+        else:
+            self.avoided += 1
+        return self._permissions.get(role_id)
+
+    def stats(self):
+        """ The table statistics as dictionary """
+        return {'version': self.version, 'roles': len(self._permissions),
+                'loads': self.loads, 'avoided': self.avoided}
+
+    def _load(self):
+        version = self.version
+        self._permissions = dict(
+            db.session.query(Role.id, Role.permissions).all())
+        self._loaded = (version, time.time())
+        self.loads += 1
+
+    def _warm_up(self):
+        try:
+            self._load()
+        except SQLAlchemyError:
+            logging.getLogger(__name__).exception('Loading roles failed')
+
+
+#: role id -> permissions, see User.can
+role_table = RoleTable()
+
+
 class User(UserMixin, SurrogatePK, Model):
     """ The User data model
 
@@ -121,7 +212,8 @@ class User(UserMixin, SurrogatePK, Model):
         password (str): bcryped (hashed and salted) user password - Only
           set for local users
         created_at (timestamp): When was the user created/registered
-        last_seen (timestamp): Last time the user logged in
+        last_seen (timestamp): Last time the user was seen (see
+          enma.user.presence)
         confirmed (boolean): 
         first_name (str): First name of the user
         last_name (str): Last name of the user
@@ -161,6 +253,8 @@ class User(UserMixin, SurrogatePK, Model):
            password (str): the users new password
         """
         self.password = bcrypt.generate_password_hash(password)
+        if self.id is not None:
+            invalidate_identity(self.id)  # cached credentials and tokens
 
     def check_password(self, value):
         """ Check if the passwords matches the users password
@@ -168,7 +262,7 @@ class User(UserMixin, SurrogatePK, Model):
         Agrs:
            password (str): the password to check
         """
-        return bcrypt.check_password_hash(self.password, value)
+        return check_password_hash(self.password, value)
 
     def generate_auth_token(self, expiration):
         """ Generate a token, that is sufficient for authentication
@@ -179,8 +273,7 @@ class User(UserMixin, SurrogatePK, Model):
         Args:
             expiration (timestamp): The expiration timestamp
         """
-        s = Serializer(current_app.config['SECRET_KEY'], expires_in=expiration)
-        return s.dumps( (self.username) )
+        return _dump_auth_token(self.username, expiration)
 
     @staticmethod
     def verify_auth_token(token):
@@ -190,12 +283,41 @@ class User(UserMixin, SurrogatePK, Model):
             User object: if and only if the token is valid and not expired
             It is not checked if the user is active.
         """
-        s = Serializer(current_app.config['SECRET_KEY'])
-        try:
-            data = s.loads(token)
-        except:
+        loaded = _load_auth_token(token)
+        if loaded is None:
             return None
-        return User.query.filter_by(username=data).first()
+        return User.query.filter_by(username=loaded[0]).first()
+
+    @staticmethod
+    def identify_auth_token(token):
+        """ Verify an authentication token - cached, for the REST API
+
+        The identity of a verified token is cached until the token expires
+        (at most AUTH_TOKEN_CACHE_TTL seconds). Repeated requests with the
+        same token neither check the signature nor query the database.
+
+        Returns:
+            UserIdentity: if and only if the token is valid and not expired
+            It is not checked if the user is active.
+        """
+        if not isinstance(token, bytes):
+            token = token.encode('utf-8')
+        key = hashlib.sha256(token).hexdigest()
+        identity = token_cache.get(key)
+        if identity is not None and identity.is_current():
+            return identity
+        loaded = _load_auth_token(token)
+        if loaded is None:
+            return None
+        username, header = loaded
+        user = User.query.filter_by(username=username).first()
+        if user is None:
+            return None
+        identity = UserIdentity.from_user(user)
+        ttl = header.get('exp', 0) - time.time()
+        if ttl > 0:
+            token_cache.set(key, identity, ttl=ttl)
+        return identity
 
     @property
     def full_name(self):
@@ -213,8 +335,12 @@ class User(UserMixin, SurrogatePK, Model):
         Returns:
             boolean: True if the user has *all* permissions
         """
-        return self.role is not None and \
-            (self.role.permissions & permissions) == permissions
+        role = self.__dict__.get('role')
+        if role is not None:  # loaded or just assigned - no query needed
+            granted = role.permissions
+        else:
+            granted = role_table.permissions(self.role_id)
+        return granted is not None and (granted & permissions) == permissions
 
     def is_administrator(self):
         """ Check if the user is the super administrator
@@ -244,6 +370,7 @@ class User(UserMixin, SurrogatePK, Model):
         if not role:
             raise Exception('Role %s does not exist' % name)
         self.role = role
+        role_table.invalidate()
 
     @property
     def nickname(self):
@@ -262,6 +389,246 @@ class User(UserMixin, SurrogatePK, Model):
             return 'not-set'
 
 
+_PENDING = 'identity_invalidations'
+
+
+def _invalidate_changed(target, user_id=None):
+    """ Invalidate at flush and again after the commit - an identity read
+    by a concurrent request meanwhile (the old row) does not survive
+    """
+    invalidate_identity(user_id)
+    session = object_session(target)
+    if session is not None:
+        session.info.setdefault(_PENDING, set()).add(user_id)
+
+
+@event.listens_for(User, 'after_update')
+def _user_updated(mapper, connection, target):
+    state = inspect(target)
+    if any(state.attrs[name].history.has_changes()
+           for name in ('username', 'active', 'role', 'role_id',
+                        'email_validated', 'password')):
+        _invalidate_changed(target, target.id)
+
+
+@event.listens_for(User, 'after_delete')
+def _user_deleted(mapper, connection, target):
+    _invalidate_changed(target, target.id)
+
+
+@event.listens_for(Role, 'after_update')
+def _role_updated(mapper, connection, target):
+    role_table.invalidate()
+    _invalidate_changed(target)
+
+
+@event.listens_for(Session, 'after_commit')
+def _invalidate_committed(session):
+    for user_id in session.info.pop(_PENDING, ()):
+        invalidate_identity(user_id)
+
+
+@event.listens_for(Session, 'after_soft_rollback')
+def _forget_pending(session, previous_transaction):
+    session.info.pop(_PENDING, None)
+
+
+@event.listens_for(Role, 'after_insert')
+@event.listens_for(Role, 'after_delete')
+def _role_inserted_or_deleted(mapper, connection, target):
+    role_table.invalidate()
+
+
+#: verified REST tokens - token digest -> UserIdentity
+token_cache = TTLCache('AUTH_TOKEN_CACHE', maxsize=10000, ttl=10)
+
+#: users of browser sessions - user id -> UserIdentity, see load_identity
+identity_cache = TTLCache('IDENTITY_CACHE', maxsize=10000, ttl=60)
+
+#: identity generations - bumped to invalidate cached user identities
+_generations = {None: 0}
+_generations_lock = threading.Lock()
+
+#: users with a generation of their own, beyond all identities are
+#: invalidated and the generations of the users are forgotten
+MAX_GENERATIONS = 10000
+
+
+def invalidate_identity(user_id=None):
+    """ Invalidate the cached identities of a user
+
+    Args:
+        user_id (int): The user id, if not given all identities are
+          invalidated (e.g. a role has changed).
+    """
+    with _generations_lock:
+        if user_id is not None and len(_generations) > MAX_GENERATIONS:
+            generation = _generations[None]
+            _generations.clear()
+            _generations[None] = generation + 1
+            return
+        _generations[user_id] = _generations.get(user_id, 0) + 1
+
+
+def _identity_generation(user_id):
+    return (_generations[None], _generations.get(user_id, 0))
+
+
+_serializers = {}
+
+
+def _dump_auth_token(username, expiration):
+    s = Serializer(current_app.config['SECRET_KEY'], expires_in=expiration)
+    return s.dumps( (username) )
+
+
+def _load_auth_token(token):
+    """ Check the signature and expiry of a token
+
+    Returns:
+        tuple: (username, header) or None if the token is not valid
+    """
+    secret_key = current_app.config['SECRET_KEY']
+    s = _serializers.get(secret_key)
+    if s is None:
+        s = _serializers[secret_key] = Serializer(secret_key)
+    try:
+        return s.loads(token, return_header=True)
+    except:
+        return None
+
+
+class UserIdentity(UserMixin):
+    """ A detached, read only snapshot of a user
+
+    It carries what is needed to authenticate and authorize a request,
+    without touching the database. A snapshot is current as long as
+    the user and the roles are not changed (see invalidate_identity).
+
+    Attributes:
+        id (int): The user id
+        username (str): The login name of the user (long form)
+        active (boolean): Only active user can log in.
+        email_validated (boolean): Flag if the email address is validated
+        role (str): The name of the users role
+        permissions (int): or-ed field of permissions of the role
+    """
+
+    def __init__(self, id, username, active=True, email_validated=False,
+                 role=None, permissions=0x00):
+        self.id = id
+        self.username = username
+        self.active = active
+        self.email_validated = email_validated
+        self.role = role
+        self.permissions = permissions
+        self.generation = _identity_generation(id)
+
+    @classmethod
+    def from_user(cls, user):
+        """ Take a snapshot of a user object """
+        role = user.role
+        return cls(user.id, user.username, active=user.active,
+                   email_validated=user.email_validated,
+                   role=role.name if role is not None else None,
+                   permissions=role.permissions if role is not None else 0)
+
+    def __repr__(self):
+        return '<UserIdentity({username!r})>'.format(username=self.username)
+
+    def __eq__(self, other):
+        return getattr(other, 'id', None) == self.id and \
+            getattr(other, 'username', None) == self.username
+
+    def __ne__(self, other):
+        return not self.__eq__(other)
+
+    def is_current(self):
+        """ Check if the snapshot is still valid """
+        return self.generation == _identity_generation(self.id)
+
+    def generate_auth_token(self, expiration):
+        """ Generate a token, see User.generate_auth_token """
+        return _dump_auth_token(self.username, expiration)
+
+    def can(self, permissions):
+        """ Check if a user has a set of permissions, see User.can """
+        return self.role is not None and \
+            (self.permissions & permissions) == permissions
+
+    def is_administrator(self):
+        """ Check if the user is the super administrator """
+        return self.can(Permission.ADMINISTRATOR)
+
+    @property
+    def nickname(self):
+        """ The (short) username reduced by the authentication provider """
+        return self.username.split('%')[0]
+
+    @property
+    def auth_provider(self):
+        """ The authentication provider """
+        parts = self.username.split('%')
+        return parts[1] if len(parts) > 1 else 'not-set'
+
+    def is_locally_authenticated(self):
+        """ Check if the user authenticates locally (using the password) """
+        return 'local' == self.auth_provider
+
+
+class SessionUser(UserIdentity):
+    """ The user of a browser session (see load_identity)
+
+    Authentication, authorization and the navigation use the identity
+    snapshot only. Anything else (names, email, password checks ...) is
+    delegated to the user object, loaded on first use within the request.
+    Change the user object - User.get_by_id(current_user.id) - not this.
+    """
+    _user = None
+
+    @classmethod
+    def of(cls, identity):
+        """ A per request copy of a (cached, shared) identity """
+        session_user = cls.__new__(cls)
+        session_user.__dict__.update(identity.__dict__)
+        return session_user
+
+    @property
+    def user(self):
+        """ The user object """
+        if self._user is None:
+            self._user = User.get_by_id(self.id)
+        return self._user
+
+    def __getattr__(self, name):
+        if name.startswith('__'):
+            raise AttributeError(name)
+        return getattr(self.user, name)
+
+
+def load_identity(user_id):
+    """ Load the user of a browser session - cached
+
+    The identity is cached for at most IDENTITY_CACHE_TTL seconds and
+    invalidated by any change of the user or the roles in this process
+    (see invalidate_identity), so page views do not query the user.
+
+    Returns:
+        SessionUser: or None if there is no such user
+    """
+    identity = identity_cache.get(user_id)
+    if identity is None or not identity.is_current():
+        generation = _identity_generation(user_id)
+        user = User.get_by_id(user_id)
+        if user is None:
+            return None
+        identity = UserIdentity.from_user(user)
+        # changed while loading: the next request loads it again
+        identity.generation = generation
+        identity_cache.set(user_id, identity)
+    return SessionUser.of(identity)
+
+
 class AnonymousUser(AnonymousUserMixin):
     """ Anonymous User to be used if no user has been logged in. """
     username = 'anonymous'
@@ -0,0 +1,231 @@
+# -*- coding: utf-8 -*-
+"""
+Module: Durable queue of outbound emails
+
+Request handlers only enqueue messages - a row in the outbox table. The
+messages are sent by a separate worker process (``manage.py mail_worker``)
+that keeps one SMTP connection open and sends the queued messages in
+batches. A message that cannot be sent is retried with exponential backoff
+and marked failed once the attempts are exhausted or the server rejected it
+permanently (5xx). Sent messages are removed from the outbox.
+
+Claiming a batch sets a lease (a token and the point in time until the
+batch is owned), so several workers can share the outbox and the messages
+of a crashed worker are picked up again once the lease expired.
+
+With MAIL_OUTBOX_SYNC the messages are sent at once, not queued (tests).
+"""
+import datetime as dt
+import json
+import smtplib
+import threading
+import uuid
+
+from flask import current_app
+from flask.ext.mail import Message
+from sqlalchemy import and_
+
+from enma.database import (
+    Column,
+    db,
+    Model,
+    SurrogatePK,
+)
+from enma.extensions import mail
+from enma.metrics.registry import metrics
+
+QUEUED = 'queued'
+SENDING = 'sending'
+FAILED = 'failed'
+
+mails_sent = metrics.counter(
+    'enma_mail_sent_total', 'Emails sent, retried later or failed',
+    ('result',))
+mail_send_seconds = metrics.histogram(
+    'enma_mail_send_seconds', 'Time of handing an email to the SMTP server')
+
+
+class OutboxMail(SurrogatePK, Model):
+    """ An email waiting to be sent """
+    __tablename__ = 'mail_outbox'
+    __table_args__ = (
+        # the worker claims the due messages
+        db.Index('ix_mail_outbox_status_due', 'status', 'due'),
+        {'extend_existing': True},
+    )
+    created_at = Column(db.DateTime, nullable=False, default=dt.datetime.utcnow)
+    sender = Column(db.String(120), nullable=True)
+    recipients = Column(db.Text, nullable=False)  # JSON list of addresses
+    subject = Column(db.String(255), nullable=False)
+    body = Column(db.Text, nullable=True)
+    html = Column(db.Text, nullable=True)
+    status = Column(db.String(10), nullable=False, default=QUEUED)
+    # next attempt if queued, end of the lease if sending
+    due = Column(db.DateTime, nullable=False, default=dt.datetime.utcnow)
+    lease = Column(db.String(32), nullable=True)
+    attempts = Column(db.Integer, nullable=False, default=0)
+    last_error = Column(db.String(255), nullable=True)
+
+    def __repr__(self):
+        return '<OutboxMail({0!r} {1})>'.format(self.subject, self.status)
+
+    @classmethod
+    def from_message(cls, message):
+        return cls(sender=message.sender,
+                   recipients=json.dumps(list(message.recipients)),
+                   subject=message.subject, body=message.body,
+                   html=message.html)
+
+    def to_message(self):
+        return Message(self.subject, recipients=json.loads(self.recipients),
+                       body=self.body, html=self.html, sender=self.sender)
+
+
+def enqueue(message):
+    """ Queue a flask-mail message for sending
+
+    Returns:
+        OutboxMail: the queued mail, None if it was sent at once
+    """
+    if current_app.config['MAIL_OUTBOX_SYNC']:
+        with mail_send_seconds.time():
+            mail.send(message)
+        mails_sent.inc(('sent',))
+        return None
+    return OutboxMail.from_message(message).save()
+
+
+class MailWorker(object):
+    """ Send the queued messages over a persistent SMTP connection
+
+    Configuration (read from the application config):
+
+        MAIL_OUTBOX_BATCH: messages claimed at once
+        MAIL_OUTBOX_POLL: seconds between two looks at an empty outbox
+        MAIL_OUTBOX_LEASE: seconds a worker owns a claimed batch
+        MAIL_OUTBOX_MAX_ATTEMPTS: attempts before a message failed
+        MAIL_OUTBOX_BACKOFF: seconds before the first retry, doubled
+          with every further attempt
+
+    Must run inside an application context.
+    """
+
+    def __init__(self, batch_size=None, poll_interval=None):
+        config = current_app.config
+        self.batch_size = batch_size or config['MAIL_OUTBOX_BATCH']
+        self.poll_interval = poll_interval or config['MAIL_OUTBOX_POLL']
+        self.lease_time = dt.timedelta(seconds=config['MAIL_OUTBOX_LEASE'])
+        self.max_attempts = config['MAIL_OUTBOX_MAX_ATTEMPTS']
+        self.backoff = config['MAIL_OUTBOX_BACKOFF']
+        self.sent = self.retried = self.failed = 0
+        self._connection = None
+        self._stopped = threading.Event()
+
+    def run(self, once=False):
+        """ Send batches until stopped (or the outbox is empty if once) """
+        self._stopped.clear()
+        try:
+            while not self._stopped.is_set():
+                metrics.ensure_worker()
+                if not self.send_batch():
+                    if once:
+                        break
+                    self._stopped.wait(self.poll_interval)
+        finally:
+            self.close()
+
+    def stop(self):
+        """ Stop after the current batch, e.g. from a signal handler """
+        self._stopped.set()
+
+    def claim(self):
+        """ Lease a batch of due messages
+
+        Returns:
+            list: the claimed OutboxMail objects
+        """
+        table = OutboxMail.__table__
+        now = dt.datetime.utcnow()
+        # queued and due or sending but the lease expired
+        due = and_(table.c.status.in_([QUEUED, SENDING]), table.c.due <= now)
+        ids = [row.id for row in db.session.execute(
+            table.select().with_only_columns([table.c.id]).where(due)
+            .order_by(table.c.due, table.c.id).limit(self.batch_size))]
+        if not ids:
+            db.session.commit()
+            return []
+        lease = uuid.uuid4().hex
+        # the condition is checked again - a concurrent worker may have won
+        db.session.execute(table.update().where(
+            and_(table.c.id.in_(ids), due)).values(
+                status=SENDING, lease=lease, due=now + self.lease_time))
+        db.session.commit()
+        return OutboxMail.query.filter_by(lease=lease) \
+            .order_by(OutboxMail.id).all()
+
+    def send_batch(self):
+        """ Claim and send one batch
+
+        Returns:
+            int: the number of claimed messages, 0 if none was due
+        """
+        batch = self.claim()
+        for outbox_mail in batch:
+            try:
+                self._send(outbox_mail.to_message())
+            except Exception as error:
+                self._retry_later(outbox_mail, error)
+            else:
+                db.session.delete(outbox_mail)
+                self.sent += 1
+                mails_sent.inc(('sent',))
+        db.session.commit()
+        return len(batch)
+
+    def _send(self, message):
+        with mail_send_seconds.time():
+            self._send_now(message)
+
+    def _send_now(self, message):
+        if self._connection is None:
+            self._connection = mail.connect().__enter__()
+        try:
+            self._connection.send(message)
+        except smtplib.SMTPServerDisconnected:
+            # the server closed the idle connection, reconnect once
+            self._connection = mail.connect().__enter__()
+            self._connection.send(message)
+
+    def _retry_later(self, outbox_mail, error):
+        outbox_mail.attempts += 1
+        outbox_mail.last_error = repr(error)[:255]
+        outbox_mail.lease = None
+        # the server answered - the connection is fine but retrying a
+        # permanent rejection is pointless
+        answered = isinstance(error, (smtplib.SMTPResponseException,
+                                      smtplib.SMTPRecipientsRefused))
+        rejected = isinstance(error, smtplib.SMTPRecipientsRefused) or \
+            (answered and error.smtp_code >= 500)
+        if not answered:
+            self.close()
+        if rejected or outbox_mail.attempts >= self.max_attempts:
+            outbox_mail.status = FAILED
+            self.failed += 1
+            mails_sent.inc(('failed',))
+            current_app.logger.error('Mail %s failed: %s', outbox_mail.id,
+                                     outbox_mail.last_error)
+        else:
+            outbox_mail.status = QUEUED
+            outbox_mail.due = dt.datetime.utcnow() + dt.timedelta(
+                seconds=self.backoff * 2 ** (outbox_mail.attempts - 1))
+            self.retried += 1
+            mails_sent.inc(('retried',))
+
+    def close(self):
+        """ Close the SMTP connection (it is reopened on demand) """
+        connection, self._connection = self._connection, None
+        if connection is not None:
+            try:
+                connection.__exit__(None, None, None)
+            except (smtplib.SMTPException, IOError):
+                pass
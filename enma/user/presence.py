@@ -0,0 +1,152 @@
+# -*- coding: utf-8 -*-
+""" Write-behind tracking of the last time users were seen
+
+Every request of an authenticated user (browser session or REST) marks
+the user as seen - in memory only. The write is deferred and coalesced:
+
+* a user is marked at most once per LAST_SEEN_INTERVAL seconds, further
+  requests within the interval cost a dictionary lookup
+* a background worker writes the marks every LAST_SEEN_FLUSH_INTERVAL
+  seconds with one executemany UPDATE, however many users were seen
+* a mark never moves last_seen backwards (another process may have
+  written a later one)
+* the remaining marks are written at exit; a forked worker process
+  (gunicorn) starts with no marks, the parent writes its own
+
+Configuration (read from the application config):
+
+    LAST_SEEN_ENABLED: track requests (False: last_seen is not updated)
+    LAST_SEEN_INTERVAL: seconds a user's last_seen may lag behind
+    LAST_SEEN_FLUSH_INTERVAL: seconds between two writes
+"""
+import datetime as dt
+import logging
+import threading
+
+from flask import g, _request_ctx_stack
+from sqlalchemy import and_, or_, bindparam
+
+from enma.background import Flusher
+from enma.database import db
+from enma.user.models import User
+
+logger = logging.getLogger(__name__)
+
+
+class LastSeenTracker(Flusher):
+    """ Mark users as seen and write the marks in bulk
+
+    Attributes:
+        touches (int): Number of requests that marked a user
+        written (int): Number of marks written (rows updated at most)
+        flushes (int): Number of bulk writes
+        failures (int): Number of failed writes (the marks are kept)
+    """
+    worker_name = 'last-seen'
+
+    def __init__(self, app=None):
+        Flusher.__init__(self)
+        self.enabled = True
+        self.interval = 60
+        self.flush_interval = 5.0
+        self.touches = self.written = self.flushes = 0
+        self._seen = {}  # user id -> last seen, not written yet
+        self._written = {}  # user id -> last seen written
+        self._lock = threading.Lock()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        config = app.config
+        Flusher.init_app(self, app)
+        self.enabled = config.get('LAST_SEEN_ENABLED', self.enabled)
+        self.interval = config.get('LAST_SEEN_INTERVAL', self.interval)
+        self.flush_interval = config.get('LAST_SEEN_FLUSH_INTERVAL',
+                                         self.flush_interval)
+        app.after_request(self._after_request)
+
+    def touch(self, user_id, now=None):
+        """ Mark a user as seen (now) """
+        now = now or dt.datetime.utcnow()
+        written = self._written.get(user_id)
+        if written is not None and \
+                (now - written).total_seconds() < self.interval:
+            return
+        self.ensure_worker()
+        with self._lock:
+            if user_id not in self._seen:
+                self.touches += 1
+            self._seen[user_id] = max(now, self._seen.get(user_id, now))
+
+    def pending(self):
+        """ The number of users whose mark is not written yet """
+        return len(self._seen)
+
+    def flush(self):
+        """ Write the marks in bulk - requires an application context
+
+        Returns:
+            int: The number of marks written
+        """
+        with self._lock:
+            seen, self._seen = self._seen, {}
+        if not seen:
+            return 0
+        table = User.__table__
+        statement = table.update().where(and_(
+            table.c.id == bindparam('user_id'),
+            or_(table.c.last_seen == None,
+                table.c.last_seen < bindparam('seen')))) \
+            .values(last_seen=bindparam('seen'))
+        try:
+            # a transaction of its own - no session is committed or rolled
+            # back by the flush
+            with db.engine.begin() as connection:
+                connection.execute(statement, [
+                    {'user_id': user_id, 'seen': seen[user_id]}
+                    for user_id in sorted(seen)])
+        except Exception:
+            self.failures += 1
+            logger.exception('Writing last seen of %d users failed',
+                             len(seen))
+            with self._lock:  # keep the marks for the next flush
+                for user_id, when in seen.items():
+                    self._seen[user_id] = max(when,
+                                              self._seen.get(user_id, when))
+            return 0
+        self._written.update(seen)
+        self._forget_written()
+        self.flushes += 1
+        self.written += len(seen)
+        return len(seen)
+
+    def _pending(self):
+        return bool(self._seen)
+
+    def _forget(self):
+        # forked (e.g. gunicorn worker): the parent owns the marks
+        with self._lock:
+            self._seen.clear()
+            self._written.clear()
+
+    def _forget_written(self):
+        # users not seen within the interval are marked again anyway
+        horizon = dt.datetime.utcnow() - dt.timedelta(seconds=self.interval)
+        for user_id, when in list(self._written.items()):
+            if when < horizon:
+                self._written.pop(user_id, None)
+
+    def _after_request(self, response):
+        if not self.enabled:
+            return response
+        # the user of the session if it was loaded, else the REST user
+        user = getattr(_request_ctx_stack.top, 'user', None) or \
+            g.get('current_user')
+        user_id = getattr(user, 'id', None)
+        if user_id is not None and user.is_authenticated():
+            self.touch(user_id)
+        return response
+
+
+#: the last seen tracker of the process
+last_seen = LastSeenTracker()
@@ -0,0 +1,138 @@
+# -*- coding: utf-8 -*-
+"""
+Module: Set based queries of users for listings
+
+Listings project the columns they display (plain rows, no User objects)
+and join the role in the same query, so a page of users costs exactly one
+query no matter how many rows it shows.
+"""
+from enma.database import db
+from enma.public.domain import split_username
+from enma.user.models import User, Role
+
+#: columns of a user listing, the role is joined as 'role' (its name)
+LISTING_COLUMNS = (User.id, User.username, User.first_name, User.last_name,
+                   User.email, User.email_validated, User.active,
+                   User.created_at)
+
+#: sort keys of a user listing - all unique together with the id
+SORT_COLUMNS = {
+    'username': (User.username,),
+    'email': (User.email,),
+    'created': (User.created_at, User.id),
+    'active': (User.active, User.id),
+    'validated': (User.email_validated, User.id),
+}
+
+TRUE_VALUES = ('1', 'true', 'yes', 'y')
+FALSE_VALUES = ('0', 'false', 'no', 'n')
+
+
+def parse_flag(value):
+    """ Parse a yes/no filter value
+
+    Returns:
+        boolean: or None if the value is empty or not a flag
+    """
+    value = (value or '').lower()
+    if value in TRUE_VALUES:
+        return True
+    if value in FALSE_VALUES:
+        return False
+    return None
+
+
+def user_listing(columns=LISTING_COLUMNS):
+    """ Query a projection of users with the name of their role joined """
+    return db.session.query(*(columns + (Role.name.label('role'),))) \
+        .outerjoin(Role, User.role_id == Role.id)
+
+
+def filter_users(query, active=None, role=None, provider=None,
+                 validated=None):
+    """ Filter a query of users
+
+    Args:
+        active (boolean): only (in)active users
+        role (str): only users with the role of this name
+        provider (str): only users of this authentication provider
+        validated (boolean): only users with (not) validated email address
+    """
+    if active is not None:
+        query = query.filter(User.active == active)
+    if validated is not None:
+        query = query.filter(User.email_validated == validated)
+    if role:
+        query = query.filter(Role.name == role)
+    if provider:
+        # username ends with %provider - % and _ are LIKE wildcards
+        escaped = provider.replace('#', '##').replace('%', '#%') \
+            .replace('_', '#_')
+        query = query.filter(User.username.like('%#%' + escaped,
+                                                escape='#'))
+    return query
+
+
+def listing_row(row):
+    """ Make a dictionary of a listing row, with the derived user fields """
+    member = row._asdict()
+    member['nickname'], member['auth_provider'] = \
+        split_username(row.username)
+    member['full_name'] = u'{0} {1}'.format(row.first_name, row.last_name)
+    return member
+
+
+#: fields of the REST representation of a user -> the columns they need
+FIELD_COLUMNS = {
+    'id': (User.id,),
+    'username': (User.username,),
+    'nickname': (User.username,),
+    'auth_provider': (User.username,),
+    'email': (User.email,),
+    'email_validated': (User.email_validated,),
+    'first_name': (User.first_name,),
+    'last_name': (User.last_name,),
+    'full_name': (User.first_name, User.last_name),
+    'active': (User.active,),
+    'role': (),  # joined by user_listing
+    'created_at': (User.created_at,),
+    'last_seen': (User.last_seen,),
+}
+
+
+def projection(fields, sort_columns=()):
+    """ The columns a listing of some fields needs (and the sort columns)
+
+    Args:
+        fields (list): names of FIELD_COLUMNS
+        sort_columns (tuple): columns the listing is ordered by
+    Raises:
+        ValueError: if a field is unknown
+    """
+    unknown = [field for field in fields if field not in FIELD_COLUMNS]
+    if unknown:
+        raise ValueError('Unknown fields: ' + ', '.join(unknown))
+    columns = [User.id]
+    for column in sum((FIELD_COLUMNS[field] for field in fields),
+                      tuple(sort_columns)):
+        if column.key not in [c.key for c in columns]:
+            columns.append(column)
+    return tuple(columns)
+
+
+def project_row(row, fields):
+    """ Make a dictionary of the fields of a listing row (see projection) """
+    values = row._asdict()
+    if 'username' in values:
+        values['nickname'], values['auth_provider'] = \
+            split_username(row.username)
+    if 'first_name' in values and 'last_name' in values:
+        values['full_name'] = u' '.join(
+            name for name in (row.first_name, row.last_name) if name)
+    result = {'id': row.id}
+    for field in fields:
+        value = values[field]
+        if hasattr(value, 'isoformat'):
+            value = value.isoformat()
+        result[field] = value
+    return result
@@ -11,8 +11,10 @@ from enma.user.models import User, Permission, Role
 from enma.user.forms import DeleteForm, EditForm, ChangePasswordForm, \
     UserAdminForm, SetPasswordForm
 from enma.user.forms import RestTokenForm
-from enma.database import db
+from enma.database import db, KeysetPagination
 from enma.utils import flash_errors
+from enma.user.queries import user_listing, filter_users, parse_flag, \
+    listing_row, SORT_COLUMNS
 from enma.activity.models import record_priviledge, record_authentication,\
     record_user
 from enma.user.mail import request_email_confirmation
@@ -31,8 +33,28 @@ def home():
 @login_required
 @permission_required(Permission.READ_USER)
 def members():
-    users = User.query.all()
-    return render_template("users/members.html", users=users)
+    filters = dict((name, request.args.get(name, ''))
+                   for name in ('active', 'role', 'provider', 'validated'))
+    sort = request.args.get('sort', 'username')
+    if sort not in SORT_COLUMNS:
+        sort = 'username'
+    query = filter_users(user_listing(),
+                         active=parse_flag(filters['active']),
+                         role=filters['role'], provider=filters['provider'],
+                         validated=parse_flag(filters['validated']))
+    pagination = KeysetPagination(query, SORT_COLUMNS[sort],
+                                  after=request.args.get('after'),
+                                  before=request.args.get('before'),
+                                  per_page=current_app.config[
+                                      'MEMBERS_PER_PAGE'],
+                                  descending=False)
+    filters['sort'] = sort
+    return render_template("users/members.html",
+                           users=[listing_row(row)
+                                  for row in pagination.items],
+                           pagination=pagination, filters=filters,
+                           roles=Role.list_of_role_names(),
+                           sort_keys=sorted(SORT_COLUMNS))
 
 
 @blueprint.route("/delete/<name>",  methods=["GET", "POST"])
@@ -46,7 +68,7 @@ def delete(name):
 @blueprint.route("/terminate", methods=["GET", "POST"])
 @login_required
 def terminate():
-    return _delete(current_user)
+    return _delete(User.get_by_id(current_user.id))
 
 
 def _delete(user):
@@ -74,7 +96,7 @@ def _delete(user):
 @blueprint.route("/profile/",  methods=["GET", "POST"])
 @login_required
 def profile():
-    user = current_user
+    user = User.get_by_id(current_user.id)
     edit_form = EditForm()
     if edit_form.apply.data:
         if edit_form.validate():
@@ -85,7 +107,7 @@ def profile():
             user.email = edit_form.email.data
             db.session.add(user)
             db.session.commit()
-            request_email_confirmation()
+            request_email_confirmation(user)
             record_user('Update Profile')
             flash('Your profile has been updated', 'info')
         else:
@@ -162,11 +184,12 @@ def password():
     Changing the password is only supported for the current user.
     """
 
-    chpwd_form = ChangePasswordForm(current_user)
+    user = User.get_by_id(current_user.id)
+    chpwd_form = ChangePasswordForm(user)
     if chpwd_form.setpwd.data:
         if chpwd_form.validate():
-            current_user.set_password(chpwd_form.password.data)
-            db.session.add(current_user)
+            user.set_password(chpwd_form.password.data)
+            db.session.add(user)
             db.session.commit()
             record_authentication('Change password')
             flash('Your password has been updated', 'info')
@@ -0,0 +1,59 @@
+# -*- coding: utf-8 -*-
+"""Version counters of resources, e.g. the entitlements of a user.
+
+A counter is bumped in the same transaction as the change of its resource,
+so a version check is a single primary key lookup, shared by all worker
+processes. Clients get the version as ETag and conditional requests are
+answered without loading the resource (see enma.rest.conditional).
+
+Usage: ::
+
+    @event.listens_for(Entitlement, 'after_update')
+    def _changed(mapper, connection, target):
+        bump_version(connection, 'entitlements', target.user_id)
+
+    current_version('entitlements', user_id)
+"""
+from sqlalchemy import and_
+from sqlalchemy.exc import IntegrityError
+
+from .database import Column, Model, db
+
+
+class ResourceVersion(Model):
+    """ The version of a resource (scope and key)
+
+    A resource without row has the version 0.
+    """
+    __tablename__ = 'resource_versions'
+    scope = Column(db.String(40), primary_key=True)
+    key = Column(db.Integer, primary_key=True, autoincrement=False)
+    version = Column(db.Integer, nullable=False, default=0)
+
+
+def bump_version(connection, scope, key):
+    """ Increment the version of a resource - on the connection of the
+    changing transaction (e.g. in a mapper event)
+    """
+    table = ResourceVersion.__table__
+    update = table.update().where(and_(
+        table.c.scope == scope, table.c.key == key)) \
+        .values(version=table.c.version + 1)
+    if connection.execute(update).rowcount:
+        return
+    try:
+        connection.execute(table.insert().values(scope=scope, key=key,
+                                                 version=1))
+    except IntegrityError:
+        # a concurrent first bump inserted the row meanwhile (the failed
+        # statement alone is rolled back, e.g. by MySQL/InnoDB)
+        connection.execute(update)
+
+
+def current_version(scope, key, connection=None):
+    """ The version of a resource - read by the session or a connection """
+    table = ResourceVersion.__table__
+    return (connection or db.session).execute(
+        table.select().with_only_columns([table.c.version])
+        .where(and_(table.c.scope == scope, table.c.key == key))) \
+        .scalar() or 0
@@ -1,8 +1,10 @@
 #!/usr/bin/env python
 # -*- coding: utf-8 -*-
 import os
+import signal
 import sys
 import subprocess
+import datetime as dt
 from flask.ext.script import Manager, Shell, Server
 from flask.ext.migrate import MigrateCommand
 from flask.ext.assets import ManageAssets
@@ -14,6 +16,12 @@ from enma.settings import DevConfig, ProdConfig
 from enma.database import db
 from enma.user.admin import establish_admin_defaults
 from enma.assets import assets
+from enma.activity.archive import ActivityArchive, compact
+from enma.activity import export as activity_export
+from enma.activity.models import record_export, record_import
+from enma.user.importer import import_users as _import_users
+from enma.user.importer import parse_csv, parse_json
+from enma.user.outbox import MailWorker
 
 if os.environ.get("ENMA_ENV") == 'prod':
     app = create_app(ProdConfig)
@@ -66,6 +74,104 @@ def set_admin(reset_password=False):
     Role.insert_roles()  # make sure we have all roles available
     establish_admin_defaults(reset_password=reset_password)
 
+
+@manager.command
+def compact_activities(days=None, batch=None, max_batches=0):
+    """
+    Move activities older than the retention period to the archive
+
+    Runs incrementally, every batch is moved in a transaction of its own.
+
+    :param days: retention period in days (default ACTIVITY_RETENTION_DAYS)
+    :param batch: activities per batch (default ACTIVITY_COMPACTION_BATCH)
+    :param max_batches: stop after that many batches, 0 means all
+    """
+    days = int(days or app.config['ACTIVITY_RETENTION_DAYS'])
+    batch = int(batch or app.config['ACTIVITY_COMPACTION_BATCH'])
+    before = dt.datetime.utcnow() - dt.timedelta(days=days)
+    archive = ActivityArchive(app.config['ACTIVITY_ARCHIVE_DIR'])
+    moved = compact(archive, before, batch_size=batch,
+                    max_batches=int(max_batches) or None)
+    print('{0} activities older than {1} archived'.format(moved, before))
+
+
+@manager.command
+def export_activities(output=None, format='csv', actor=None, category=None,
+                      since=None, until=None):
+    """
+    Export activities as CSV or NDJSON - streamed with constant memory
+
+    :param output: the file to write to (default standard output)
+    :param format: csv or ndjson
+    :param actor: only activities of this actor
+    :param category: only activities of this category (e.g. Authentication)
+    :param since: only activities at or after YYYY-MM-DD[THH:MM:SS]
+    :param until: only activities before YYYY-MM-DD[THH:MM:SS]
+    """
+    since = activity_export.parse_time(since) if since else None
+    until = activity_export.parse_time(until) if until else None
+    with app.test_request_context():
+        record_export('Export activities as %s' % format)
+    batches = activity_export.iter_batches(
+        actor=actor, category=category, since=since, until=until,
+        batch_size=app.config['ACTIVITY_EXPORT_BATCH'])
+    stream = open(output, 'wb') if output else sys.stdout
+    try:
+        for chunk in activity_export.FORMATTERS[format](batches):
+            stream.write(chunk)
+    finally:
+        if output:
+            stream.close()
+
+
+@manager.command
+def import_users(filename, batch=None, processes=None):
+    """
+    Import users in bulk from a CSV (with header row) or JSON file
+
+    :param filename: the file to import, *.json is read as JSON
+    :param batch: users per transaction (default USER_IMPORT_BATCH)
+    :param processes: processes hashing passwords (USER_IMPORT_PROCESSES)
+    """
+    with open(filename, 'rb') as stream:
+        if filename.endswith('.json'):
+            records = parse_json(stream.read())
+        else:
+            records = parse_csv(stream)
+    with app.test_request_context():
+        report = _import_users(
+            records, batch_size=int(batch) if batch else None,
+            processes=int(processes) if processes is not None else None)
+        record_import('Import %d users' % report.created)
+    for row, message in report.errors:
+        print('row {0}: {1}'.format(row, message))
+    print('{0} users created, {1} failed in {2:.1f}s ({3:.0f} users/s)'
+          .format(report.created, len(report.errors), report.seconds,
+                  report.rate))
+
+
+@manager.command
+def mail_worker(batch=None, poll=None, once=False):
+    """
+    Send the emails queued in the outbox - runs until terminated
+
+    :param batch: messages per batch (default MAIL_OUTBOX_BATCH)
+    :param poll: seconds between two looks at an empty outbox
+           (default MAIL_OUTBOX_POLL)
+    :param once: stop as soon as the outbox is empty
+    """
+    with app.test_request_context():
+        worker = MailWorker(batch_size=int(batch) if batch else None,
+                            poll_interval=float(poll) if poll else None)
+        # finish the current batch on termination
+        signal.signal(signal.SIGTERM, lambda signum, frame: worker.stop())
+        try:
+            worker.run(once=once)
+        except KeyboardInterrupt:
+            pass
+    print('{0} emails sent, {1} to be retried, {2} failed'.format(
+        worker.sent, worker.retried, worker.failed))
+
 manager.add_command('server', Server())
 manager.add_command('shell', Shell(make_context=_make_context))
 manager.add_command('db', MigrateCommand)
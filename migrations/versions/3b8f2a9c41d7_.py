@@ -0,0 +1,26 @@
+"""indexes for the keyset pagination of activities
+
+Revision ID: 3b8f2a9c41d7
+Revises: 5321a4ac197c
+Create Date: 2026-10-17 09:12:44.318207
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = '3b8f2a9c41d7'
+down_revision = '5321a4ac197c'
+
+from alembic import op
+import sqlalchemy as sa
+
+
+def upgrade():
+    op.create_index('ix_activities_timestamp', 'activities',
+                    ['timestamp'], unique=False)
+    op.create_index('ix_activities_actor_timestamp', 'activities',
+                    ['actor', 'timestamp'], unique=False)
+
+
+def downgrade():
+    op.drop_index('ix_activities_actor_timestamp', table_name='activities')
+    op.drop_index('ix_activities_timestamp', table_name='activities')
@@ -0,0 +1,39 @@
+"""outbox of emails
+
+Revision ID: 8d0c6e51a2f3
+Revises: 3b8f2a9c41d7
+Create Date: 2026-10-17 14:05:21.640113
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = '8d0c6e51a2f3'
+down_revision = '3b8f2a9c41d7'
+
+from alembic import op
+import sqlalchemy as sa
+
+
+def upgrade():
+    op.create_table('mail_outbox',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('created_at', sa.DateTime(), nullable=False),
+    sa.Column('sender', sa.String(length=120), nullable=True),
+    sa.Column('recipients', sa.Text(), nullable=False),
+    sa.Column('subject', sa.String(length=255), nullable=False),
+    sa.Column('body', sa.Text(), nullable=True),
+    sa.Column('html', sa.Text(), nullable=True),
+    sa.Column('status', sa.String(length=10), nullable=False),
+    sa.Column('due', sa.DateTime(), nullable=False),
+    sa.Column('lease', sa.String(length=32), nullable=True),
+    sa.Column('attempts', sa.Integer(), nullable=False),
+    sa.Column('last_error', sa.String(length=255), nullable=True),
+    sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index('ix_mail_outbox_status_due', 'mail_outbox',
+                    ['status', 'due'], unique=False)
+
+
+def downgrade():
+    op.drop_index('ix_mail_outbox_status_due', table_name='mail_outbox')
+    op.drop_table('mail_outbox')
@@ -0,0 +1,60 @@
+"""entitlements, entitlement types and organizations
+
+Revision ID: c4e97d3b5a10
+Revises: 8d0c6e51a2f3
+Create Date: 2026-10-17 15:31:07.228410
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = 'c4e97d3b5a10'
+down_revision = '8d0c6e51a2f3'
+
+from alembic import op
+import sqlalchemy as sa
+
+
+def upgrade():
+    op.create_table('organizations',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('name', sa.String(length=80), nullable=False),
+    sa.Column('description', sa.String(length=255), nullable=False),
+    sa.PrimaryKeyConstraint('id'),
+    sa.UniqueConstraint('name')
+    )
+    op.create_table('entitlement_types',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('name', sa.String(length=80), nullable=False),
+    sa.Column('description', sa.String(length=255), nullable=False),
+    sa.PrimaryKeyConstraint('id'),
+    sa.UniqueConstraint('name')
+    )
+    op.create_table('entitlements',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('name', sa.String(length=80), nullable=False),
+    sa.Column('type_id', sa.Integer(), nullable=False),
+    sa.Column('user_id', sa.Integer(), nullable=True),
+    sa.Column('organization_id', sa.Integer(), nullable=True),
+    sa.Column('status', sa.String(length=10), nullable=False),
+    sa.Column('description', sa.String(length=255), nullable=False),
+    sa.Column('capacity', sa.Integer(), nullable=True),
+    sa.Column('expiry', sa.DateTime(), nullable=True),
+    sa.Column('created_at', sa.DateTime(), nullable=False),
+    sa.ForeignKeyConstraint(['type_id'], ['entitlement_types.id'], ),
+    sa.ForeignKeyConstraint(['user_id'], ['users.id'], ),
+    sa.ForeignKeyConstraint(['organization_id'], ['organizations.id'], ),
+    sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index('ix_entitlements_user_name_status', 'entitlements',
+                    ['user_id', 'name', 'status'], unique=False)
+    op.create_index('ix_entitlements_organization_id', 'entitlements',
+                    ['organization_id'], unique=False)
+
+
+def downgrade():
+    op.drop_index('ix_entitlements_organization_id', table_name='entitlements')
+    op.drop_index('ix_entitlements_user_name_status',
+                  table_name='entitlements')
+    op.drop_table('entitlements')
+    op.drop_table('entitlement_types')
+    op.drop_table('organizations')
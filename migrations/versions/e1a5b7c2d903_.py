@@ -0,0 +1,28 @@
+"""usage of entitlements
+
+Revision ID: e1a5b7c2d903
+Revises: c4e97d3b5a10
+Create Date: 2026-10-17 17:12:40.108326
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = 'e1a5b7c2d903'
+down_revision = 'c4e97d3b5a10'
+
+from alembic import op
+import sqlalchemy as sa
+
+
+def upgrade():
+    op.create_table('entitlement_usage',
+    sa.Column('entitlement_id', sa.Integer(), nullable=False),
+    sa.Column('shard', sa.Integer(), autoincrement=False, nullable=False),
+    sa.Column('used', sa.BigInteger(), nullable=False),
+    sa.ForeignKeyConstraint(['entitlement_id'], ['entitlements.id'], ),
+    sa.PrimaryKeyConstraint('entitlement_id', 'shard')
+    )
+
+
+def downgrade():
+    op.drop_table('entitlement_usage')
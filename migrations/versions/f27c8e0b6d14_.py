@@ -0,0 +1,27 @@
+"""version counters of resources
+
+Revision ID: f27c8e0b6d14
+Revises: e1a5b7c2d903
+Create Date: 2026-10-17 18:40:55.921734
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = 'f27c8e0b6d14'
+down_revision = 'e1a5b7c2d903'
+
+from alembic import op
+import sqlalchemy as sa
+
+
+def upgrade():
+    op.create_table('resource_versions',
+    sa.Column('scope', sa.String(length=40), nullable=False),
+    sa.Column('key', sa.Integer(), autoincrement=False, nullable=False),
+    sa.Column('version', sa.Integer(), nullable=False),
+    sa.PrimaryKeyConstraint('scope', 'key')
+    )
+
+
+def downgrade():
+    op.drop_table('resource_versions')
@@ -0,0 +1,364 @@
+# -*- coding: utf-8 -*-
+"""Benchmark of the hot paths of enma at a growing number of users.
+
+The scenarios run against create_app(TestConfig) through the Flask test
+client - the cost of the application and the database, no network:
+
+* html_login: POST of the login form (a new browser session each time)
+* rest_basic_cached: GET /rest/v1.0/entitlements with HTTP Basic
+  authentication, the verified credentials cached (the repeated client)
+* rest_basic_uncached: the same with a bcrypt check every request
+* rest_token: the same with a token
+* entitlement_lookup: GET /rest/v1.0/entitlements/<name> (token)
+* activities_deep: the activity list, a page 90% down the log
+* rest_activities_deep: the activity REST API tailing from 90% of the log
+* members_first, members_deep: the user list, first page and 90% down
+
+The database is populated with a user created by UserFactory and copies
+of it inserted in bulk, up to every number of users given (10k, 100k and
+1M by default); all scenarios are measured at every size. The results
+(throughput and latency percentiles) are written as JSON - pass an earlier
+result file as --baseline to compare and to fail on regressions.
+
+Run it with: python -m tests.benchmarks.bench_hotpaths [--help]
+
+bcrypt makes up most of a login - TestConfig hashes with the minimum cost,
+pass --bcrypt-rounds 12 to measure logins as in production.
+"""
+import argparse
+import base64
+import datetime as dt
+import json
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import timeit
+
+from enma.app import create_app
+from enma.settings import TestConfig
+from enma.database import db, KeysetPagination
+from enma.activity.models import Activity
+from enma.user.credentials import credentials
+from enma.user.models import Role, User
+from enma.user.queries import user_listing, SORT_COLUMNS
+from tests.test_enma.factories import UserFactory, EntitlementFactory
+
+SCALES = (10000, 100000, 1000000)
+USERNAME = 'benchmark'  # the login name of benchmark%local
+PASSWORD = 'benchmark'
+ENTITLEMENT = 'benchmark-entitlement'
+INSERT_BATCH = 10000  # rows inserted per statement (executemany)
+
+
+def bench_config(database, bcrypt_rounds=None):
+    """ TestConfig with a production like response and the given database """
+    settings = {'DEBUG': False, 'SQLALCHEMY_DATABASE_URI': database}
+    if bcrypt_rounds:
+        settings['BCRYPT_LOG_ROUNDS'] = bcrypt_rounds
+    return type('BenchConfig', (TestConfig,), settings)
+
+
+class Population(object):
+    """ The data of the scenarios - grown in bulk
+
+    Must be used inside an application context.
+    """
+
+    def __init__(self, activities):
+        db.create_all()
+        Role.insert_roles()
+        self.admin = UserFactory(username=USERNAME + '%local',
+                                 email='benchmark@example.com',
+                                 password=PASSWORD, email_validated=True)
+        self.admin.set_role('SiteAdmin')
+        EntitlementFactory(user=self.admin, name=ENTITLEMENT)
+        db.session.commit()
+        self.admin_id = self.admin.id
+        self.token = self.admin.generate_auth_token(86400)  # a day
+        self.users = 1
+        self._template = self._user_values()
+        self._insert_activities(activities)
+
+    def _user_values(self):
+        # a user as UserFactory makes it, without its unique columns
+        user = UserFactory.build(password=PASSWORD)
+        values = dict((column.key, getattr(user, column.key))
+                      for column in User.__table__.columns)
+        values['role_id'] = user.role.id
+        for key in ('id', 'username', 'email'):
+            values.pop(key)
+        return dict((key, value) for key, value in values.items()
+                    if value is not None)  # None: the column default
+
+    def grow(self, users):
+        """ Insert copies of the template user up to a number of users """
+        table = User.__table__
+        while self.users < users:
+            count = min(INSERT_BATCH, users - self.users)
+            rows = []
+            for n in range(self.users, self.users + count):
+                row = dict(self._template)
+                row['username'] = 'bulk{0:07d}%local'.format(n)
+                row['email'] = 'bulk{0:07d}@example.com'.format(n)
+                rows.append(row)
+            db.session.execute(table.insert(), rows)
+            db.session.commit()
+            self.users += count
+
+    def _insert_activities(self, count):
+        start = dt.datetime(2015, 1, 1)
+        table = Activity.__table__
+        for first in range(0, count, INSERT_BATCH):
+            db.session.execute(table.insert(), [
+                dict(timestamp=start + dt.timedelta(seconds=n),
+                     actor='bulk{0:07d}%local'.format(n % 1000),
+                     category='User', acted_on='',
+                     description=u'activity {0}'.format(n),
+                     origin='127.0.0.1')
+                for n in range(first, min(count, first + INSERT_BATCH))])
+            db.session.commit()
+        self.activities = count
+
+    def activity_cursor(self, fraction, descending):
+        """ The cursor of the activity at a fraction of the log """
+        position = max(1, int(self.activities * fraction))
+        return _cursor(Activity.query.filter(Activity.id == position),
+                       (Activity.timestamp, Activity.id), descending)
+
+    def member_cursor(self, fraction):
+        """ The cursor of the user at a fraction of the user list """
+        username = db.session.query(User.username) \
+            .order_by(User.username) \
+            .offset(int(self.users * fraction)).limit(1).scalar()
+        return _cursor(user_listing().filter(User.username == username),
+                       SORT_COLUMNS['username'], False)
+
+
+def _cursor(query, columns, descending):
+    page = KeysetPagination(query, columns, per_page=1,
+                            descending=descending)
+    return page.encode(page.items[0])
+
+
+def scenarios(app, population):
+    """ name -> function that makes a request and checks its response """
+    basic = {'Authorization': 'Basic ' + base64.b64encode(
+        USERNAME + '%local:' + PASSWORD)}
+    token = {'Authorization': 'Basic ' + base64.b64encode(
+        population.token + ':')}
+    browser = app.test_client()
+    _expect(browser.post('/login/', data=_login_form()), 302)
+    client = app.test_client()
+    activities = population.activity_cursor(0.1, descending=True)
+    tail = population.activity_cursor(0.9, descending=False)
+    members = population.member_cursor(0.9)
+
+    def html_login():
+        _expect(app.test_client().post('/login/', data=_login_form()), 302)
+
+    def rest_basic_uncached():
+        credentials.cache.clear()
+        _expect(client.get('/rest/v1.0/entitlements', headers=basic))
+
+    return [
+        ('html_login', html_login),
+        ('rest_basic_cached', lambda: _expect(client.get(
+            '/rest/v1.0/entitlements', headers=basic))),
+        ('rest_basic_uncached', rest_basic_uncached),
+        ('rest_token', lambda: _expect(client.get(
+            '/rest/v1.0/entitlements', headers=token))),
+        ('entitlement_lookup', lambda: _expect(client.get(
+            '/rest/v1.0/entitlements/' + ENTITLEMENT, headers=token))),
+        ('activities_deep', lambda: _expect(browser.get(
+            '/activities/?after=' + activities))),
+        ('rest_activities_deep', lambda: _expect(client.get(
+            '/rest/v1.0/activities?limit=100&since=' + tail,
+            headers=token))),
+        ('members_first', lambda: _expect(browser.get('/users/members'))),
+        ('members_deep', lambda: _expect(browser.get(
+            '/users/members?after=' + members))),
+    ]
+
+
+def _login_form():
+    return {'up-username': USERNAME, 'up-password': PASSWORD,
+            'up-login': 'Login'}
+
+
+def _expect(response, status=200):
+    if response.status_code != status:
+        raise AssertionError('{0} instead of {1}: {2}'.format(
+            response.status_code, status, response.data[:200]))
+    return response
+
+
+def measure(function, requests, warmup):
+    """ Call a function repeatedly
+
+    Returns:
+        dict: throughput (calls per second) and latency percentiles (ms)
+    """
+    for _ in range(warmup):
+        function()
+    latencies = []
+    timer = timeit.default_timer
+    started = timer()
+    for _ in range(requests):
+        before = timer()
+        function()
+        latencies.append(timer() - before)
+    elapsed = timer() - started
+    latencies.sort()
+    return {
+        'requests': requests,
+        'throughput': round(requests / elapsed, 1),
+        'latency_ms': dict(
+            [(name, round(percentile(latencies, rank) * 1000, 3))
+             for name, rank in (('p50', 50), ('p90', 90), ('p99', 99))] +
+            [('mean', round(sum(latencies) / len(latencies) * 1000, 3)),
+             ('max', round(latencies[-1] * 1000, 3))]),
+    }
+
+
+def percentile(ordered, rank):
+    """ The nearest-rank percentile of sorted values """
+    index = max(0, int(-(-len(ordered) * rank // 100)) - 1)
+    return ordered[min(index, len(ordered) - 1)]
+
+
+def run(scales=SCALES, activities=100000, requests=200, warmup=20,
+        database=None, bcrypt_rounds=None, only=None, log=None):
+    """ Measure the scenarios at every number of users
+
+    Returns:
+        dict: 'meta' (the setup) and 'results' by '<scenario>@<users>'
+    """
+    directory = None
+    if database is None:
+        directory = tempfile.mkdtemp(prefix='enma-bench-')
+        database = 'sqlite:///' + os.path.join(directory, 'bench.db')
+    app = create_app(bench_config(database, bcrypt_rounds))
+    results = {}
+    try:
+        with app.app_context():
+            db.session.remove()  # bound to another app in a test run
+            population = Population(activities)
+            for users in sorted(scales):
+                population.grow(users)
+                for name, function in scenarios(app, population):
+                    if only and name not in only:
+                        continue
+                    result = measure(function, requests, warmup)
+                    result.update(scenario=name, users=users)
+                    results['{0}@{1}'.format(name, users)] = result
+                    if log:
+                        log(result)
+            db.session.remove()
+            db.drop_all()
+    finally:
+        if directory:
+            shutil.rmtree(directory, ignore_errors=True)
+    return {'meta': _meta(app, scales, activities, requests, warmup),
+            'results': results}
+
+
+def _meta(app, scales, activities, requests, warmup):
+    config = app.config
+    return {
+        'commit': _git('rev-parse', 'HEAD'),
+        'dirty': bool(_git('status', '--porcelain', '--untracked-files=no')),
+        'created': dt.datetime.utcnow().strftime('%Y-%m-%dT%H:%M:%SZ'),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'database': config['SQLALCHEMY_DATABASE_URI'].split(':', 1)[0],
+        'bcrypt_rounds': config['BCRYPT_LOG_ROUNDS'],
+        'users': sorted(scales), 'activities': activities,
+        'requests': requests, 'warmup': warmup,
+    }
+
+
+def _git(*args):
+    try:
+        with open(os.devnull, 'w') as devnull:
+            return subprocess.check_output(('git',) + args,
+                                           stderr=devnull).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(baseline, current, tolerance=0.2):
+    """ The results slower (median latency) than the baseline allows
+
+    Returns:
+        list: (key, baseline p50, current p50, ratio) of the regressions
+    """
+    regressions = []
+    for key, result in sorted(current['results'].items()):
+        before = baseline['results'].get(key)
+        if before is None:
+            continue
+        old = before['latency_ms']['p50']
+        new = result['latency_ms']['p50']
+        ratio = new / old if old else 1.0
+        if ratio > 1 + tolerance:
+            regressions.append((key, old, new, ratio))
+    return regressions
+
+
+def _print(result):
+    latency = result['latency_ms']
+    print('{0:>22} {1:>8} {2:>10.1f} {3:>9.2f} {4:>9.2f} {5:>9.2f}'.format(
+        result['scenario'], result['users'], result['throughput'],
+        latency['p50'], latency['p90'], latency['p99']))
+    sys.stdout.flush()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--users', default=','.join(map(str, SCALES)),
+                        help='comma separated numbers of users')
+    parser.add_argument('--activities', type=int, default=100000)
+    parser.add_argument('--requests', type=int, default=200,
+                        help='measured requests per scenario and size')
+    parser.add_argument('--warmup', type=int, default=20)
+    parser.add_argument('--scenario', action='append',
+                        help='run only this scenario (repeatable)')
+    parser.add_argument('--database', help='SQLAlchemy URI of an empty'
+                        ' database (default: a temporary SQLite file)')
+    parser.add_argument('--bcrypt-rounds', type=int)
+    parser.add_argument('--output', help='result file (default:'
+                        ' benchmark-<commit>.json)')
+    parser.add_argument('--baseline', help='result file to compare with')
+    parser.add_argument('--tolerance', type=float, default=0.2,
+                        help='allowed slowdown of the median (0.2: 20%%)')
+    args = parser.parse_args(argv)
+
+    print('{0:>22} {1:>8} {2:>10} {3:>9} {4:>9} {5:>9}'.format(
+        'scenario', 'users', 'req/s', 'p50 [ms]', 'p90 [ms]', 'p99 [ms]'))
+    report = run(scales=[int(n) for n in args.users.split(',')],
+                 activities=args.activities, requests=args.requests,
+                 warmup=args.warmup, database=args.database,
+                 bcrypt_rounds=args.bcrypt_rounds, only=args.scenario,
+                 log=_print)
+    output = args.output or 'benchmark-{0}.json'.format(
+        (report['meta']['commit'] or 'unknown')[:10])
+    with open(output, 'w') as result_file:
+        json.dump(report, result_file, indent=2, sort_keys=True)
+    print('results written to {0}'.format(output))
+    if args.baseline:
+        with open(args.baseline) as baseline_file:
+            baseline = json.load(baseline_file)
+        regressions = compare(baseline, report, args.tolerance)
+        for key, old, new, ratio in regressions:
+            print('REGRESSION {0}: p50 {1:.2f} -> {2:.2f} ms ({3:.2f}x)'
+                  .format(key, old, new, ratio))
+        if regressions:
+            return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,71 @@
+# -*- coding: utf-8 -*-
+"""Benchmark of the REST response serialization against flask.jsonify.
+
+Run it with: python -m tests.benchmarks.bench_serialization
+"""
+import datetime as dt
+import timeit
+from collections import namedtuple
+
+from flask import jsonify
+
+from enma.app import create_app
+from enma.settings import TestConfig
+from enma.activity.export import COLUMNS, to_dict
+from enma.activity.models import Activity
+from enma.rest.serialization import ENCODER, json_response, extractor
+
+Row = namedtuple('Row', COLUMNS)
+
+
+def activity_rows(count):
+    timestamp = dt.datetime(2015, 1, 1)
+    return [Row(n, timestamp + dt.timedelta(seconds=n), u'actor%d' % n,
+                u'User', u'', u'activity %d' % n, u'127.0.0.1')
+            for n in range(count)]
+
+
+def cases():
+    """ name -> (jsonify variant, serialization layer variant) """
+    error = {'error': 'not_found', 'message': 'REST Object'}
+    small = activity_rows(10)
+    large = activity_rows(1000)
+    extract = extractor(Activity, COLUMNS)
+    return [
+        ('error', lambda: jsonify(error), lambda: json_response(error)),
+        ('10 rows',
+         lambda: jsonify({'activities': [to_dict(r) for r in small]}),
+         lambda: json_response({'activities': [extract(r) for r in small]})),
+        ('1000 rows',
+         lambda: jsonify({'activities': [to_dict(r) for r in large]}),
+         lambda: json_response({'activities': [extract(r) for r in large]})),
+    ]
+
+
+def measure(function, repeat=5):
+    """ The best time per call in microseconds """
+    number = 1
+    while timeit.timeit(function, number=number) < 0.2:
+        number *= 2
+    return min(timeit.repeat(function, number=number, repeat=repeat)) \
+        / number * 1e6
+
+
+class BenchConfig(TestConfig):
+    DEBUG = False  # responses as in production
+
+
+def main():
+    app = create_app(BenchConfig)
+    print('encoder: {0}'.format(ENCODER))
+    print('{0:>10} {1:>14} {2:>14} {3:>8}'.format(
+        'payload', 'jsonify [us]', 'layer [us]', 'speedup'))
+    with app.test_request_context('/rest/v1.0/activities'):
+        for name, baseline, candidate in cases():
+            before, after = measure(baseline), measure(candidate)
+            print('{0:>10} {1:>14.1f} {2:>14.1f} {3:>7.2f}x'.format(
+                name, before, after, before / after))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,60 @@
+# -*- coding: utf-8 -*-
+"""Unit tests of the activity archive."""
+import datetime as dt
+
+import pytest
+
+from enma.activity.models import Activity
+from enma.activity.archive import ActivityArchive, compact
+
+
+@pytest.fixture
+def archive(app, tmpdir):
+    app.config['ACTIVITY_ARCHIVE_DIR'] = str(tmpdir.join('archive'))
+    return ActivityArchive(app.config['ACTIVITY_ARCHIVE_DIR'])
+
+
+@pytest.fixture
+def activities(db):
+    for month, actor in ((1, 'a'), (1, 'b'), (2, 'a'), (3, 'b'), (6, 'a')):
+        activity = Activity(actor, 'in month %d' % month)
+        activity.timestamp = dt.datetime(2015, month, 10)
+        db.session.add(activity)
+    db.session.commit()
+
+
+def test_compact_moves_old_activities(archive, activities):
+    moved = compact(archive, dt.datetime(2015, 4, 1), batch_size=2)
+    assert 4 == moved
+    assert ['2015-01', '2015-02', '2015-03'] == archive.months()
+    assert 1 == Activity.query.count()
+    assert 4 == Activity.archived().count()
+
+
+def test_compact_incrementally(archive, activities):
+    assert 2 == compact(archive, dt.datetime(2015, 4, 1), batch_size=2,
+                        max_batches=1)
+    assert 3 == Activity.query.count()
+    assert 2 == compact(archive, dt.datetime(2015, 4, 1), batch_size=2)
+    assert 1 == Activity.query.count()
+
+
+def test_query_archive(archive, activities):
+    compact(archive, dt.datetime(2016, 1, 1))
+    query = Activity.archived()
+    assert ['a', 'a', 'a'] == [x.actor for x in query.filter_by(actor='a')]
+    in_range = query.between(dt.datetime(2015, 2, 1), dt.datetime(2015, 6, 1))
+    assert ['in month 2', 'in month 3'] == \
+        [x.description for x in in_range.all()]
+    first = query.filter_by(actor='b').first()
+    assert isinstance(first, Activity)
+    assert dt.datetime(2015, 1, 10) == first.timestamp
+    assert 2 == query.limit(2).count()
+
+
+def test_read_skips_duplicates(archive, activities):
+    rows = [dict(id=1, timestamp=dt.datetime(2015, 1, 1), actor='a',
+                 category='', acted_on='', description='d', origin='')]
+    archive.append(rows)
+    archive.append(rows)  # interrupted compaction appends a batch again
+    assert 1 == len(list(archive.read('2015-01')))
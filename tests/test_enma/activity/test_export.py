@@ -0,0 +1,74 @@
+# -*- coding: utf-8 -*-
+"""Unit and functional tests of the activity export."""
+import datetime as dt
+import json
+
+import pytest
+from flask import url_for
+from webtest.app import AppError
+
+from enma.activity.models import Activity
+from enma.activity.export import iter_batches, to_csv, to_ndjson, parse_time
+
+
+@pytest.fixture
+def activities(db):
+    for n in range(5):
+        activity = Activity('actor%d' % (n % 2), u'activity \xe4 %d' % n)
+        activity.timestamp = dt.datetime(2015, 1, n + 1)
+        db.session.add(activity)
+    db.session.commit()
+
+
+def test_iter_batches(activities):
+    batches = list(iter_batches(batch_size=2))
+    assert [2, 2, 1] == [len(rows) for rows in batches]
+
+
+def test_iter_batches_filtered(activities):
+    rows = sum(iter_batches(actor='actor0', since=dt.datetime(2015, 1, 2),
+                            until=dt.datetime(2015, 1, 5)), [])
+    assert [3] == [row.id for row in rows]
+
+
+def test_to_csv(activities):
+    lines = ''.join(to_csv(iter_batches(batch_size=2))).splitlines()
+    assert 6 == len(lines)
+    assert lines[0].startswith('id,timestamp,actor')
+    assert '2015-01-01T00:00:00' in lines[1]
+    assert u'activity \xe4 0'.encode('utf-8') in lines[1]
+
+
+def test_to_ndjson(activities):
+    lines = ''.join(to_ndjson(iter_batches(batch_size=2))).splitlines()
+    assert 5 == len(lines)
+    assert u'activity \xe4 4' == json.loads(lines[-1])['description']
+
+
+def test_parse_time():
+    assert dt.datetime(2015, 1, 2) == parse_time('2015-01-02')
+    assert dt.datetime(2015, 1, 2, 3, 4, 5) == parse_time('2015-01-02T03:04:05')
+    with pytest.raises(ValueError):
+        parse_time('yesterday')
+
+
+class TestExportView:
+
+    def test_admin_exports(self, logged_in, user, testapp, activities):
+        user.set_role('SiteAdmin')
+        user.save()
+        res = testapp.get(url_for('activity.export', format='ndjson',
+                                  actor='actor1'))
+        assert 'application/x-ndjson' == res.content_type
+        assert 2 == len(res.body.splitlines())
+        assert 1 == Activity.query.filter_by(category='Export').count()
+
+    def test_user_not_permitted(self, logged_in, user, testapp):
+        with pytest.raises(AppError):
+            testapp.get(url_for('activity.export'))
+
+    def test_invalid_format(self, logged_in, user, testapp):
+        user.set_role('SiteAdmin')
+        user.save()
+        with pytest.raises(AppError):
+            testapp.get(url_for('activity.export', format='xml'))
@@ -33,14 +33,14 @@ def test_record(user):
 def test_record_api(test_patch):
     record_api('description', 'acted_on')
     test_patch.assert_called_with('description', category=API,
-                                  acted_on='acted_on')
+                                  acted_on='acted_on', actor=None)
 
 
 @patch('enma.activity.models.record')
 def test_record_api_without_acted_on(test_patch):
     record_api('description')
     test_patch.assert_called_with('description', category=API, 
-                                  acted_on=None)
+                                  acted_on=None, actor=None)
 
 
 @patch('enma.activity.models.record')
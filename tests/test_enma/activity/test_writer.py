@@ -0,0 +1,104 @@
+# -*- coding: utf-8 -*-
+"""Activity writer unit tests."""
+import datetime as dt
+
+import pytest
+from mock import patch
+
+from enma.activity.models import Activity
+from enma.activity.writer import ActivityWriter
+
+
+def _row(n):
+    return dict(timestamp=dt.datetime.utcnow(), actor='actor',
+                category='', acted_on='', description='row %d' % n,
+                origin='')
+
+
+@pytest.yield_fixture
+def writer(app, db):
+    app.config['ACTIVITY_WRITER_SYNC'] = False
+    app.config['ACTIVITY_QUEUE_SIZE'] = 3
+    app.config['ACTIVITY_BATCH_SIZE'] = 2
+    with patch.object(ActivityWriter, '_start_worker'):
+        yield ActivityWriter(Activity.__table__, app)
+
+
+def test_sync_mode_writes_immediately(app, db):
+    writer = ActivityWriter(Activity.__table__, app)
+    assert writer.sync
+    writer.put(_row(1))
+    assert 1 == Activity.query.count()
+    assert 0 == len(writer)
+
+
+def test_buffered_until_flush(writer):
+    writer.put(_row(1))
+    assert 1 == len(writer)
+    assert 0 == Activity.query.count()
+    assert 1 == writer.flush()
+    assert 1 == Activity.query.count()
+    assert 0 == len(writer)
+
+
+def test_full_batch_wakes_up_worker(writer):
+    writer.put(_row(1))
+    assert not writer._wakeup.is_set()
+    writer.put(_row(2))
+    assert writer._wakeup.is_set()
+
+
+def test_overflow_inline_flushes(writer):
+    for n in range(4):
+        writer.put(_row(n))
+    assert 4 == Activity.query.count()
+    assert 0 == writer.dropped
+
+
+def test_overflow_drop(writer):
+    writer.overflow = 'drop'
+    for n in range(4):
+        writer.put(_row(n))
+    assert 3 == len(writer)
+    assert 1 == writer.dropped
+
+
+def test_unknown_overflow_policy(app):
+    app.config['ACTIVITY_OVERFLOW'] = 'unknown'
+    with pytest.raises(ValueError):
+        ActivityWriter(Activity.__table__, app)
+
+
+def test_failed_write_is_kept(writer):
+    writer.put(_row(1))
+    writer.put(_row(2))
+    with patch.object(writer, '_write', side_effect=RuntimeError):
+        assert 0 == writer.flush()
+    assert 1 == writer.failures
+    assert 2 == len(writer)
+    assert 2 == writer.flush()
+    assert 2 == Activity.query.count()
+
+
+def test_failed_write_keeps_the_callers_session(writer, db):
+    row = _row(1)
+    row['actor'] = None  # violates NOT NULL
+    writer.put(row)
+    pending = Activity('pending', 'not flushed yet')
+    db.session.add(pending)
+    assert 0 == writer.flush()
+    assert pending in db.session
+    assert 1 == len(writer)
+
+
+def test_pending_since(writer):
+    assert writer.pending_since() is None
+    first, second = _row(1), _row(2)
+    writer.put(first)
+    writer.put(second)
+    assert first['timestamp'] == writer.pending_since()
+    with patch.object(writer, '_write', side_effect=RuntimeError):
+        writer.flush()
+    assert first['timestamp'] == writer.pending_since()
+    writer.flush()
+    assert writer.pending_since() is None
@@ -9,6 +9,7 @@ from enma.settings import TestConfig
 from enma.app import create_app
 from enma.database import db as _db
 from tests.test_enma.factories import UserFactory
+from tests.test_enma.helpers import basic_auth
 from enma.user.models import Role
 from copy import deepcopy
 
@@ -45,6 +46,19 @@ def user(db):
     return user
 
 
+@pytest.fixture
+def admin(user):
+    user.set_role('SiteAdmin')
+    user.save()
+    return user
+
+
+@pytest.fixture
+def headers(admin):
+    """Basic authentication of the admin at the REST API."""
+    return basic_auth(admin.username, 'myprecious')
+
+
 @pytest.fixture
 def logged_in(user, testapp):
     """
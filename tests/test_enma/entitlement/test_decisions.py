@@ -0,0 +1,92 @@
+# -*- coding: utf-8 -*-
+"""Unit tests of the entitlement decision cache."""
+import datetime as dt
+import time
+
+import pytest
+
+from enma.database import db
+from enma.entitlement.decisions import decisions, DENIED
+from enma.entitlement.models import REVOKED, GRANTED
+from tests.test_enma.factories import EntitlementFactory, UserFactory
+
+
+@pytest.yield_fixture
+def cache(app):
+    decisions.cache.clear()
+    yield decisions
+    decisions.cache.clear()
+
+
+@pytest.mark.usefixtures('db')
+class TestDecisionCache:
+
+    def test_decide_is_cached(self, user, cache):
+        EntitlementFactory(name='svc', user=user, capacity=7)
+        db.session.commit()
+        decision = cache.decide(user.id, 'svc')
+        assert decision.granted
+        assert 7 == decision.capacity
+        assert 'svc' == decision.entitlement['name']
+        misses = cache.stats()['misses']
+        assert decision is cache.decide(user.id, 'svc')
+        assert misses == cache.stats()['misses']
+
+    def test_negative_decision_is_cached(self, user, cache):
+        assert DENIED == cache.decide(user.id, 'svc')
+        assert (user.id, 'svc') in cache.cache
+
+    def test_grant_and_revoke_invalidate(self, user, cache):
+        assert not cache.decide(user.id, 'svc').granted
+        entitlement = EntitlementFactory(name='svc', user=user)
+        db.session.commit()
+        assert cache.decide(user.id, 'svc').granted
+        entitlement.update(status=REVOKED)
+        assert not cache.decide(user.id, 'svc').granted
+        entitlement.update(status=GRANTED)
+        assert cache.decide(user.id, 'svc').granted
+        entitlement.delete()
+        assert not cache.decide(user.id, 'svc').granted
+
+    def test_rename_invalidates_old_name(self, user, cache):
+        entitlement = EntitlementFactory(name='old', user=user)
+        db.session.commit()
+        assert cache.decide(user.id, 'old').granted
+        entitlement.update(name='new')
+        assert not cache.decide(user.id, 'old').granted
+        assert cache.decide(user.id, 'new').granted
+
+    def test_entry_expires_with_entitlement(self, user, cache):
+        EntitlementFactory(name='svc', user=user,
+                           expiry=dt.datetime.utcnow() +
+                           dt.timedelta(seconds=0.05))
+        db.session.commit()
+        assert cache.decide(user.id, 'svc').granted
+        time.sleep(0.1)
+        assert not cache.decide(user.id, 'svc').granted
+        assert 1 == cache.stats()['expirations']
+
+    def test_warm_up(self, user, cache):
+        EntitlementFactory(name='svc', user=user)
+        EntitlementFactory(name='revoked', user=user, status=REVOKED)
+        db.session.commit()
+        cache.cache.clear()
+        cache._warm_up()
+        assert 1 == len(cache.cache)
+        hits = cache.stats()['hits']
+        assert cache.decide(user.id, 'svc').granted
+        assert hits + 1 == cache.stats()['hits']
+
+
+    def test_decide_many(self, user, cache):
+        other = UserFactory()
+        EntitlementFactory(name='a', user=user)
+        EntitlementFactory(name='b', user=other)
+        EntitlementFactory(name='b', user=user, status=REVOKED)
+        db.session.commit()
+        assert cache.decide(user.id, 'a').granted  # cached before
+        result = cache.decide_many([user.id, other.id], ['a', 'b'])
+        assert {(user.id, 'a'): True, (user.id, 'b'): False,
+                (other.id, 'a'): False, (other.id, 'b'): True} == \
+            dict((key, decision.granted) for key, decision in result.items())
+        assert 4 == len(cache.cache)  # all decisions are cached
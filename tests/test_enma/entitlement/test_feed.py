@@ -0,0 +1,88 @@
+# -*- coding: utf-8 -*-
+"""Unit tests of the entitlement change feed."""
+import datetime as dt
+
+import pytest
+
+from enma.database import db
+from enma.entitlement import feed as feed_module
+from enma.entitlement.feed import Feed, GRANTED, REVOKED, EXPIRED, RESYNC
+from enma.entitlement.models import REVOKED as REVOKED_STATUS
+from tests.test_enma.factories import EntitlementFactory, UserFactory
+
+
+@pytest.yield_fixture
+def feed(user):
+    db.session.commit()
+    feed = Feed(user.id)
+    yield feed
+    feed.close()
+
+
+def kinds(events):
+    return [(e['type'], e['name']) for e in events]
+
+
+@pytest.mark.usefixtures('db')
+class TestFeed:
+
+    def test_grant_and_revoke_after_commit(self, user, feed):
+        entitlement = EntitlementFactory(name='svc', user=user)
+        db.session.flush()
+        assert [] == feed.wait(0)
+        db.session.commit()
+        assert [(GRANTED, 'svc')] == kinds(feed.wait(0))
+        entitlement.update(status=REVOKED_STATUS)
+        assert [(REVOKED, 'svc')] == kinds(feed.wait(0))
+        entitlement.update(status='granted')
+        entitlement.delete()
+        assert [(GRANTED, 'svc'), (REVOKED, 'svc')] == kinds(feed.wait(0))
+
+    def test_rollback_publishes_nothing(self, user, feed):
+        EntitlementFactory(name='svc', user=user)
+        db.session.flush()
+        db.session.rollback()
+        assert [] == feed.wait(0)
+
+    def test_moved_entitlement_is_revoked(self, user, feed):
+        entitlement = EntitlementFactory(name='svc', user=user)
+        db.session.commit()
+        feed.wait(0)
+        other = UserFactory()
+        db.session.commit()
+        with Feed(other.id) as other_feed:
+            entitlement.update(user=other)
+            assert [(REVOKED, 'svc')] == kinds(feed.wait(0))
+            assert [(GRANTED, 'svc')] == kinds(other_feed.wait(0))
+
+    def test_other_users_are_not_told(self, user, feed):
+        EntitlementFactory(name='svc')
+        db.session.commit()
+        assert [] == feed.wait(0)
+
+    def test_expiry(self, user):
+        EntitlementFactory(name='svc', user=user, expiry=dt.datetime.utcnow() +
+                           dt.timedelta(seconds=0.2))
+        db.session.commit()
+        with Feed(user.id) as feed:
+            assert [(EXPIRED, 'svc')] == kinds(feed.wait(5))
+            assert [] == feed.wait(0)
+
+    def test_overflow_asks_for_resync(self, user, feed):
+        feed.subscription.overflowed = True
+        assert [(RESYNC, None)] == kinds(feed.wait(0))
+
+    def test_stream(self, user, feed):
+        EntitlementFactory(name='svc', user=user)
+        db.session.commit()
+        chunks = list(feed.stream(duration=0.1, heartbeat=0.05))
+        assert 'retry: 1000\n\n' == chunks[0]
+        assert chunks[1].startswith('event: granted\ndata: {')
+        assert chunks[-1].startswith('event: heartbeat\n')
+        assert 0 == feed_module.events.subscribers(feed.subscription.channel)
+
+    def test_reads_leave_the_session_alone(self, user, feed):
+        pending = EntitlementFactory(name='svc', user=user)
+        feed.version()
+        feed._load_expiring()
+        assert pending in db.session
@@ -0,0 +1,114 @@
+# -*- coding: utf-8 -*-
+"""Unit tests of the metering of entitlement usage."""
+import threading
+
+import pytest
+from mock import patch
+
+from enma.database import db as _db
+from enma.entitlement.metering import UsageMeter
+from enma.entitlement.models import EntitlementUsage
+from tests.test_enma.factories import EntitlementFactory
+
+
+@pytest.fixture
+def entitlement(db):
+    entitlement = EntitlementFactory(capacity=100)
+    db.session.commit()
+    return entitlement
+
+
+@pytest.yield_fixture
+def meter(app, db):
+    app.config['ENTITLEMENT_USAGE_SYNC'] = False
+    with patch.object(UsageMeter, '_start_worker'):
+        yield UsageMeter(app)
+
+
+def test_sync_mode_writes_immediately(app, entitlement):
+    meter = UsageMeter(app)
+    assert meter.sync
+    meter.record(entitlement.id, 3)
+    meter.record(entitlement.id, 4)
+    assert 7 == meter.used(entitlement.id)
+    assert [7] == [usage.used for usage in EntitlementUsage.query]
+
+
+def test_counted_until_flush(meter, entitlement):
+    meter.record(entitlement.id, 2)
+    meter.record(entitlement.id)
+    assert 3 == meter.pending(entitlement.id)
+    assert 3 == meter.used(entitlement.id)
+    assert 0 == EntitlementUsage.query.count()
+    assert 1 == meter.flush()
+    assert 0 == meter.pending(entitlement.id)
+    assert 3 == meter.used(entitlement.id)
+    assert 0 == meter.flush()
+
+
+def test_flush_aggregates_threads(meter, entitlement):
+    entitlement_id = entitlement.id
+
+    def report():
+        for _ in range(100):
+            meter.record(entitlement_id)
+    threads = [threading.Thread(target=report) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    meter.flush()
+    usage = EntitlementUsage.query.one()
+    assert 400 == usage.used
+
+
+def test_threads_use_several_stripes(meter, entitlement):
+    entitlement_id = entitlement.id
+
+    def report():
+        meter.record(entitlement_id)
+    threads = [threading.Thread(target=report) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    used = [counts for _, counts in meter._stripes if counts]
+    assert 4 == len(used)
+    assert 4 == meter.pending(entitlement_id)
+
+
+def test_flush_adds_to_shard(meter, entitlement):
+    meter.record(entitlement.id, 5)
+    meter.flush()
+    meter.record(entitlement.id, 6)
+    meter.flush()
+    assert [11] == [usage.used for usage in EntitlementUsage.query]
+
+
+def test_shards_are_summed(meter, entitlement):
+    _db.session.add(EntitlementUsage(entitlement_id=entitlement.id,
+                                     shard=99, used=10))
+    _db.session.commit()
+    meter.record(entitlement.id, 1)
+    meter.flush()
+    assert 11 == meter.used(entitlement.id)
+
+
+def test_staleness_is_bounded_by_cache(meter, entitlement):
+    assert 0 == meter.used(entitlement.id)
+    _db.session.add(EntitlementUsage(entitlement_id=entitlement.id,
+                                     shard=99, used=10))
+    _db.session.commit()
+    assert 0 == meter.used(entitlement.id)  # cached
+    meter.totals.clear()  # i.e. expired
+    assert 10 == meter.used(entitlement.id)
+
+
+def test_failed_flush_keeps_usage(meter, entitlement):
+    meter.record(entitlement.id, 5)
+    with patch.object(UsageMeter, '_add', side_effect=RuntimeError):
+        assert 0 == meter.flush()
+    assert 1 == meter.failures
+    assert 5 == meter.pending(entitlement.id)
+    assert 1 == meter.flush()
+    assert 5 == meter.used(entitlement.id)
@@ -0,0 +1,45 @@
+# -*- coding: utf-8 -*-
+"""Unit tests of the entitlement models."""
+import datetime as dt
+
+import pytest
+
+from enma.database import db
+from enma.entitlement.models import Entitlement, Organization, REVOKED
+from tests.test_enma.factories import EntitlementFactory, UserFactory
+
+
+@pytest.mark.usefixtures('db')
+class TestEntitlement:
+
+    def test_valid(self, user):
+        past = dt.datetime.utcnow() - dt.timedelta(days=1)
+        future = dt.datetime.utcnow() + dt.timedelta(days=1)
+        forever = EntitlementFactory(name='one', user=user)
+        later = EntitlementFactory(name='two', user=user, expiry=future)
+        EntitlementFactory(name='three', user=user, expiry=past)
+        EntitlementFactory(name='four', user=user, status=REVOKED)
+        EntitlementFactory(name='one', user=UserFactory())
+        db.session.commit()
+        assert [forever, later] == \
+            Entitlement.valid(user.id).order_by(Entitlement.id).all()
+        assert [forever] == Entitlement.valid(user.id, 'one').all()
+        assert [] == Entitlement.valid(user.id, 'three').all()
+        assert forever.is_valid
+        assert not Entitlement.query.filter_by(name='four').one().is_valid
+
+    def test_organization(self):
+        organization = Organization.create(name='ACME')
+        entitlement = EntitlementFactory(organization=organization)
+        db.session.commit()
+        assert [entitlement] == organization.entitlements.all()
+        assert None == entitlement.user
+
+    def test_to_dict(self, user):
+        expiry = dt.datetime(2030, 1, 2)
+        entitlement = EntitlementFactory(name='svc', user=user,
+                                         capacity=500, expiry=expiry)
+        db.session.commit()
+        assert {'name': 'svc', 'type': entitlement.type.name,
+                'status': 'granted', 'description': '', 'capacity': 500,
+                'expiry': '2030-01-02T00:00:00'} == entitlement.to_dict()
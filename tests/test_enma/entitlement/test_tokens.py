@@ -0,0 +1,72 @@
+# -*- coding: utf-8 -*-
+"""Unit tests of the signed entitlement tokens and their verifier."""
+import datetime as dt
+import time
+
+import pytest
+
+from enma.database import db
+from enma.entitlement.models import REVOKED
+from enma.entitlement.tokens import issue_token, signing_key
+from enma.entitlement.verifier import EntitlementVerifier, \
+    InvalidEntitlementToken
+from tests.test_enma.factories import EntitlementFactory
+
+
+@pytest.fixture
+def verifier(app):
+    kid, key = signing_key()
+    return EntitlementVerifier([{'kid': kid, 'key': key}])
+
+
+@pytest.mark.usefixtures('db')
+class TestEntitlementTokens:
+
+    def test_roundtrip(self, user, verifier):
+        expiry = dt.datetime.utcnow() + dt.timedelta(days=1)
+        EntitlementFactory(name='a', user=user, capacity=10)
+        EntitlementFactory(name='b', user=user, expiry=expiry)
+        EntitlementFactory(name='c', user=user, status=REVOKED)
+        db.session.commit()
+        assertion = verifier.verify(issue_token(user.id, user.username))
+        assert user.username == assertion.user
+        assert user.id == assertion.user_id
+        assert assertion.allows('a')
+        assert assertion.allows('b')
+        assert not assertion.allows('b', now=time.time() + 2 * 86400)
+        assert not assertion.allows('c')
+        assert 10 == assertion.capacity('a')
+        assert None == assertion.capacity('b')
+
+    def test_verified_token_is_remembered(self, user, verifier):
+        token = issue_token(user.id, user.username)
+        assert verifier.verify(token) is verifier.verify(token)
+
+    def test_forged_token(self, user, verifier):
+        token = issue_token(user.id, user.username)
+        with pytest.raises(InvalidEntitlementToken):
+            verifier.verify(token[:-2] + 'xx')
+        with pytest.raises(InvalidEntitlementToken):
+            verifier.verify('garbage')
+
+    def test_unknown_key(self, app, user):
+        token = issue_token(user.id, user.username)
+        with pytest.raises(InvalidEntitlementToken):
+            EntitlementVerifier({signing_key()[0]: 'other'}).verify(token)
+        with pytest.raises(InvalidEntitlementToken):
+            EntitlementVerifier({}).verify(token)
+
+    def test_expired_token(self, user, verifier):
+        token = issue_token(user.id, user.username, expiration=-1)
+        with pytest.raises(InvalidEntitlementToken):
+            verifier.verify(token)
+
+    def test_auth_token_is_no_entitlement_token(self, app, user):
+        kid, key = signing_key()
+        app.config['SECRET_KEY'], secret = key, app.config['SECRET_KEY']
+        try:
+            token = user.generate_auth_token(60)
+        finally:
+            app.config['SECRET_KEY'] = secret
+        with pytest.raises(InvalidEntitlementToken):
+            EntitlementVerifier({kid: key}).verify(token)
@@ -1,8 +1,9 @@
 # -*- coding: utf-8 -*-
-from factory import Sequence, PostGenerationMethodCall
+from factory import Sequence, PostGenerationMethodCall, SubFactory
 from factory.alchemy import SQLAlchemyModelFactory
 
 from enma.user.models import User
+from enma.entitlement.models import Entitlement, EntitlementType, GRANTED
 from enma.database import db
 
 
@@ -21,3 +22,19 @@ class UserFactory(BaseFactory):
 
     class Meta:
         model = User
+
+
+class EntitlementTypeFactory(BaseFactory):
+    name = Sequence(lambda n: "service-{0}".format(n))
+
+    class Meta:
+        model = EntitlementType
+
+
+class EntitlementFactory(BaseFactory):
+    name = Sequence(lambda n: "entitlement-{0}".format(n))
+    type = SubFactory(EntitlementTypeFactory)
+    status = GRANTED
+
+    class Meta:
+        model = Entitlement
@@ -0,0 +1,9 @@
+# -*- coding: utf-8 -*-
+"""Helpers shared by the tests."""
+import base64
+
+
+def basic_auth(username, password=''):
+    """The headers of HTTP Basic authentication."""
+    credentials = base64.b64encode('{0}:{1}'.format(username, password))
+    return {'Authorization': 'Basic ' + credentials}
@@ -0,0 +1,110 @@
+# -*- coding: utf-8 -*-
+"""Unit tests of the metrics registry."""
+import json
+import os
+
+import pytest
+from mock import patch
+
+from enma.metrics.registry import MetricsRegistry
+
+
+@pytest.fixture
+def registry():
+    return MetricsRegistry()
+
+
+def dead_pid():
+    pid = 99999
+    while True:
+        try:
+            os.kill(pid, 0)
+        except OSError:
+            return pid
+        pid += 1
+
+
+def test_counter_and_gauge(registry):
+    requests = registry.counter('requests_total', 'Requests', ('status',))
+    requests.inc(('200',))
+    requests.inc(('200',), 2)
+    queue = registry.gauge('queue', 'Queue length')
+    queue.set(5)
+    queue.dec()
+    assert requests is registry.counter('requests_total', 'Requests')
+    assert 3 == requests.value(('200',))
+    text = registry.exposition()
+    assert '# TYPE requests_total counter' in text
+    assert 'requests_total{status="200"} 3' in text
+    assert 'queue 4' in text
+
+
+def test_histogram(registry):
+    seconds = registry.histogram('seconds', 'Latency', ('endpoint',),
+                                 buckets=(0.1, 1))
+    for value in (0.05, 0.1, 0.5, 3):
+        seconds.observe(value, ('home',))
+    assert 4 == seconds.count(('home',))
+    lines = registry.exposition().splitlines()
+    assert 'seconds_bucket{endpoint="home",le="0.1"} 2' in lines
+    assert 'seconds_bucket{endpoint="home",le="1"} 3' in lines
+    assert 'seconds_bucket{endpoint="home",le="+Inf"} 4' in lines
+    assert 'seconds_sum{endpoint="home"} 3.65' in lines
+    assert 'seconds_count{endpoint="home"} 4' in lines
+
+
+def test_labels_are_escaped(registry):
+    registry.counter('c', 'C', ('path',)).inc(('a"b\\',))
+    assert r'c{path="a\"b\\"} 1' in registry.exposition()
+
+
+def test_function_gauge(registry):
+    registry.gauge('buffered', 'Buffered', function=lambda: 7)
+    assert 'buffered 7' in registry.exposition()
+
+
+def test_kind_conflict(registry):
+    registry.counter('metric', 'A counter')
+    with pytest.raises(ValueError):
+        registry.gauge('metric', 'A gauge')
+
+
+def test_disabled(registry):
+    registry.enabled = False
+    counter = registry.counter('c', 'C')
+    counter.inc()
+    assert 0 == counter.value()
+
+
+def test_merges_processes(registry, tmpdir):
+    registry.directory = str(tmpdir)
+    requests = registry.counter('requests_total', 'Requests')
+    workers = registry.gauge('busy', 'Busy', aggregate='max')
+    seconds = registry.histogram('seconds', 'Latency', buckets=(1,))
+    requests.inc(amount=2)
+    workers.set(3)
+    seconds.observe(0.5)
+    # an exited process: its counters count, its gauges do not
+    tmpdir.join('other.json').write(json.dumps({'pid': dead_pid(), 'metrics': {
+        'requests_total': {'kind': 'counter', 'values': [[[], 5]]},
+        'busy': {'kind': 'gauge', 'values': [[[], 9]]},
+        'seconds': {'kind': 'histogram', 'values': [[[], [0, 1, 2.0]]]}}}))
+    tmpdir.join('broken.json').write('{')
+    merged = registry.collect()
+    assert 7 == merged['requests_total'][()]
+    assert 3 == merged['busy'][()]
+    assert [1, 1, 2.5] == merged['seconds'][()]
+    assert tmpdir.join('{0}.json'.format(os.getpid())).check()
+
+
+def test_forked_process_starts_empty(registry):
+    counter = registry.counter('c', 'C')
+    counter.inc()
+    registry._pid = -1  # as if forked
+    registry.directory = '/tmp'
+    with patch.object(MetricsRegistry, '_start_worker') as start:
+        start.side_effect = lambda: setattr(registry, '_worker', start)
+        registry.ensure_worker()
+        registry.ensure_worker()
+    assert 0 == counter.value()
+    assert 1 == start.call_count
@@ -0,0 +1,53 @@
+# -*- coding: utf-8 -*-
+"""Functional tests of the metrics endpoint and the request metrics."""
+from enma.metrics.registry import metrics
+from enma.metrics.views import requests_total
+from enma.rest.authentication import authentications
+from tests.test_enma.helpers import basic_auth
+
+
+def test_request_metrics(db, testapp):
+    before = requests_total.value(('public.home', 'GET', '200'))
+    testapp.get('/')
+    assert before + 1 == requests_total.value(('public.home', 'GET', '200'))
+    res = testapp.get('/metrics')
+    assert res.content_type == 'text/plain'
+    assert 'enma_http_request_duration_seconds_bucket{endpoint=' \
+        '"public.home",le="0.005"}' in res.body
+    assert '# TYPE enma_bcrypt_seconds histogram' in res.body
+
+
+def test_authentication_metrics(user, testapp):
+    labels = ('password', 'failure')
+    before = authentications.value(labels)
+    testapp.get('/rest/v1.0/caches', headers=basic_auth(user.username, 'x'),
+                status=401)
+    assert before + 1 == authentications.value(labels)
+    assert metrics.get('enma_rest_authentications_total') is authentications
+
+
+def test_token_required(db, testapp):
+    config = testapp.app.config
+    config['METRICS_TOKEN'] = 'secret'
+    try:
+        testapp.get('/metrics', status=401)
+        testapp.get('/metrics', headers={'Authorization': 'Bearer wrong'},
+                    status=401)
+        testapp.get('/metrics', headers={'Authorization': 'Bearer secret'})
+    finally:
+        config['METRICS_TOKEN'] = None
+
+
+def test_no_token_outside_dev_and_test(db, testapp):
+    config = testapp.app.config
+    config['DEBUG'] = config['TESTING'] = False
+    try:
+        testapp.get('/metrics', status=403)
+    finally:
+        config['DEBUG'] = config['TESTING'] = True
+
+
+def test_forked_process_keeps_its_first_request(db, testapp):
+    metrics._pid = -1  # as if forked
+    testapp.get('/')
+    assert 1 == requests_total.value(('public.home', 'GET', '200'))
@@ -0,0 +1,105 @@
+# -*- coding: utf-8 -*-
+"""Functional tests of the REST resources of the activities."""
+import datetime as dt
+import json
+
+import pytest
+from mock import patch
+
+from enma.database import db
+from enma.activity.models import Activity, activity_writer
+from tests.test_enma.helpers import basic_auth
+
+
+@pytest.fixture
+def activities(db):
+    for n in range(5):
+        activity = Activity('actor%d' % (n % 2), u'activity %d' % n,
+                            category='Export' if n == 4 else 'User')
+        activity.timestamp = dt.datetime(2015, 1, n + 1)
+        db.session.add(activity)
+    db.session.commit()
+
+
+def descriptions(activities):
+    return [activity['description'] for activity in activities]
+
+
+@pytest.mark.usefixtures('activities')
+class TestActivities:
+
+    def test_tail_by_cursor(self, headers, testapp):
+        url = '/rest/v1.0/activities?actor=actor0&actor=actor1&limit=2'
+        res = testapp.get(url, headers=headers)
+        assert ['activity 0', 'activity 1'] == \
+            descriptions(res.json['activities'])
+        assert res.json['more']
+        cursor = res.json['cursor']
+        res = testapp.get(url + '&since=' + cursor, headers=headers)
+        assert ['activity 2', 'activity 3'] == \
+            descriptions(res.json['activities'])
+        res = testapp.get(url + '&since=' + res.json['cursor'],
+                          headers=headers)
+        assert ['activity 4'] == descriptions(res.json['activities'])
+        assert not res.json['more']
+        cursor = res.json['cursor']
+        res = testapp.get(url + '&since=' + cursor, headers=headers)
+        assert [] == res.json['activities']
+        assert cursor == res.json['cursor']
+
+    def test_filters(self, headers, testapp):
+        res = testapp.get('/rest/v1.0/activities?actor=actor0'
+                          '&category=User&since=2015-01-02',
+                          headers=headers)
+        assert ['activity 2'] == descriptions(res.json['activities'])
+
+    def test_not_settled(self, headers, testapp):
+        db.session.add(Activity('fresh', u'just now'))
+        db.session.commit()
+        url = '/rest/v1.0/activities?actor=fresh'
+        config = testapp.app.config
+        settle, config['ACTIVITY_API_SETTLE'] = \
+            config['ACTIVITY_API_SETTLE'], 3600
+        try:
+            res = testapp.get(url, headers=headers)
+        finally:
+            config['ACTIVITY_API_SETTLE'] = settle
+        assert [] == res.json['activities']
+        res = testapp.get(url, headers=headers)
+        assert ['just now'] == descriptions(res.json['activities'])
+
+    def test_unwritten_activity_holds_back_later_ones(self, headers,
+                                                       testapp):
+        # activity 2 is still buffered (or retried) by the writer
+        with patch.object(activity_writer, 'pending_since',
+                          return_value=dt.datetime(2015, 1, 3)):
+            res = testapp.get('/rest/v1.0/activities', headers=headers)
+        assert ['activity 0', 'activity 1'] == \
+            descriptions(res.json['activities'])
+
+    def test_ndjson(self, headers, testapp):
+        config = testapp.app.config
+        batch, config['ACTIVITY_EXPORT_BATCH'] = \
+            config['ACTIVITY_EXPORT_BATCH'], 2
+        try:
+            res = testapp.get('/rest/v1.0/activities?format=ndjson'
+                              '&actor=actor1', headers=headers)
+        finally:
+            config['ACTIVITY_EXPORT_BATCH'] = batch
+        assert 'application/x-ndjson' == res.content_type
+        lines = [json.loads(line) for line in res.body.splitlines()]
+        assert ['activity 1', 'activity 3'] == descriptions(lines)
+        res = testapp.get('/rest/v1.0/activities?actor=actor1&since=' +
+                          lines[0]['cursor'], headers=headers)
+        assert ['activity 3'] == descriptions(res.json['activities'])
+
+    @pytest.mark.parametrize('query', ['since=nonsense', 'limit=0',
+                                       'limit=1000000'])
+    def test_bad_request(self, headers, testapp, query):
+        testapp.get('/rest/v1.0/activities?' + query, headers=headers,
+                    status=400)
+
+    def test_not_permitted(self, user, testapp):
+        testapp.get('/rest/v1.0/activities',
+                    headers=basic_auth(user.username, 'myprecious'),
+                    status=403)
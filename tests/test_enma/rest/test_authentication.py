@@ -0,0 +1,33 @@
+# -*- coding: utf-8 -*-
+"""Functional tests of the REST API authentication."""
+
+import pytest
+from webtest.app import AppError
+
+from tests.test_enma.helpers import basic_auth
+
+
+class TestBasicAuthentication:
+
+    def test_valid_credentials(self, user, testapp):
+        res = testapp.get('/rest/v1.0/entitlements',
+                          headers=basic_auth(user.username, 'myprecious'))
+        assert 200 == res.status_int
+
+    def test_invalid_password(self, user, testapp):
+        with pytest.raises(AppError) as e:
+            testapp.get('/rest/v1.0/entitlements',
+                        headers=basic_auth(user.username, 'wrong'))
+        assert '401' in str(e.value)
+
+    def test_unknown_user(self, user, testapp):
+        with pytest.raises(AppError) as e:
+            testapp.get('/rest/v1.0/entitlements',
+                        headers=basic_auth('unknown', 'myprecious'))
+        assert '401' in str(e.value)
+
+    def test_valid_token(self, user, testapp):
+        token = user.generate_auth_token(60)
+        res = testapp.get('/rest/v1.0/entitlements',
+                          headers=basic_auth(token))
+        assert 200 == res.status_int
@@ -0,0 +1,42 @@
+# -*- coding: utf-8 -*-
+"""Unit tests of the REST response serialization."""
+import datetime as dt
+import json
+
+from enma.activity.models import Activity
+from enma.rest.serialization import dumps, extractor, json_response, \
+    stream_list
+
+
+def test_dumps_is_compact():
+    assert {'a': [1, 2]} == json.loads(dumps({'a': [1, 2]}))
+    assert ' ' not in dumps({'a': [1, 2]})
+    assert '\n' in dumps({'a': [1, 2]}, pretty=True)
+
+
+def test_extractor_converts_dates():
+    activity = Activity('actor', 'description')
+    activity.timestamp = dt.datetime(2015, 1, 2, 3, 4, 5)
+    assert {'actor': 'actor', 'timestamp': '2015-01-02T03:04:05'} == \
+        extractor(Activity, ('actor', 'timestamp'))(activity)
+    assert {'actor': 'actor'} == extractor(Activity, ('actor',))(activity)
+    assert extractor(Activity, ('actor',)) is \
+        extractor(Activity, ['actor'])
+
+
+def test_json_response(app):
+    with app.test_request_context():
+        response = json_response({'a': 1}, 201, {'Location': '/a'})
+        assert 201 == response.status_code
+        assert 'application/json' == response.mimetype
+        assert {'a': 1} == json.loads(response.data)
+
+
+def test_stream_list(app):
+    with app.test_request_context():
+        response = stream_list('items', range(5), lambda n: {'n': n},
+                               lambda: {'more': False}, chunk_size=2)
+        assert {'items': [{'n': n} for n in range(5)], 'more': False} == \
+            json.loads(''.join(response.response))
+        response = stream_list('items', [])
+        assert {'items': []} == json.loads(''.join(response.response))
@@ -0,0 +1,170 @@
+# -*- coding: utf-8 -*-
+"""Functional tests of the REST resources of the users."""
+import pytest
+from mock import patch
+
+from enma.activity.models import Activity
+from enma.database import db
+from enma.extensions import mail
+from enma.user.models import User
+from tests.test_enma.factories import UserFactory
+from tests.test_enma.helpers import basic_auth
+
+
+class TestListUsers:
+
+    def test_projection(self, headers, testapp):
+        res = testapp.get('/rest/v1.0/users?fields=nickname,role',
+                          headers=headers)
+        assert 1 == len(res.json['users'])
+        user = res.json['users'][0]
+        assert ['id', 'nickname', 'role'] == sorted(user)
+        assert 'SiteAdmin' == user['role']
+
+    def test_filter_and_pages(self, headers, testapp):
+        for i in range(5):
+            UserFactory(username='u{0}%ldap'.format(i), active=i % 2 == 0)
+        db.session.commit()
+        url = '/rest/v1.0/users?fields=username&active=yes&limit=2' \
+            '&provider=ldap'
+        res = testapp.get(url, headers=headers)
+        names = [u['username'] for u in res.json['users']]
+        assert ['u0%ldap', 'u2%ldap'] == names
+        res = testapp.get(url + '&after=' + res.json['next'], headers=headers)
+        assert ['u4%ldap'] == [u['username'] for u in res.json['users']]
+        assert None == res.json['next']
+        assert res.json['prev']
+
+    @pytest.mark.parametrize('query', [
+        'fields=password', 'sort=password', 'active=maybe', 'limit=100000'])
+    def test_bad_request(self, headers, testapp, query):
+        testapp.get('/rest/v1.0/users?' + query, headers=headers, status=400)
+
+    def test_not_permitted(self, user, testapp):
+        testapp.get('/rest/v1.0/users',
+                    headers=basic_auth(user.username, 'myprecious'),
+                    status=403)
+
+
+class TestUser:
+
+    def test_get_self(self, user, testapp):
+        res = testapp.get('/rest/v1.0/users/{0}'.format(user.id),
+                          headers=basic_auth(user.username, 'myprecious'))
+        assert user.username == res.json['user']['username']
+
+    def test_get_other_not_permitted(self, user, testapp):
+        other = UserFactory()
+        db.session.commit()
+        testapp.get('/rest/v1.0/users/{0}'.format(other.id),
+                    headers=basic_auth(user.username, 'myprecious'),
+                    status=403)
+
+    def test_get_unknown(self, headers, testapp):
+        testapp.get('/rest/v1.0/users/0', headers=headers, status=404)
+
+    def test_create(self, headers, testapp):
+        res = testapp.post_json('/rest/v1.0/users',
+                                {'username': 'new', 'email': 'new@x.org',
+                                 'password': 'secret', 'role': 'User'},
+                                headers=headers)
+        assert 201 == res.status_int
+        assert 'new%local' == res.json['user']['username']
+        assert res.headers['Location'].endswith(
+            '/rest/v1.0/users/{0}'.format(res.json['user']['id']))
+        user = User.query.get(res.json['user']['id'])
+        assert user.check_password('secret')
+
+    def test_create_duplicate(self, admin, headers, testapp):
+        testapp.post_json('/rest/v1.0/users',
+                          {'username': 'new', 'email': admin.email},
+                          headers=headers, status=409)
+
+    def test_create_invalid(self, headers, testapp):
+        testapp.post_json('/rest/v1.0/users', {'username': 'new'},
+                          headers=headers, status=400)
+
+    def test_patch_own_profile(self, user, testapp):
+        headers = basic_auth(user.username, 'myprecious')
+        with patch.object(mail, 'send'):
+            res = testapp.patch_json('/rest/v1.0/users/{0}'.format(user.id),
+                                     {'first_name': 'Ann',
+                                      'email': 'ann@x.org'},
+                                     headers=headers)
+        assert 'Ann' == res.json['user']['first_name']
+        assert not res.json['user']['email_validated']
+
+    def test_patch_own_role_not_permitted(self, user, testapp):
+        testapp.patch_json('/rest/v1.0/users/{0}'.format(user.id),
+                           {'role': 'SiteAdmin'},
+                           headers=basic_auth(user.username, 'myprecious'),
+                           status=403)
+
+    @pytest.mark.parametrize('changes', [
+        {'password': 'x'}, {'active': 'yes'}, {'role': 'Unknown'},
+        {'email': 'no address'}, {'first_name': 'x' * 41},
+        [{'a': 1}], 'string', {'role': ['SiteAdmin']}])
+    def test_patch_invalid(self, admin, headers, testapp, changes):
+        testapp.patch_json('/rest/v1.0/users/{0}'.format(admin.id), changes,
+                           headers=headers, status=400)
+
+    def test_patch_taken_email(self, admin, headers, testapp):
+        other = UserFactory()
+        db.session.commit()
+        testapp.patch_json('/rest/v1.0/users/{0}'.format(admin.id),
+                           {'email': other.email}, headers=headers,
+                           status=409)
+
+    def test_delete(self, headers, testapp):
+        other = UserFactory()
+        db.session.commit()
+        url = '/rest/v1.0/users/{0}'.format(other.id)
+        testapp.delete(url, headers=headers, status=204)
+        testapp.get(url, headers=headers, status=404)
+
+    def test_recorded_with_the_caller(self, admin, headers, testapp):
+        other = UserFactory()
+        db.session.commit()
+        testapp.delete('/rest/v1.0/users/{0}'.format(other.id),
+                       headers=headers, status=204)
+        activity = Activity.query.filter_by(description='Delete user').one()
+        assert admin.username == activity.actor
+
+    def test_delete_not_permitted(self, user, testapp):
+        testapp.delete('/rest/v1.0/users/{0}'.format(user.id),
+                       headers=basic_auth(user.username, 'myprecious'),
+                       status=403)
+
+
+class TestBulkPatch:
+
+    def test_patch_users(self, headers, testapp):
+        users = [UserFactory(active=False) for _ in range(3)]
+        db.session.commit()
+        res = testapp.patch_json('/rest/v1.0/users', {'users': [
+            {'id': user.id, 'active': True} for user in users]},
+            headers=headers)
+        assert 3 == res.json['updated']
+        assert all(user.active for user in User.query.filter(
+            User.id.in_([user.id for user in users])))
+
+    def test_all_or_nothing(self, headers, testapp):
+        user = UserFactory(active=False)
+        db.session.commit()
+        testapp.patch_json('/rest/v1.0/users', {'users': [
+            {'id': user.id, 'active': True}, {'id': 0, 'active': True}]},
+            headers=headers, status=404)
+        testapp.patch_json('/rest/v1.0/users', {'users': [
+            {'id': user.id, 'active': True}, {'active': True}]},
+            headers=headers, status=400)
+        assert not User.query.get(user.id).active
+
+    def test_limit(self, headers, testapp):
+        config = testapp.app.config
+        limit, config['USERS_BULK_LIMIT'] = config['USERS_BULK_LIMIT'], 1
+        try:
+            testapp.patch_json('/rest/v1.0/users',
+                               {'users': [{'id': 1}, {'id': 2}]},
+                               headers=headers, status=400)
+        finally:
+            config['USERS_BULK_LIMIT'] = limit
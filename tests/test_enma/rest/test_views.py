@@ -0,0 +1,340 @@
+# -*- coding: utf-8 -*-
+"""Functional tests of the REST API resources."""
+import datetime as dt
+import json
+import time
+
+import pytest
+from webtest.app import AppError
+
+from enma.database import db
+from enma.user.models import User, Role
+from enma.entitlement.models import REVOKED
+from enma.entitlement.verifier import EntitlementVerifier
+from tests.test_enma.factories import EntitlementFactory, UserFactory
+from tests.test_enma.helpers import basic_auth
+
+
+class TestEntitlements:
+
+    def test_list(self, user, testapp):
+        EntitlementFactory(name='b', user=user, status=REVOKED)
+        EntitlementFactory(name='a', user=user)
+        EntitlementFactory(name='c')
+        db.session.commit()
+        res = testapp.get('/rest/v1.0/entitlements',
+                          headers=basic_auth(user.username, 'myprecious'))
+        assert ['a', 'b'] == [e['name'] for e in res.json['entitlements']]
+
+    def test_get_granted(self, user, testapp):
+        EntitlementFactory(name='svc', user=user, capacity=5)
+        db.session.commit()
+        res = testapp.get('/rest/v1.0/entitlements/svc',
+                          headers=basic_auth(user.username, 'myprecious'))
+        assert 'svc' == res.json['entitlements']['name']
+        assert 5 == res.json['entitlements']['capacity']
+
+    def test_list_not_modified(self, user, testapp):
+        entitlement = EntitlementFactory(name='a', user=user)
+        db.session.commit()
+        headers = basic_auth(user.username, 'myprecious')
+        res = testapp.get('/rest/v1.0/entitlements', headers=headers)
+        etag = res.headers['ETag']
+        headers['If-None-Match'] = etag
+        res = testapp.get('/rest/v1.0/entitlements', headers=headers)
+        assert 304 == res.status_int
+        assert '' == res.body
+        entitlement.update(status=REVOKED)
+        res = testapp.get('/rest/v1.0/entitlements', headers=headers)
+        assert 200 == res.status_int
+        assert etag != res.headers['ETag']
+
+    def test_get_not_modified_until_expired(self, user, testapp):
+        EntitlementFactory(name='svc', user=user, expiry=dt.datetime.utcnow() +
+                           dt.timedelta(seconds=0.3))
+        db.session.commit()
+        headers = basic_auth(user.username, 'myprecious')
+        res = testapp.get('/rest/v1.0/entitlements/svc', headers=headers)
+        headers['If-None-Match'] = res.headers['ETag']
+        res = testapp.get('/rest/v1.0/entitlements/svc', headers=headers)
+        assert 304 == res.status_int
+        time.sleep(0.4)  # expires without a change of the version
+        testapp.get('/rest/v1.0/entitlements/svc', headers=headers,
+                    status=404)
+
+    def test_etag_depends_on_user(self, user, testapp):
+        other = UserFactory(password='other')
+        db.session.commit()
+        res = testapp.get('/rest/v1.0/entitlements',
+                          headers=basic_auth(user.username, 'myprecious'))
+        headers = basic_auth(other.username, 'other')
+        headers['If-None-Match'] = res.headers['ETag']
+        res = testapp.get('/rest/v1.0/entitlements', headers=headers)
+        assert 200 == res.status_int
+
+    @pytest.mark.parametrize('kwargs', [
+        {'status': REVOKED},
+        {'expiry': dt.datetime(2000, 1, 1)},
+        {'name': 'other'},
+    ])
+    def test_get_not_valid(self, user, testapp, kwargs):
+        values = dict(name='svc', user=user)
+        values.update(kwargs)
+        EntitlementFactory(**values)
+        db.session.commit()
+        with pytest.raises(AppError) as e:
+            testapp.get('/rest/v1.0/entitlements/svc',
+                        headers=basic_auth(user.username, 'myprecious'))
+        assert '404' in str(e.value)
+
+
+class TestEntitlementUsage:
+
+    def test_report_and_query(self, user, testapp):
+        EntitlementFactory(name='svc', user=user, capacity=10)
+        db.session.commit()
+        headers = basic_auth(user.username, 'myprecious')
+        res = testapp.post('/rest/v1.0/entitlements/svc/usage',
+                           json.dumps({'amount': 4}), headers=headers,
+                           content_type='application/json')
+        assert 202 == res.status_int
+        assert {'name': 'svc', 'capacity': 10, 'used': 4,
+                'remaining': 6} == res.json
+        testapp.post('/rest/v1.0/entitlements/svc/usage',
+                     json.dumps({'amount': 8}), headers=headers,
+                     content_type='application/json')
+        res = testapp.get('/rest/v1.0/entitlements/svc/usage',
+                          headers=headers)
+        assert 12 == res.json['used']
+        assert 0 == res.json['remaining']
+
+    def test_unlimited(self, user, testapp):
+        EntitlementFactory(name='svc', user=user)
+        db.session.commit()
+        res = testapp.get('/rest/v1.0/entitlements/svc/usage',
+                          headers=basic_auth(user.username, 'myprecious'))
+        assert None == res.json['remaining']
+
+    @pytest.mark.parametrize('body', [{}, {'amount': 0}, {'amount': 'x'},
+                                      {'amount': True}, []])
+    def test_bad_amount(self, user, testapp, body):
+        EntitlementFactory(name='svc', user=user)
+        db.session.commit()
+        testapp.post('/rest/v1.0/entitlements/svc/usage', json.dumps(body),
+                     headers=basic_auth(user.username, 'myprecious'),
+                     content_type='application/json', status=400)
+
+    def test_not_granted(self, user, testapp):
+        testapp.post('/rest/v1.0/entitlements/svc/usage',
+                     json.dumps({'amount': 1}),
+                     headers=basic_auth(user.username, 'myprecious'),
+                     content_type='application/json', status=404)
+
+
+class TestEntitlementsCheck:
+
+    def check(self, testapp, user, body, status=200):
+        return testapp.post('/rest/v1.0/entitlements:check', json.dumps(body),
+                            headers=basic_auth(user.username, 'myprecious'),
+                            content_type='application/json', status=status)
+
+    def test_check_own(self, user, testapp):
+        EntitlementFactory(name='a', user=user, capacity=3)
+        db.session.commit()
+        res = self.check(testapp, user, {'names': ['a', 'b', 'a']})
+        checks = res.json['checks']
+        assert [('a', True), ('b', False)] == \
+            [(c['name'], c['granted']) for c in checks]
+        assert 3 == checks[0]['entitlement']['capacity']
+        assert None == checks[1]['entitlement']
+        assert [user.username] * 2 == [c['user'] for c in checks]
+
+    def test_check_other_users(self, admin, testapp):
+        other = UserFactory()
+        EntitlementFactory(name='a', user=other)
+        db.session.commit()
+        res = self.check(testapp, admin,
+                         {'names': ['a'],
+                          'users': [admin.username, other.username]})
+        assert [False, True] == [c['granted'] for c in res.json['checks']]
+
+    def test_check_other_users_not_permitted(self, user, testapp):
+        self.check(testapp, user, {'names': ['a'], 'users': ['x%local']},
+                   status=403)
+
+    @pytest.mark.parametrize('body', [
+        [], {}, {'names': 'a'}, {'names': [1]}, {'names': ['a'], 'users': 'x'},
+    ])
+    def test_bad_request(self, admin, testapp, body):
+        self.check(testapp, admin, body, status=400)
+
+    def test_unknown_user(self, admin, testapp):
+        res = self.check(testapp, admin,
+                         {'names': ['a'], 'users': ['unknown%local']},
+                         status=400)
+        assert 'unknown%local' in res.json['message']
+
+    def test_limit(self, user, testapp):
+        config = testapp.app.config
+        limit, config['ENTITLEMENT_CHECK_LIMIT'] = \
+            config['ENTITLEMENT_CHECK_LIMIT'], 2
+        try:
+            self.check(testapp, user, {'names': ['a', 'b', 'c']}, status=400)
+        finally:
+            config['ENTITLEMENT_CHECK_LIMIT'] = limit
+
+    def test_limit_before_lookup(self, admin, testapp):
+        # the size of the request is checked before any work is done
+        config = testapp.app.config
+        limit, config['ENTITLEMENT_CHECK_LIMIT'] = \
+            config['ENTITLEMENT_CHECK_LIMIT'], 4
+        try:
+            res = self.check(testapp, admin,
+                             {'names': ['a'] * 3,
+                              'users': ['unknown%local'] * 2}, status=400)
+        finally:
+            config['ENTITLEMENT_CHECK_LIMIT'] = limit
+        assert 'At most 4 checks at once' == res.json['message']
+
+
+class TestEntitlementsToken:
+
+    def test_issue_and_verify(self, admin, testapp):
+        EntitlementFactory(name='a', user=admin)
+        db.session.commit()
+        headers = basic_auth(admin.username, 'myprecious')
+        res = testapp.put('/rest/v1.0/entitlements:token', headers=headers)
+        assert 201 == res.status_int
+        keys = testapp.get('/rest/v1.0/entitlements:key',
+                           headers=headers).json['keys']
+        assertion = EntitlementVerifier(keys).verify(res.json['token'])
+        assert assertion.allows('a')
+
+    def test_key_not_permitted(self, user, testapp):
+        with pytest.raises(AppError) as e:
+            testapp.get('/rest/v1.0/entitlements:key',
+                        headers=basic_auth(user.username, 'myprecious'))
+        assert '403' in str(e.value)
+
+
+class TestEntitlementsFeed:
+
+    def test_long_poll_timeout(self, user, testapp):
+        headers = basic_auth(user.username, 'myprecious')
+        res = testapp.get('/rest/v1.0/entitlements:feed?timeout=0',
+                          headers=headers)
+        assert [] == res.json['events']
+        version = res.json['version']
+        res = testapp.get('/rest/v1.0/entitlements:feed?timeout=0&version=%d'
+                          % version, headers=headers)
+        assert [] == res.json['events']
+
+    def test_long_poll_outdated_version(self, user, testapp):
+        headers = basic_auth(user.username, 'myprecious')
+        version = testapp.get('/rest/v1.0/entitlements:feed?timeout=0',
+                              headers=headers).json['version']
+        EntitlementFactory(name='svc', user=user)
+        db.session.commit()
+        res = testapp.get('/rest/v1.0/entitlements:feed?version=%d' % version,
+                          headers=headers)
+        assert ['resync'] == [e['type'] for e in res.json['events']]
+        assert version != res.json['version']
+
+    def test_long_poll_expiry(self, user, testapp):
+        EntitlementFactory(name='svc', user=user, expiry=dt.datetime.utcnow() +
+                           dt.timedelta(seconds=0.2))
+        db.session.commit()
+        res = testapp.get('/rest/v1.0/entitlements:feed?timeout=5',
+                          headers=basic_auth(user.username, 'myprecious'))
+        assert ['expired'] == [e['type'] for e in res.json['events']]
+
+    def test_server_sent_events(self, user, testapp):
+        config = testapp.app.config
+        duration, config['ENTITLEMENT_FEED_DURATION'] = \
+            config['ENTITLEMENT_FEED_DURATION'], 0.1
+        heartbeat, config['ENTITLEMENT_FEED_HEARTBEAT'] = \
+            config['ENTITLEMENT_FEED_HEARTBEAT'], 0.05
+        try:
+            headers = basic_auth(user.username, 'myprecious')
+            headers['Accept'] = 'text/event-stream'
+            res = testapp.get('/rest/v1.0/entitlements:feed', headers=headers)
+        finally:
+            config['ENTITLEMENT_FEED_DURATION'] = duration
+            config['ENTITLEMENT_FEED_HEARTBEAT'] = heartbeat
+        assert res.content_type == 'text/event-stream'
+        assert 'event: heartbeat\n' in res.body
+
+
+class TestCaches:
+
+    def test_statistics(self, admin, testapp):
+        res = testapp.get('/rest/v1.0/caches',
+                          headers=basic_auth(admin.username, 'myprecious'))
+        assert 'hits' in res.json['entitlement_decisions']
+        assert 'roles' in res.json['roles']
+
+    def test_not_permitted(self, user, testapp):
+        with pytest.raises(AppError) as e:
+            testapp.get('/rest/v1.0/caches',
+                        headers=basic_auth(user.username, 'myprecious'))
+        assert '403' in str(e.value)
+
+
+class TestUsersImport:
+
+    def test_import_json(self, admin, testapp):
+        body = json.dumps([{'username': 'new', 'email': 'new@test.org'}])
+        res = testapp.post('/rest/v1.0/users/import', body,
+                           headers=basic_auth(admin.username, 'myprecious'),
+                           content_type='application/json')
+        assert 201 == res.status_int
+        assert 1 == res.json['created']
+        assert User.query.filter_by(username='new%local').first()
+
+    def test_import_csv(self, admin, testapp):
+        body = 'username,email\nnew,new@test.org\nbad,\n'
+        res = testapp.post('/rest/v1.0/users/import', body,
+                           headers=basic_auth(admin.username, 'myprecious'),
+                           content_type='text/csv')
+        assert 1 == res.json['created']
+        assert [{'row': 2, 'message': 'Username and email required'}] == \
+            res.json['errors']
+
+    def test_import_invalid_json(self, admin, testapp):
+        with pytest.raises(AppError) as e:
+            testapp.post('/rest/v1.0/users/import', '[',
+                         headers=basic_auth(admin.username, 'myprecious'),
+                         content_type='application/json')
+        assert '400' in str(e.value)
+
+    def test_import_not_permitted(self, user, testapp):
+        with pytest.raises(AppError) as e:
+            testapp.post('/rest/v1.0/users/import', '[]',
+                         headers=basic_auth(user.username, 'myprecious'),
+                         content_type='application/json')
+        assert '403' in str(e.value)
+
+    def test_import_role_not_held(self, user, testapp):
+        Role.insert_roles(True)
+        user.set_role('Admin')
+        user.save()
+        body = json.dumps([{'username': 'new', 'email': 'new@test.org'},
+                           {'username': 'boss', 'email': 'boss@test.org',
+                            'role': ' SiteAdmin'}])
+        res = testapp.post('/rest/v1.0/users/import', body,
+                           headers=basic_auth(user.username, 'myprecious'),
+                           content_type='application/json', status=403)
+        assert 'Assignment of role SiteAdmin' == res.json['message']
+        assert User.query.filter_by(username='new%local').first() is None
+
+    def test_import_limit(self, admin, testapp):
+        config = testapp.app.config
+        limit, config['USER_IMPORT_LIMIT'] = config['USER_IMPORT_LIMIT'], 1
+        try:
+            body = json.dumps([{'username': 'a', 'email': 'a@test.org'},
+                               {'username': 'b', 'email': 'b@test.org'}])
+            testapp.post('/rest/v1.0/users/import', body,
+                         headers=basic_auth(admin.username, 'myprecious'),
+                         content_type='application/json', status=400)
+        finally:
+            config['USER_IMPORT_LIMIT'] = limit
@@ -0,0 +1,53 @@
+# -*- coding: utf-8 -*-
+"""Unit tests of the background flushing."""
+from mock import patch
+
+from enma.background import Flusher
+
+
+class Buffer(Flusher):
+
+    def __init__(self):
+        Flusher.__init__(self)
+        self.items = []
+        self.flushed = []
+
+    def flush(self):
+        self.flushed.extend(self.items)
+        del self.items[:]
+
+    def _pending(self):
+        return bool(self.items)
+
+    def _forget(self):
+        del self.items[:]
+
+
+def test_worker_started_once():
+    buffer = Buffer()
+    with patch.object(Buffer, '_start_worker') as start:
+        start.side_effect = lambda: setattr(buffer, '_worker', start)
+        buffer.ensure_worker()
+        buffer.ensure_worker()
+    assert 1 == start.call_count
+
+
+def test_forked_process_forgets():
+    buffer = Buffer()
+    buffer.items.append(1)
+    buffer._pid = -1  # as if forked
+    with patch.object(Buffer, '_start_worker'):
+        buffer.ensure_worker()
+    assert [] == buffer.items
+
+
+def test_worker_flushes_and_shutdown_stops_it(app):
+    buffer = Buffer()
+    buffer.init_app(app)
+    buffer.flush_interval = 0.01
+    buffer.ensure_worker()
+    buffer.items.append(1)
+    buffer.wakeup()
+    buffer.shutdown()
+    assert [1] == buffer.flushed
+    assert buffer._worker is None
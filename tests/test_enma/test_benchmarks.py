@@ -0,0 +1,28 @@
+# -*- coding: utf-8 -*-
+"""Smoke test of the hot path benchmark - every scenario succeeds."""
+from tests.benchmarks.bench_hotpaths import run, compare, percentile
+
+
+def test_scenarios_run():
+    report = run(scales=(5, 10), activities=30, requests=2, warmup=1)
+    assert 18 == len(report['results'])
+    result = report['results']['members_deep@10']
+    assert 2 == result['requests']
+    assert result['latency_ms']['p50'] <= result['latency_ms']['max']
+    assert [5, 10] == report['meta']['users']
+    assert [] == compare(report, report)
+
+
+def test_compare():
+    def report(p50):
+        return {'results': {'rest_basic_cached@10': {'latency_ms': {'p50': p50}}}}
+    assert [] == compare(report(10.0), report(11.0))
+    assert [('rest_basic_cached@10', 10.0, 13.0, 1.3)] == \
+        compare(report(10.0), report(13.0))
+
+
+def test_percentile():
+    ordered = range(1, 101)
+    assert 50 == percentile(ordered, 50)
+    assert 99 == percentile(ordered, 99)
+    assert 7 == percentile([7], 90)
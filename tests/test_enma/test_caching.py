@@ -0,0 +1,43 @@
+# -*- coding: utf-8 -*-
+"""Unit tests of the in-process caches."""
+import time
+
+from enma.caching import TTLCache
+
+
+def test_get_and_set():
+    cache = TTLCache('TEST_CACHE')
+    assert None == cache.get('key')
+    cache.set('key', 'value')
+    assert 'value' == cache.get('key')
+    assert 'key' in cache
+    assert 1 == cache.misses
+    assert 2 == cache.hits
+
+
+def test_lru_eviction():
+    cache = TTLCache('TEST_CACHE', maxsize=2)
+    cache.set('a', 1)
+    cache.set('b', 2)
+    cache.get('a')
+    cache.set('c', 3)
+    assert 1 == cache.get('a')
+    assert None == cache.get('b')
+    assert 1 == cache.evictions
+
+
+def test_expiry():
+    cache = TTLCache('TEST_CACHE', ttl=60)
+    cache.set('key', 'value', ttl=-1)
+    assert None == cache.get('key')
+    assert 1 == cache.expirations
+    cache.set('key', 'value', ttl=3600)  # capped to the cache ttl
+    assert cache._data['key'][0] <= time.time() + 60
+
+
+def test_configured_by_app(app):
+    app.config['TEST_CACHE_SIZE'] = 0
+    cache = TTLCache('TEST_CACHE', app=app)
+    cache.set('key', 'value')
+    assert 0 == len(cache)
+    assert 0 == cache.stats()['maxsize']
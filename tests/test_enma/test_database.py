@@ -0,0 +1,59 @@
+# -*- coding: utf-8 -*-
+"""Unit tests of the database utilities."""
+import datetime as dt
+
+import pytest
+
+from enma.activity.models import Activity
+from enma.database import KeysetPagination
+
+
+@pytest.fixture
+def activities(db):
+    start = dt.datetime(2015, 4, 1)
+    for n in range(25):
+        # pairs of activities share a timestamp - the id breaks the tie
+        activity = Activity('actor', 'activity %d' % n)
+        activity.timestamp = start + dt.timedelta(minutes=n // 2)
+        db.session.add(activity)
+    db.session.commit()
+    return Activity.query.order_by(Activity.timestamp.desc(),
+                                   Activity.id.desc()).all()
+
+
+def paginate(**kwargs):
+    return KeysetPagination(Activity.query, (Activity.timestamp, Activity.id),
+                            per_page=10, **kwargs)
+
+
+def test_first_page(activities):
+    pagination = paginate()
+    assert activities[:10] == pagination.items
+    assert pagination.has_next
+    assert not pagination.has_prev
+    assert None == pagination.prev_cursor
+
+
+def test_walk_forward_and_back(activities):
+    second = paginate(after=paginate().next_cursor)
+    assert activities[10:20] == second.items
+    assert second.has_prev and second.has_next
+    last = paginate(after=second.next_cursor)
+    assert activities[20:] == last.items
+    assert not last.has_next
+    assert None == last.next_cursor
+    back = paginate(before=last.prev_cursor)
+    assert activities[10:20] == back.items
+    assert back.has_prev and back.has_next
+
+
+def test_ascending(activities):
+    pagination = KeysetPagination(Activity.query,
+                                  (Activity.timestamp, Activity.id),
+                                  per_page=10, descending=False)
+    assert list(reversed(activities))[:10] == pagination.items
+
+
+@pytest.mark.parametrize('cursor', ['garbage', 'W10=', u'\xe4'])
+def test_invalid_cursor_starts_at_the_beginning(activities, cursor):
+    assert activities[:10] == paginate(after=cursor).items
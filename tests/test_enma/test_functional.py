@@ -8,6 +8,7 @@ from mock import Mock
 from flask import url_for
 
 from enma.user.models import User, Permission
+from enma.activity.models import Activity
 from tests.test_enma.factories import UserFactory
 from enma.user.admin import establish_admin_defaults
 from webtest.app import AppError
@@ -336,6 +337,19 @@ class TestUserPagesAndSettings:
         """
         testapp.get(url_for('activity.home'))
 
+    def test_page_through_user_activity(self, logged_in, user, testapp):
+        """
+        Test that User can page through his activity log
+        """
+        for n in range(15):
+            Activity(user.username, 'activity %d' % n).save()
+        res = testapp.get(url_for('activity.home'))
+        assert 'activity 14' in res
+        assert 'activity 3' not in res
+        res = res.click('Older')
+        assert 'activity 3' in res
+        assert 'activity 14' not in res
+
     def test_access_user_profile_after_login(self, logged_in, user, testapp):
         """
         Test that User can access his profile after login
@@ -592,6 +606,26 @@ class TestUserManagementPages:
         res = testapp.get(url_for('user.members'))
         assert user.nickname in res
 
+    def test_user_manager_filters_and_pages_user_list(self, user, testapp):
+        """
+        Test that the user list is filtered and paged
+        """
+        user.role.permissions = Permission.READ_USER
+        user.save()
+        testapp.app.config['MEMBERS_PER_PAGE'] = 2
+        try:
+            for nick in ('alpha', 'beta', 'gamma'):
+                UserFactory(username=nick + '%google').save()
+            res = testapp.get(url_for('user.members', provider='google'))
+            assert 'alpha' in res
+            assert 'beta' in res
+            assert 'gamma' not in res
+            res = res.click(u'Next')
+            assert 'gamma' in res
+            assert 'alpha' not in res
+        finally:
+            testapp.app.config['MEMBERS_PER_PAGE'] = 50
+
     def test_user_access_to_other_users_data_not_permitted(self, user, testapp):
         """
         Test that User cannot access other users data
@@ -0,0 +1,98 @@
+# -*- coding: utf-8 -*-
+"""Unit tests of the per request SQL instrumentation."""
+import pytest
+from flask import g
+from mock import patch
+
+from enma.instrumentation import query_stats, SQLStatsDebugPanel, \
+    fingerprint
+from enma.user.models import User
+
+
+@pytest.yield_fixture
+def stats(app, db):
+    app.config.update(SQL_INSTRUMENTATION=True, SQL_HEADERS=True,
+                      SQL_REPEATED_STATEMENTS=3)
+    settings = dict((name, getattr(query_stats, name))
+                    for name in ('enabled', 'slow', 'threshold', 'headers'))
+    query_stats.init_app(app)
+
+    @app.route('/_sql/<int:count>')
+    def lookups(count):
+        for _ in range(count):
+            db.session.query(User.id).filter_by(id=0).first()
+        return 'done'
+
+    yield query_stats
+    query_stats.reset()
+    query_stats.__dict__.update(settings)
+
+
+def test_counts_statements(stats, app):
+    with patch('enma.instrumentation.logger') as logger:
+        response = app.test_client().get('/_sql/2')
+    assert '2' == response.headers['X-SQL-Statements']
+    assert float(response.headers['X-SQL-Time']) >= 0
+    assert '0' == response.headers['X-SQL-Repeated']
+    assert not logger.warning.called
+
+
+def test_flags_repeated_statements(stats, app):
+    with patch('enma.instrumentation.logger') as logger:
+        response = app.test_client().get('/_sql/4')
+    assert '1' == response.headers['X-SQL-Repeated']
+    assert 4 == logger.warning.call_args[0][1]
+    assert 'lookups' == logger.warning.call_args[0][2]
+
+
+def test_endpoint_stats(stats, app):
+    client = app.test_client()
+    client.get('/_sql/1')
+    client.get('/_sql/3')
+    endpoint = stats.stats()['lookups']
+    assert 2 == endpoint['requests']
+    assert 4 == endpoint['statements']
+    assert 2.0 == endpoint['statements_per_request']
+    assert 3 == endpoint['max_statements']
+    assert 1 == endpoint['repeated']
+    stats.reset()
+    assert {} == stats.stats()
+
+
+def test_logs_slow_statements(stats, app):
+    stats.slow = 0
+    with patch('enma.instrumentation.logger') as logger:
+        app.test_client().get('/_sql/1')
+    args = logger.warning.call_args[0]
+    assert 12 == len(args[2])  # a digest of the parameters, not values
+    assert 'SELECT' in args[3]
+
+
+def test_fingerprint():
+    assert fingerprint((1, 'a')) == fingerprint((1, 'a'))
+    assert fingerprint((1, 'a')) != fingerprint((1, 'b'))
+
+
+def test_debug_panel(stats, app):
+    client = app.test_client()
+    client.get('/_sql/3')
+    panel = SQLStatsDebugPanel(app.jinja_env)
+    g._sql_stats = None  # not instrumented request
+    panel.process_response(None, None)
+    assert 'not instrumented' == panel.nav_subtitle()
+    assert 'lookups' in panel.content()
+    stats._start()
+    User.query.get(0)
+    panel.process_response(None, None)
+    assert panel.nav_subtitle().startswith('1 statements')
+
+
+def test_failed_statement_leaves_nothing_behind(stats, db):
+    stats._start()
+    with pytest.raises(Exception):
+        db.session.execute('SELECT * FROM no_such_table')
+    db.session.rollback()
+    connection = db.session.connection()
+    User.query.get(0)
+    assert not connection.info.get('sql_started')
+    assert 1 == stats.current().statements
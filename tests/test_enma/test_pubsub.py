@@ -0,0 +1,46 @@
+# -*- coding: utf-8 -*-
+"""Unit tests of the in-process publish/subscribe."""
+import threading
+
+from enma.pubsub import PubSub
+
+
+def test_publish_to_subscribers():
+    pubsub = PubSub()
+    first = pubsub.subscribe('a')
+    second = pubsub.subscribe('a')
+    other = pubsub.subscribe('b')
+    assert 2 == pubsub.publish('a', 'message')
+    assert 'message' == first.get(0)
+    assert 'message' == second.get(0)
+    assert None == other.get_nowait()
+    assert 1 == pubsub.published
+    assert 2 == pubsub.delivered
+
+
+def test_unsubscribe():
+    pubsub = PubSub()
+    with pubsub.subscribe('a') as subscription:
+        assert 1 == pubsub.subscribers('a')
+    assert 0 == pubsub.subscribers()
+    assert 0 == pubsub.publish('a', 'message')
+    assert None == subscription.get_nowait()
+
+
+def test_overflow():
+    pubsub = PubSub(maxsize=2)
+    subscription = pubsub.subscribe('a')
+    for message in range(3):
+        pubsub.publish('a', message)
+    assert subscription.overflowed
+    assert [0, 1] == [subscription.get(0), subscription.get(0)]
+
+
+def test_wait_for_message():
+    pubsub = PubSub()
+    subscription = pubsub.subscribe('a')
+    timer = threading.Timer(0.05, pubsub.publish, ('a', 'late'))
+    timer.start()
+    assert 'late' == subscription.get(5)
+    timer.join()
+    assert None == subscription.get(0.01)
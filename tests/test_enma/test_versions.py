@@ -0,0 +1,63 @@
+# -*- coding: utf-8 -*-
+"""Unit tests of the version counters of resources."""
+from sqlalchemy.sql.expression import Update
+
+from enma.database import db as _db
+from enma.entitlement.models import Entitlement, REVOKED
+from enma.versions import bump_version, current_version
+from tests.test_enma.factories import EntitlementFactory, UserFactory
+
+
+def test_bump_version(db):
+    assert 0 == current_version('things', 1)
+    connection = _db.session.connection()
+    bump_version(connection, 'things', 1)
+    bump_version(connection, 'things', 1)
+    bump_version(connection, 'things', 2)
+    _db.session.commit()
+    assert 2 == current_version('things', 1)
+    assert 1 == current_version('things', 2)
+    assert 0 == current_version('other', 1)
+
+
+def test_entitlement_changes_bump_version(user):
+    version = Entitlement.version(user.id)
+    entitlement = EntitlementFactory(user=user)
+    _db.session.commit()
+    assert version + 1 == Entitlement.version(user.id)
+    entitlement.update(status=REVOKED)
+    assert version + 2 == Entitlement.version(user.id)
+    other = UserFactory()
+    _db.session.commit()
+    entitlement.update(user=other)  # moved - both have changed
+    assert version + 3 == Entitlement.version(user.id)
+    assert 1 == Entitlement.version(other.id)
+    entitlement.delete()
+    assert 2 == Entitlement.version(other.id)
+
+
+class Racing(object):
+    """ A connection whose first update misses the row, as if a concurrent
+    transaction inserted it meanwhile
+    """
+
+    def __init__(self, connection):
+        self.connection = connection
+        self.missed = False
+
+    def execute(self, statement):
+        if not self.missed and isinstance(statement, Update):
+            self.missed = True
+            return type('Result', (object,), {'rowcount': 0})()
+        return self.connection.execute(statement)
+
+    def __getattr__(self, name):
+        return getattr(self.connection, name)
+
+
+def test_concurrent_first_bump(db):
+    connection = _db.session.connection()
+    bump_version(connection, 'things', 1)
+    bump_version(Racing(connection), 'things', 1)
+    _db.session.commit()
+    assert 2 == current_version('things', 1)
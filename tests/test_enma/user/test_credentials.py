@@ -0,0 +1,63 @@
+# -*- coding: utf-8 -*-
+"""Unit tests of the credential verification."""
+import threading
+
+import pytest
+from mock import patch
+
+from enma.user.credentials import CredentialVerifier, CredentialsBusy
+
+
+@pytest.fixture
+def verifier(app):
+    return CredentialVerifier(app)
+
+
+def test_verify_and_lookup(user, verifier):
+    assert None == verifier.lookup(user.username, 'myprecious')
+    identity = verifier.verify(user, 'myprecious')
+    assert identity == user
+    assert identity is verifier.lookup(user.username, 'myprecious')
+
+
+def test_wrong_password_not_cached(user, verifier):
+    assert None == verifier.verify(user, 'wrong')
+    assert None == verifier.lookup(user.username, 'wrong')
+
+
+def test_set_password_invalidates(user, verifier):
+    verifier.verify(user, 'myprecious')
+    user.set_password('new-password')
+    user.save()
+    assert None == verifier.lookup(user.username, 'myprecious')
+
+
+def test_check_on_request_thread(app, user):
+    app.config['BCRYPT_POOL_SIZE'] = 0
+    verifier = CredentialVerifier(app)
+    assert verifier.verify(user, 'myprecious') == user
+
+
+def test_exhausted_pool(app, user):
+    app.config['BCRYPT_POOL_BACKLOG'] = 1
+    verifier = CredentialVerifier(app)
+    verifier._slots.acquire()
+    with pytest.raises(CredentialsBusy):
+        verifier.verify(user, 'myprecious')
+
+
+def test_slot_held_until_check_done(app, user):
+    app.config['BCRYPT_POOL_BACKLOG'] = 1
+    app.config['BCRYPT_POOL_TIMEOUT'] = 0.01
+    verifier = CredentialVerifier(app)
+    done = threading.Event()
+    with patch('enma.user.credentials.check_password_hash',
+               side_effect=lambda *args: done.wait(5)):
+        with pytest.raises(CredentialsBusy):
+            verifier.verify(user, 'myprecious')
+        # the timed out check still runs and occupies the backlog
+        assert not verifier._slots.acquire(False)
+        done.set()
+        verifier._get_pool().close()
+        verifier._get_pool().join()
+    assert verifier._slots.acquire(False)
@@ -0,0 +1,83 @@
+# -*- coding: utf-8 -*-
+"""Unit tests of the bulk import of users."""
+import pytest
+from mock import patch
+
+from enma.user import importer
+from enma.user.models import User
+from enma.user.importer import import_users, parse_csv, parse_json
+
+
+def test_import(db):
+    report = import_users([
+        {'username': 'one', 'email': 'one@test.org', 'password': 'secret',
+         'active': 'yes'},
+        {'username': 'two', 'email': 'two@test.org', 'role': 'SiteAdmin'},
+    ], batch_size=1)
+    assert 2 == report.created
+    assert [] == report.errors
+    one = User.query.filter_by(username='one%local').first()
+    assert one.active
+    assert one.check_password('secret')
+    assert 'User' == one.role.name
+    two = User.query.filter_by(username='two%local').first()
+    assert not two.active
+    assert None == two.password
+    assert two.is_administrator()
+
+
+def test_import_reports_errors(user):
+    report = import_users([
+        {'username': user.username, 'email': 'new@test.org'},
+        {'username': 'new', 'email': user.email},
+        {'username': 'dup', 'email': 'dup@test.org'},
+        {'username': 'dup', 'email': 'dup2@test.org'},
+        {'username': 'nomail'},
+        {'username': 'role', 'email': 'role@test.org', 'role': 'Unknown'},
+        {'username': 'x' * 81, 'email': 'long@test.org'},
+        'garbage',
+    ])
+    assert 1 == report.created
+    assert [1, 2, 4, 5, 6, 7, 8] == [row for row, _ in report.errors]
+    assert 'Username already registered' == report.errors[0][1]
+    assert 'Email already registered' == report.errors[1][1]
+    assert 7 == report.as_dict()['failed']
+
+
+def test_import_reports_concurrent_conflicts(user):
+    existing = importer._existing
+    missed = [set(), set()]  # the user is inserted after the deduplication
+    with patch.object(importer, '_existing', side_effect=lambda *args:
+                      missed.pop() if missed else existing(*args)):
+        report = import_users([
+            {'username': 'new', 'email': 'new@test.org'},
+            {'username': user.username, 'email': 'other@test.org'},
+            {'username': 'next', 'email': 'next@test.org'},
+        ], batch_size=2)
+    assert 2 == report.created
+    assert [(2, 'Username already registered')] == report.errors
+    assert User.query.filter_by(username='new%local').first()
+
+
+def test_hash_passwords_in_processes(db):
+    report = import_users([
+        {'username': 'user%d' % n, 'email': 'user%d@test.org' % n,
+         'password': 'secret%d' % n} for n in range(4)], processes=2)
+    assert 4 == report.created
+    user = User.query.filter_by(username='user3%local').first()
+    assert user.check_password('secret3')
+
+
+def test_parse_csv():
+    records = parse_csv(['username,email,first_name',
+                         'one,one@test.org,J\xc3\xbcrgen'])
+    assert [{'username': 'one', 'email': 'one@test.org',
+             'first_name': u'J\xfcrgen'}] == records
+
+
+def test_parse_json():
+    assert [{'username': 'one'}] == parse_json('[{"username": "one"}]')
+    assert [{'username': 'one'}] == \
+        parse_json('{"users": [{"username": "one"}]}')
+    with pytest.raises(ValueError):
+        parse_json('"one"')
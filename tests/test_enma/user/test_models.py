@@ -3,8 +3,13 @@
 import datetime as dt
 
 import pytest
+from mock import patch
 
-from enma.user.models import User, Role, AnonymousUser
+from enma.user import models
+from enma.user.models import User, Role, AnonymousUser, UserIdentity
+from enma.user.models import Permission
+from enma.user.models import token_cache, role_table, identity_cache, \
+    load_identity, SessionUser, invalidate_identity
 from tests.test_enma.factories import UserFactory
 import time
 
@@ -72,6 +77,68 @@ class TestUser:
         db.session.commit()
         assert None ==  User.verify_auth_token(t) # expired
 
+    def test_identify_auth_token_is_cached(self):
+        u1 = User(username='u1', email='u1@mail.org')
+        u1.save()
+        t = u1.generate_auth_token(5)  # valid for five seconds
+        identity = User.identify_auth_token(t)
+        assert isinstance(identity, UserIdentity)
+        assert identity == u1
+        assert identity.role == 'User'
+        hits = token_cache.hits
+        assert identity is User.identify_auth_token(t)
+        assert hits + 1 == token_cache.hits
+
+    def test_identify_auth_token_invalid(self):
+        assert None == User.identify_auth_token('invalid-token')
+
+    def test_identify_auth_token_invalidated_on_deactivation(self):
+        u1 = UserFactory()
+        u1.save()
+        t = u1.generate_auth_token(5)  # valid for five seconds
+        identity = User.identify_auth_token(t)
+        assert identity.active
+        u1.active = False
+        u1.save()
+        assert not identity.is_current()
+        assert not User.identify_auth_token(t).active
+
+    def test_identity_invalidated_again_at_commit(self, db):
+        u1 = UserFactory()
+        u1.save()
+        u1.active = False
+        db.session.flush()
+        # a concurrent request reads the committed (active) row meanwhile
+        identity = UserIdentity(u1.id, u1.username, active=True)
+        db.session.commit()
+        assert not identity.is_current()
+
+    def test_generations_are_bounded(self):
+        identity = UserIdentity(1, 'u1')
+        with patch('enma.user.models.MAX_GENERATIONS', 3):
+            for user_id in range(2, 6):
+                invalidate_identity(user_id)
+            assert len(models._generations) <= 4
+        assert not identity.is_current()
+
+    def test_identify_auth_token_invalidated_on_role_change(self):
+        u1 = UserFactory()
+        u1.save()
+        t = u1.generate_auth_token(5)  # valid for five seconds
+        assert not User.identify_auth_token(t).is_administrator()
+        u1.set_role('SiteAdmin')
+        u1.save()
+        assert User.identify_auth_token(t).is_administrator()
+
+    def test_identify_auth_token_user_deleted(self, db):
+        u1 = User(username='u1', email='u1@mail.org')
+        u1.save()
+        t = u1.generate_auth_token(5)  # valid for five seconds
+        assert User.identify_auth_token(t)
+        db.session.delete(u1)
+        db.session.commit()
+        assert None == User.identify_auth_token(t)
+
     @pytest.mark.skipif("True", reason="Runs to long")
     def test_auth_token_expiry(self, db):
         u1 = User(username='u1', email='u1@mail.org')
@@ -177,3 +244,74 @@ class TestRole:
         role_names = Role.list_of_role_names()
         assert 3 == len(role_names)
         assert 'Admin' in role_names
+
+
+@pytest.mark.usefixtures('db')
+class TestRoleTable:
+    """ Unit tests concerning the in-memory role permission table"""
+
+    def test_can_without_loading_the_role(self, db):
+        u = UserFactory()
+        u.set_role('SiteAdmin')
+        u.save()
+        db.session.expire(u, ['role'])
+        role_table.permissions(None)  # load the table
+        avoided = role_table.avoided
+        assert u.can(Permission.ADMINISTRATOR)
+        assert 'role' not in u.__dict__
+        assert avoided + 1 == role_table.avoided
+
+    def test_insert_roles_invalidates(self):
+        version = role_table.version
+        Role.insert_roles(True)
+        assert version < role_table.version
+        for role in Role.query.all():
+            assert role.permissions == role_table.permissions(role.id)
+        assert 3 == role_table.stats()['roles']
+
+    def test_changed_permissions_are_reloaded(self, db):
+        u = UserFactory()
+        u.save()
+        assert not u.can(Permission.READ_USER)
+        u.role.permissions = Permission.READ_USER
+        u.save()
+        db.session.expire(u, ['role'])
+        assert u.can(Permission.READ_USER)
+
+
+@pytest.mark.usefixtures('db')
+class TestIdentityCache:
+    """ Unit tests concerning the identities of browser sessions"""
+
+    def test_load_identity_is_cached(self):
+        u = UserFactory(first_name='Ann', last_name='Smith')
+        u.save()
+        identity_cache.clear()
+        loaded = load_identity(u.id)
+        assert isinstance(loaded, SessionUser)
+        assert u.username == loaded.username
+        hits = identity_cache.hits
+        again = load_identity(u.id)
+        assert hits + 1 == identity_cache.hits
+        assert again is not loaded  # a copy per request
+        assert 'Ann Smith' == again.full_name  # delegated to the user
+
+    def test_change_invalidates(self):
+        u = UserFactory(active=True)
+        u.save()
+        assert load_identity(u.id).active
+        u.update(active=False)
+        assert not load_identity(u.id).active
+        u.update(email_validated=True)
+        assert load_identity(u.id).email_validated
+        u.set_role('SiteAdmin')
+        u.save()
+        assert load_identity(u.id).is_administrator()
+
+    def test_deleted_user(self):
+        u = UserFactory()
+        u.save()
+        user_id = u.id
+        load_identity(user_id)
+        u.delete()
+        assert None == load_identity(user_id)
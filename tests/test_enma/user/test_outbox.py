@@ -0,0 +1,99 @@
+# -*- coding: utf-8 -*-
+"""Unit tests of the outbox of emails and the mail worker."""
+import datetime as dt
+import smtplib
+
+import pytest
+from mock import MagicMock, patch
+from flask.ext.mail import Message
+
+from enma.extensions import mail
+from enma.user.outbox import OutboxMail, MailWorker, enqueue, QUEUED, \
+    FAILED
+
+
+@pytest.fixture
+def queued(app, db):
+    app.config['MAIL_OUTBOX_SYNC'] = False
+    for number in range(3):
+        enqueue(Message('Subject %d' % number, recipients=['to@test.org'],
+                        body='Body', html='<p>Body</p>'))
+    return OutboxMail.query.order_by(OutboxMail.id).all()
+
+
+@pytest.yield_fixture
+def connection():
+    connection = MagicMock()
+    connection.__enter__.return_value = connection
+    with patch.object(mail, 'connect', return_value=connection):
+        yield connection
+
+
+def test_sync_sends_at_once(app, db):
+    message = Message('Now', recipients=['to@test.org'])
+    with patch.object(mail, 'send') as send:
+        assert None == enqueue(message)
+        send.assert_called_once_with(message)
+    assert 0 == OutboxMail.query.count()
+
+
+def test_enqueue(queued):
+    assert 3 == len(queued)
+    assert QUEUED == queued[0].status
+    message = queued[0].to_message()
+    assert 'Subject 0' == message.subject
+    assert ['to@test.org'] == message.recipients
+    assert '<p>Body</p>' == message.html
+
+
+def test_worker_sends_batches_on_one_connection(queued, connection):
+    worker = MailWorker(batch_size=2)
+    worker.run(once=True)
+    assert 3 == worker.sent
+    assert 3 == connection.send.call_count
+    assert 1 == mail.connect.call_count
+    assert ['Subject 0', 'Subject 1', 'Subject 2'] == \
+        [args[0].subject for args, _ in connection.send.call_args_list]
+    assert 0 == OutboxMail.query.count()
+
+
+def test_worker_retries_with_backoff(app, queued, connection):
+    connection.send.side_effect = [
+        smtplib.SMTPResponseException(421, 'try later'), None, None]
+    worker = MailWorker()
+    worker.run(once=True)
+    assert (2, 1, 0) == (worker.sent, worker.retried, worker.failed)
+    retry = OutboxMail.query.one()
+    assert QUEUED == retry.status
+    assert 1 == retry.attempts
+    assert retry.due > dt.datetime.utcnow() + dt.timedelta(
+        seconds=app.config['MAIL_OUTBOX_BACKOFF'] - 5)
+    # not due yet
+    assert 0 == worker.send_batch()
+
+
+def test_worker_fails_permanent_rejection(queued, connection):
+    connection.send.side_effect = smtplib.SMTPResponseException(550, 'no')
+    worker = MailWorker()
+    worker.run(once=True)
+    assert 3 == worker.failed
+    assert [FAILED] * 3 == [m.status for m in OutboxMail.query]
+
+
+def test_worker_fails_after_max_attempts(app, queued, connection):
+    app.config['MAIL_OUTBOX_MAX_ATTEMPTS'] = 2
+    connection.send.side_effect = IOError('down')
+    worker = MailWorker()
+    for _ in range(2):
+        OutboxMail.query.update({'due': dt.datetime.utcnow()})
+        worker.run(once=True)
+    assert 3 == worker.failed
+    assert [2] * 3 == [m.attempts for m in OutboxMail.query]
+
+
+def test_claim_takes_over_expired_lease(queued, connection):
+    worker = MailWorker()
+    assert 3 == len(worker.claim())
+    assert [] == worker.claim()  # leased
+    OutboxMail.query.update({'due': dt.datetime.utcnow()})
+    assert 3 == len(worker.claim())
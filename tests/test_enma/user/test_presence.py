@@ -0,0 +1,77 @@
+# -*- coding: utf-8 -*-
+"""Unit tests of the write-behind last seen tracking."""
+import datetime as dt
+
+import pytest
+from mock import patch
+
+from enma.database import db as _db
+from enma.user.models import User
+from enma.user.presence import LastSeenTracker
+from tests.test_enma.helpers import basic_auth
+
+
+@pytest.yield_fixture
+def tracker(app, db):
+    with patch.object(LastSeenTracker, '_start_worker'):
+        tracker = LastSeenTracker(app)
+        tracker.enabled = True
+        yield tracker
+
+
+def last_seen(user_id):
+    return _db.session.query(User.last_seen).filter_by(id=user_id).scalar()
+
+
+def test_touches_are_coalesced(tracker, user):
+    now = dt.datetime.utcnow()
+    for seconds in range(3):
+        tracker.touch(user.id, now + dt.timedelta(seconds=seconds))
+    assert 1 == tracker.pending()
+    assert 1 == tracker.flush()
+    assert now + dt.timedelta(seconds=2) == last_seen(user.id)
+    tracker.touch(user.id, now + dt.timedelta(seconds=30))
+    assert 0 == tracker.pending()  # written within the interval
+    tracker.touch(user.id, now + dt.timedelta(seconds=63))
+    assert 1 == tracker.pending()
+    assert 1 == tracker.flush()
+
+
+def test_never_moves_backwards(tracker, user):
+    later = dt.datetime.utcnow() + dt.timedelta(hours=1)
+    user.update(last_seen=later)
+    tracker.touch(user.id)
+    tracker.flush()
+    assert later == last_seen(user.id)
+
+
+def test_failed_write_is_retried(tracker, user):
+    tracker.touch(user.id)
+    with patch.object(_db.engine, 'begin', side_effect=RuntimeError):
+        assert 0 == tracker.flush()
+    assert 1 == tracker.failures
+    assert 1 == tracker.pending()
+    assert 1 == tracker.flush()
+
+
+def test_flush_leaves_the_session_alone(tracker, user):
+    user.first_name = 'pending'
+    tracker.touch(user.id)
+    assert 1 == tracker.flush()
+    assert user in _db.session.dirty
+
+
+def test_forked_process_drops_the_marks(tracker, user):
+    tracker.touch(user.id)
+    tracker._pid = -1  # as if forked
+    tracker.touch(user.id + 1)
+    assert [user.id + 1] == list(tracker._seen)
+
+
+def test_requests_mark_the_user(tracker, app, user):
+    client = app.test_client()
+    client.get('/rest/v1.0/entitlements',
+               headers=basic_auth(user.username, 'myprecious'))
+    assert [user.id] == list(tracker._seen)
+    client.get('/about/')
+    assert 1 == tracker.pending()
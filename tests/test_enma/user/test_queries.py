@@ -0,0 +1,69 @@
+# -*- coding: utf-8 -*-
+"""Unit tests of the user listing queries."""
+import pytest
+
+from enma.public.domain import split_username
+from enma.user.models import Role
+from enma.user.queries import user_listing, filter_users, parse_flag, \
+    listing_row, projection, SORT_COLUMNS
+from tests.test_enma.factories import UserFactory
+
+
+@pytest.fixture
+def users(db):
+    Role.insert_roles()
+    admin = Role.query.filter_by(name='SiteAdmin').first()
+    users = [UserFactory(username='anna%local', active=True),
+             UserFactory(username='bob%google', active=False,
+                         email_validated=True, role=admin),
+             UserFactory(username='carl%go_gle', active=True)]
+    db.session.commit()
+    return users
+
+
+def usernames(query):
+    return sorted(row.username for row in query)
+
+
+def test_parse_flag():
+    assert parse_flag('Yes') is True
+    assert parse_flag('0') is False
+    assert parse_flag('') is None
+    assert parse_flag(None) is None
+    assert parse_flag('maybe') is None
+
+
+def test_split_username():
+    assert ('nick', 'google') == split_username('nick%google')
+    assert ('nick', 'not-set') == split_username('nick')
+
+
+def test_filter_users(users):
+    query = user_listing()
+    assert 3 == len(usernames(query))
+    assert ['bob%google'] == usernames(filter_users(query, active=False))
+    assert ['bob%google'] == usernames(filter_users(query, validated=True))
+    assert ['bob%google'] == usernames(filter_users(query, role='SiteAdmin'))
+    # LIKE wildcards in the provider match literally
+    assert ['bob%google'] == usernames(filter_users(query, provider='google'))
+    assert ['carl%go_gle'] == usernames(filter_users(query,
+                                                     provider='go_gle'))
+    assert [] == usernames(filter_users(query, provider='%'))
+
+
+def test_listing_row(users):
+    row = filter_users(user_listing(), role='SiteAdmin').one()
+    member = listing_row(row)
+    assert 'SiteAdmin' == member['role']
+    assert 'bob' == member['nickname']
+    assert 'google' == member['auth_provider']
+    assert users[1].full_name == member['full_name']
+    assert users[1].id == member['id']
+
+
+def test_projection_adds_id_and_sort_columns():
+    columns = projection(['full_name', 'role'], SORT_COLUMNS['created'])
+    assert ['id', 'created_at', 'first_name', 'last_name'] == \
+        [column.key for column in columns]
+    with pytest.raises(ValueError):
+        projection(['password'])